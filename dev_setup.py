@@ -1,5 +1,4 @@
 import os
-import re
 import shutil
 
 def create_env_folder():
@@ -12,25 +11,14 @@ def create_env_folder():
 
     return env_path
 
-def get_total_client_number():
-    matches = []
-    with open('docker-compose.yml') as file:
-        for line in file:
-            match = re.findall("(client\d.env|client\d\d.env)", line)
-            if len(match) == 1:
-                matches += match
-    return matches
-
-
-def write_files(api_key, env_path, total_clients, aws_access_key, aws_secret_access_key):
-    # Write client files
-    for i in range(1, len(total_clients) + 1):
-          with open("{}client{}.env".format(env_path, i), 'w') as file:
-            file.write("API_KEY={}".format(api_key) + "\n")
-            file.write("ID={}".format(i) + "\n")
-            file.write("PYTHONUNBUFFERED=TRUE\n")
-            file.write(f"AWS_ACCESS_KEY={aws_access_key}\n")
-            file.write(f"AWS_SECRET_ACCESS_KEY={aws_secret_access_key}")
+def write_files(api_key, env_path, aws_access_key, aws_secret_access_key):
+    # Write client file, more keys can be added to API_KEYS separated by commas
+    with open("{}client.env".format(env_path), 'w') as file:
+        file.write("API_KEYS={}".format(api_key) + "\n")
+        file.write("ID=1\n")
+        file.write("PYTHONUNBUFFERED=TRUE\n")
+        file.write(f"AWS_ACCESS_KEY={aws_access_key}\n")
+        file.write(f"AWS_SECRET_ACCESS_KEY={aws_secret_access_key}")
 
     # Write work generator file
     with open("{}work_gen.env".format(env_path), 'w') as file:
@@ -69,12 +57,11 @@ if __name__ == "__main__":
     aws_secret_access_key = input("Enter your AWS Secret Access Key: ")
 
     env_path = create_env_folder() 
-    total_clients = get_total_client_number()
 
     # Install all packages
     os.system("bash install_packages.sh")
 
-    write_files(api_key, env_path, total_clients, aws_access_key, aws_secret_access_key)
+    write_files(api_key, env_path, aws_access_key, aws_secret_access_key)
 
             
 
@@ -0,0 +1,117 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from mirrclient.client import FAILED_FETCH_DELAY, HANDLED_EXCEPTIONS, \
+    print_failure, client_from_environment, \
+    exit_if_environment_variables_missing, saves_flushed_on_exit
+from mirrcore.redis_check import load_redis
+from mirrcore.regulations_api import MIN_DELAY_BETWEEN_CALLS
+from mirrcore.rate_limiter import RateLimiter
+
+
+class AsyncClient:
+    """
+    Runs a Client on an asyncio event loop so that the steps of consecutive
+    jobs overlap. API calls are made one at a time and are spaced at
+    least `delay` seconds apart, while saving the results and downloading
+    the attachments of earlier jobs continues in the background.
+
+    The Client itself uses blocking libraries (requests, boto3, redis),
+    so each step runs in a thread pool and the event loop only schedules
+    them. Jobs are taken from the job queue on a thread of their own,
+    because the broker connection may only be used by one thread.
+
+    When the Client has a RateLimiter the API calls are paced by it and
+    `delay` can be 0. After a job could not be fetched the next one is
+    tried at least FAILED_FETCH_DELAY seconds later.
+
+    Attributes
+    ----------
+    client : Client
+        Performs the individual steps of a job
+    max_pending_saves : int
+        The number of fetched jobs that may be saving at the same time.
+        When this many saves are in flight the next API call waits.
+    delay : float
+        Minimum number of seconds between the start of two API calls
+    """
+    def __init__(self, client, max_pending_saves=4,
+                 delay=MIN_DELAY_BETWEEN_CALLS):
+        self.client = client
+        self.max_pending_saves = max_pending_saves
+        self.delay = delay
+        self.executor = ThreadPoolExecutor(max_workers=max_pending_saves + 1)
+        self.queue_executor = ThreadPoolExecutor(max_workers=1)
+        self.pending_saves = set()
+
+    async def run(self, max_jobs=None):
+        """
+        Fetches jobs until `max_jobs` API calls have been attempted
+        (forever if None), then waits for the remaining saves to finish.
+        """
+        loop = asyncio.get_running_loop()
+        save_slots = asyncio.Semaphore(self.max_pending_saves)
+        jobs_attempted = 0
+        while max_jobs is None or jobs_attempted < max_jobs:
+            started = loop.time()
+            delay = await self._attempt_job(loop, save_slots)
+            jobs_attempted += 1
+            elapsed = loop.time() - started
+            await asyncio.sleep(max(0, delay - elapsed))
+        await self.drain()
+
+    async def _attempt_job(self, loop, save_slots):
+        """
+        Fetches a job and starts saving it. Returns the seconds from the
+        start of the attempt until the next one.
+        """
+        await save_slots.acquire()
+        fetched = await self._fetch(loop)
+        if fetched is None:
+            save_slots.release()
+            return max(self.delay, FAILED_FETCH_DELAY)
+        self._start_save(loop, save_slots, fetched)
+        return self.delay
+
+    async def drain(self):
+        """
+        Waits for every save that is still in flight.
+        """
+        if self.pending_saves:
+            await asyncio.gather(*self.pending_saves)
+
+    async def _fetch(self, loop):
+        try:
+            job = await loop.run_in_executor(self.queue_executor,
+                                             self.client.take_job)
+            return job, await loop.run_in_executor(
+                self.executor, self.client.fetch_result, job)
+        except HANDLED_EXCEPTIONS as error:
+            print_failure(error)
+        return None
+
+    def _start_save(self, loop, save_slots, fetched):
+        task = loop.create_task(self._save(loop, *fetched))
+        self.pending_saves.add(task)
+
+        def _on_done(finished):
+            self.pending_saves.discard(finished)
+            save_slots.release()
+        task.add_done_callback(_on_done)
+
+    async def _save(self, loop, job, result):
+        try:
+            await loop.run_in_executor(self.executor, self.client.save_job,
+                                       job, result)
+        except HANDLED_EXCEPTIONS as error:
+            print_failure(error)
+
+
+if __name__ == '__main__':
+    exit_if_environment_variables_missing()
+    # load_redis blocks until the database has finished loading
+    database = load_redis()
+    job_client = client_from_environment(
+        database, RateLimiter(database, os.getenv('API_KEY')))
+    with saves_flushed_on_exit(job_client):
+        asyncio.run(AsyncClient(job_client, delay=0).run())
@@ -1,20 +1,42 @@
 import time
 import os
 import sys
+import signal
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 import redis
 from dotenv import load_dotenv
 from mirrclient.saver import Saver
+from mirrclient.retry_spool import RetrySpool, SPOOL_DIRECTORY
 from mirrclient.disk_saver import DiskSaver
 from mirrclient.s3_saver import S3Saver
+from mirrclient.shard_saver import build_packed_savers
+from mirrclient.write_behind_saver import JobSaves, WriteBehindSaver
+from mirrclient.group_sync import group_sync_from_environment
+from mirrclient.streaming import download_to_temp_file
 from mirrclient.exceptions import NoJobsAvailableException, APITimeoutException
 from mirrcore.redis_check import load_redis
 from mirrcore.path_generator import PathGenerator
 from mirrcore.job_queue import JobQueue
-from mirrcore.jobs_statistics import JobStatistics
+from mirrcore.manifest import Manifest
+from mirrcore.compression import get_compression
+from mirrcore.shards import is_packed
+from mirrcore.blob_store import BlobStore, uses_blob_store
+from mirrcore.rate_limiter import RateLimiter
+from mirrcore.http_session import get_session
 from mirrcore.job_queue_exceptions import JobQueueException
 from pika.exceptions import AMQPConnectionError
 
+# Most attachments of one comment that are downloaded at the same time
+MAX_ATTACHMENT_WORKERS = 8
+
+# Seconds the entry points wait after a job could not be fetched. API calls
+# are paced by a rate limiter or delay, this only avoids spinning while the
+# queue or Redis is unavailable.
+FAILED_FETCH_DELAY = 3.6
+
 
 def is_environment_variables_present():
     """
@@ -29,7 +51,96 @@ def is_environment_variables_present():
             and os.getenv('ID') is not None)
 
 
-class Client:
+def get_prefetch_count():
+    """
+    Returns the number of jobs the broker should push ahead to this
+    client, from the PREFETCH_COUNT environment variable (default 4).
+    0 means the client polls the job queue instead.
+    """
+    prefetch_count = int(os.getenv('PREFETCH_COUNT', '4'))
+    return prefetch_count if prefetch_count > 0 else None
+
+
+def is_permanent_failure(error):
+    """
+    Returns whether a job that failed with `error` would fail the same way
+    if it was tried again, because regulations.gov answered with a 4xx
+    status other than 429 Too Many Requests. Other failures, such as rate
+    limits, timeouts, connection errors and 5xx statuses, may pass.
+    """
+    if not isinstance(error, requests.exceptions.HTTPError) \
+            or error.response is None:
+        return False
+    status = error.response.status_code
+    return 400 <= status < 500 and status != 429
+
+
+def exit_if_environment_variables_missing():
+    """
+    Loads the client .env file and exits when the environment
+    variables needed for performing jobs are not present.
+    """
+    load_dotenv()
+    if not is_environment_variables_present():
+        print('Need client environment variables.')
+        sys.exit(1)
+
+
+def build_saver(manifest=None, compression=None, packed=False, blobs=False):
+    """
+    Returns the Saver used by the clients, which writes to disk and to the
+    mirrulations S3 bucket.
+
+    Parameters
+    ----------
+    manifest : Manifest
+        Records every file that is written. If None, nothing is recorded.
+    compression : str
+        The codec json and extracted text are compressed with, see
+        mirrcore.compression. If None, they are saved uncompressed.
+    packed : bool
+        Whether json is packed into per-docket shards, see
+        mirrclient.shard_saver
+    blobs : bool
+        Whether attachments are stored once per content, see
+        mirrcore.blob_store
+    """
+    if packed:
+        savers = build_packed_savers(manifest, compression)
+    else:
+        savers = [DiskSaver(manifest, compression),
+                  S3Saver(bucket_name="mirrulations", manifest=manifest,
+                          compression=compression)]
+    if blobs:
+        for saver in savers:
+            saver.blob_store = BlobStore()
+    return Saver(savers=savers)
+
+
+def saver_from_environment(manifest, job_queue=None):
+    """
+    Returns the Saver built with the storage options set by the
+    STORAGE_COMPRESSION, PACKED_STORAGE, BLOB_STORE, DISK_SYNC_FILES and
+    DISK_SYNC_MS environment variables. Its retry spool is kept in
+    SPOOL_DIRECTORY when the client stops, and the saves kept when it
+    last stopped are spooled again.
+    @param job_queue: if given, records the saves the spool drops in
+        invalid_jobs
+    """
+    saver = build_saver(manifest, get_compression(), is_packed(),
+                        uses_blob_store())
+    group_sync = group_sync_from_environment()
+    for disk_saver in saver.savers:
+        if isinstance(disk_saver, DiskSaver):
+            disk_saver.group_sync = group_sync
+    saver.spool = RetrySpool(directory=SPOOL_DIRECTORY)
+    if job_queue is not None:
+        saver.spool.on_dropped = job_queue.record_dropped_save
+    saver.spool.load(saver.savers)
+    return saver
+
+
+class Client:  # pylint: disable=too-many-instance-attributes
     """
     The Client class gets a job directly from the job queue.
     It receives a job, performs it depending on the job type.
@@ -49,21 +160,29 @@ class Client:
         Handles the making of directories and the saving of files either
         to disk or Amazon s3.
     redis : redis_server
-        Allows for a direct connection to the Redis server, incrementing the
-        jobs completed.
+        Allows for a direct connection to the Redis server, checking that
+        it is up and recording invalid jobs.
     job_queue : JobQueue
         Queue of all of the jobs that need to be completed. The client will
-        directly pull jobs from this queue.
+        directly pull jobs from this queue, and the queue records which
+        jobs are in progress and done.
+    rate_limiter : RateLimiter
+        Token bucket shared by every process using the same api key.
+        A token is taken before each API call and the rate limit headers
+        of the response are passed back. If None, calls are not paced.
+    key_pool : KeyPool
+        When set, each API call is made with whichever of the pool's
+        keys has a token, instead of with api_key and rate_limiter.
     """
-    def __init__(self, redis_server, job_queue):
+    def __init__(self, redis_server, job_queue, rate_limiter=None):
         self.api_key = os.getenv('API_KEY')
         self.client_id = os.getenv('ID')
         self.path_generator = PathGenerator()
-        self.saver = Saver(savers=[DiskSaver(),
-                                   S3Saver(bucket_name="mirrulations")])
+        self.saver = build_saver()
         self.redis = redis_server
         self.job_queue = job_queue
-        self.cache = JobStatistics(redis_server)
+        self.rate_limiter = rate_limiter
+        self.key_pool = None
 
     def _can_connect_to_database(self):
         try:
@@ -75,6 +194,18 @@ class Client:
     def _get_job_from_job_queue(self):
         print('Attempting to get job')
 
+        # Jobs pushed by the broker need no polling round trips
+        if self.job_queue.prefetch_count is None:
+            self._check_job_queue_has_jobs()
+
+        job = self.job_queue.lease_job(self.client_id)
+        if job is None:
+            raise NoJobsAvailableException
+        print('Job received from job queue')
+
+        return job
+
+    def _check_job_queue_has_jobs(self):
         if not self._can_connect_to_database():
             # temporary, ideally we should get
             # rid of _can_connect_to_database() altogether
@@ -83,11 +214,6 @@ class Client:
         if self.job_queue.get_num_jobs() == 0:
             raise NoJobsAvailableException
 
-        job = self.job_queue.get_job()
-        print('Job received from job queue')
-
-        return job
-
     def _set_default_key(self, job, key, default_value):
         if key not in job:
             job[key] = default_value
@@ -98,17 +224,13 @@ class Client:
         self._set_default_key(job, 'agency', 'other_agency')
         return job
 
-    def _set_redis_values(self, job):
-        self.redis.hset('jobs_in_progress', job['job_id'], job['url'])
-        self.redis.hset('client_jobs', job['job_id'], self.client_id)
-
     def _remove_plural_from_job_type(self, job):
         split_url = str(job['url']).split('/')
         job_type = split_url[-2][:-1]  # Removes plural from job type
         type_id = split_url[-1]
         return f'{job_type}/{type_id}'
 
-    def _get_job(self):
+    def take_job(self):
         """
         Get a job from the JobQueue.
         Converts API URL to regulations.gov URL and prints to logs.
@@ -122,11 +244,6 @@ class Client:
 
         job = self._set_missing_job_key_defaults(job)
 
-        self._set_redis_values(job)
-
-        # update count for dashboard
-        self.job_queue.decrement_count(job['job_type'])
-
         print(f'Job received: {job["job_type"]}'
               + f' for client: {self.client_id}')
 
@@ -135,7 +252,7 @@ class Client:
 
         return job
 
-    def _download_job(self, job, job_result):
+    def _download_job(self, job, job_result, saver):
         """
         Downloads the current job and saves the data using the Saver. Downloads
         the attachments if there are any.
@@ -152,6 +269,13 @@ class Client:
             information about the job being completed
         job_result : dict
             results from a performed job
+        saver : JobSaves
+            keeps the saves of the job
+
+        Returns
+        -------
+        list
+            the urls of the attachments that were downloaded
         """
         data = {
             'job_type': job['job_type'],
@@ -162,21 +286,23 @@ class Client:
         }
         print(f'Downloading Job {job["job_id"]}')
         data['directory'] = self.path_generator.get_path(job_result)
-        self.cache.increase_jobs_done(data['job_type'])
 
-        self._put_results(data)
+        self._put_results(data, saver)
 
         comment_has_attachment = self._does_comment_have_attachment(job_result)
         json_has_file_format = self._document_has_file_formats(job_result)
 
         if data["job_type"] == "comments" and comment_has_attachment:
-            self._download_all_attachments_from_comment(job_result)
+            return self._download_all_attachments_from_comment(job_result,
+                                                               saver)
         if data["job_type"] == "documents" and json_has_file_format:
             document_htm = self._get_document_htm(job_result)
             if document_htm is not None:
-                self._download_htm(job_result)
+                self._download_htm(job_result, saver)
+                return [document_htm]
+        return []
 
-    def _put_results(self, data):
+    def _put_results(self, data, saver):
         """
         Ensures data format matches expected format
         If results are valid, writes them to disk
@@ -185,9 +311,11 @@ class Client:
         ----------
         data : dict
             the results from a performed job
+        saver : JobSaves
+            keeps the saves of the job
         """
         dir_, filename = data['directory'].rsplit('/', 1)
-        self.saver.save_json(f'/data{dir_}/{filename}', data)
+        saver.save_json(f'/data{dir_}/{filename}', data)
 
     def _perform_job(self, job_url):
         """
@@ -204,17 +332,36 @@ class Client:
         dict
             json results of the performed job
         """
+        api_key = self._acquire_api_key()
         try:
             delimiter = '&' if '?' in job_url else '?'
-            url = f'{job_url}{delimiter}api_key={self.api_key}'
+            url = f'{job_url}{delimiter}api_key={api_key}'
 
-            return requests.get(url, timeout=10)
+            response = get_session().get(url, timeout=10)
         except requests.exceptions.ReadTimeout as exc:
             raise APITimeoutException from exc
+        if self.key_pool is not None:
+            self.key_pool.update(api_key, response)
+        elif self.rate_limiter is not None:
+            self.rate_limiter.update(response)
+        return response
+
+    def _acquire_api_key(self):
+        """
+        Waits until an API call may be made and returns the key to use.
+        """
+        if self.key_pool is not None:
+            return self.key_pool.acquire()
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return self.api_key
 
-    def _download_all_attachments_from_comment(self, comment_json):
+    def _download_all_attachments_from_comment(self, comment_json, saver):
         '''
-        Downloads all attachments for a comment
+        Downloads all attachments for a comment.
+        The attachments are downloaded at the same time by up to
+        MAX_ATTACHMENT_WORKERS threads, so a comment takes about as long
+        as its slowest attachment.
 
         Parameters
         ----------
@@ -225,30 +372,51 @@ class Client:
         comment_json : dict
             The json of the comment
 
+        saver : JobSaves
+            Keeps the saves of the job
+
+        Returns
+        -------
+        list
+            the urls of the downloaded attachments
         '''
 
         path_list = self.path_generator.get_attachment_json_paths(comment_json)
-        counter = 0
-        comment_id_str = f"Comment - {comment_json['data']['id']}"
-        print(f"Found {len(path_list)} attachment(s) for {comment_id_str}")
+        print(f"Found {len(path_list)} attachment(s) for "
+              f"Comment - {comment_json['data']['id']}")
+        if not path_list:
+            return []
+        with ThreadPoolExecutor(max_workers=min(
+                len(path_list), MAX_ATTACHMENT_WORKERS)) as executor:
+            downloads = {
+                executor.submit(self._download_single_attachment, url, path,
+                                saver):
+                url for url, path in zip(
+                    self._get_attachment_urls(comment_json), path_list)}
+            for count, download in enumerate(as_completed(downloads), 1):
+                download.result()
+                print(f"Downloaded {count}/{len(path_list)} attachment(s) "
+                      f"for Comment - {comment_json['data']['id']}")
+        return list(downloads.values())
+
+    def _get_attachment_urls(self, comment_json):
+        '''
+        Returns the download urls of a comment's attachments, in the same
+        order as PathGenerator.get_attachment_json_paths returns their paths
+        '''
+        urls = []
         for included in comment_json["included"]:
-            if (included["attributes"]["fileFormats"] and
-                    included["attributes"]["fileFormats"]
-                    not in ["null", None]):
-                for attachment in included['attributes']['fileFormats']:
-                    url = attachment["fileUrl"]
-                    self._download_single_attachment(url,
-                                                     path_list[counter])
-                    print(f"Downloaded {counter+1}/{len(path_list)} "
-                          f"attachment(s) for {comment_id_str}")
-                    counter += 1
-                    self.cache.increase_jobs_done('attachment',
-                                                  url.endswith('.pdf'))
-
-    def _download_single_attachment(self, url, path):
+            file_formats = included["attributes"]["fileFormats"]
+            if file_formats and file_formats not in ["null", None]:
+                urls.extend(attachment["fileUrl"]
+                            for attachment in file_formats)
+        return urls
+
+    def _download_single_attachment(self, url, path, saver):
         '''
         Downloads a single attachment for a comment and
-        writes it to its correct path
+        writes it to its correct path. The download is streamed to a
+        temporary file so large attachments are never held in memory.
 
         Parameters
         ----------
@@ -260,15 +428,13 @@ class Client:
             The attachment path the download should be written to
             Comes from the path_generator.get_attachment_json_paths
 
-        data : dict
-            Dictionary of the job
-            Keys include: 'job_type', 'job_id', 'results', 'reg_id', 'agency'
+        saver : JobSaves
+            Keeps the saves of the job
 
         '''
-        response = requests.get(url, timeout=10)
         dir_, filename = path.rsplit('/', 1)
-        self.saver.save_binary(f'/data{dir_}/{filename}', response.content)
-        filename = path.split('/')[-1]
+        with download_to_temp_file(url) as temp_path:
+            saver.save_binary_file(f'/data{dir_}/{filename}', temp_path)
 
     def _does_comment_have_attachment(self, comment_json):
         """
@@ -284,23 +450,24 @@ class Client:
             return True
         return False
 
-    def _download_htm(self, json):
+    def _download_htm(self, json, saver):
         """
         Attempts to download an HTM and saves it to its correct path
         Parameters
         ----------
         json : dict
             The json of a document
+        saver : JobSaves
+            Keeps the saves of the job
         """
         url = self._get_document_htm(json)
         path = self.path_generator.get_document_htm_path(json)
         if url is not None:
-            response = requests.get(url, timeout=10)
             dir_, filename = path.rsplit('/', 1)
-            self.saver.save_binary(f'/data{dir_}/{filename}',
-                                   response.content)
+            with download_to_temp_file(url) as temp_path:
+                saver.save_binary_file(f'/data{dir_}/{filename}',
+                                       temp_path)
             print(f"SAVED document HTM - {url} to path: ", path)
-            self.cache.increase_jobs_done('attachment')
 
     def _get_document_htm(self, json):
         """
@@ -335,69 +502,175 @@ class Client:
             return False
         return True
 
-    def _report_bad_job(self, job):
-        self.redis.hdel('jobs_in_progress', job['job_id'])
-        self.redis.hset('invalid_jobs', job['job_id'], job['url'])
+    def _handle_failed_job(self, job, error):
+        """
+        Records a job that failed in invalid_jobs if it would fail again,
+        and otherwise has it queued again by the lease reaper. If Redis is
+        down the lease expires and the reaper queues it again later.
+        """
+        try:
+            if is_permanent_failure(error):
+                self.job_queue.fail_job(job)
+            else:
+                self.job_queue.retry_job(job)
+        except redis.exceptions.ConnectionError:
+            print("FAILURE: Couldn't save bad job to Redis.")
 
-    def job_operation(self):
+    def fetch_job(self):
         """
-        Processes a job.
-        The Client gets the job from the job queue, performs the job
-        based on job_type, then saves the job results using the saver class.
+        Gets a job from the job queue and performs the API call for it.
+        This is the only part of processing a job that uses the API key.
+
+        Returns
+        -------
+        tuple
+            the job and the json results of the performed job
         """
         print('Processing job from RabbitMQ.')
 
-        job = self._get_job()
+        job = self.take_job()
+        return job, self.fetch_result(job)
 
+    def fetch_result(self, job):
+        """
+        Performs the API call for a job that has been taken from the
+        job queue.
+
+        Parameters
+        ----------
+        job : dict
+            information about the job being performed
+
+        Returns
+        -------
+        dict
+            the json results of the performed job
+        """
         try:
             print('Performing job.')
 
             response = self._perform_job(job['url'])
             response.raise_for_status()
-            result = response.json()
+            return response.json()
+        except Exception as error:
+            self._handle_failed_job(job, error)
+            raise
 
-            self._download_job(job, result)
-        except Exception as exc:
-            try:
-                self._report_bad_job(job)
-            except redis.exceptions.ConnectionError:
-                print("FAILURE: Couldn't save bad job to Redis.")
+    def save_job(self, job, result):
+        """
+        Saves the results of a fetched job and downloads its attachments.
+        The job is completed, and its lease ended, once every save was
+        written, and only then is it printed as a success. With a
+        WriteBehindSaver that is after this returns, and a save that could
+        not be written fails the job instead.
 
-            # re-raise whatever exception was being thrown
-            raise exc
+        Parameters
+        ----------
+        job : dict
+            information about the job being completed
+        result : dict
+            json results of the performed job
+        """
+        saves = JobSaves(self.saver)
+        try:
+            attachment_urls = self._download_job(job, result, saves)
+        except Exception as error:
+            self._handle_failed_job(job, error)
+            raise
+        pdf_urls = [url for url in attachment_urls if url.endswith('.pdf')]
+        saves.when_written(
+            partial(self._complete_job, job, len(attachment_urls),
+                    len(pdf_urls)),
+            partial(self._handle_failed_job, job))
+
+    def _complete_job(self, job, num_attachments, num_pdfs):
+        self.job_queue.complete_job(job, num_attachments, num_pdfs)
+        print(f'SUCCESS: {job["url"]} complete.')
 
+    def job_operation(self):
+        """
+        Processes a job.
+        The Client gets the job from the job queue, performs the job
+        based on job_type, then saves the job results using the saver class.
+        """
+        job, result = self.fetch_job()
+        self.save_job(job, result)
         return job
 
 
+FAILURE_MESSAGES = {
+    redis.exceptions.ConnectionError: 'FAILURE: Could not connect to Redis.',
+    NoJobsAvailableException: 'FAILURE: No Jobs Available.',
+    APITimeoutException: 'FAILURE: Request to API timed out.',
+    JobQueueException: 'The Job Queue is down.',
+    AMQPConnectionError: 'RabbitMQ is still loading'
+}
+
+# Exceptions that end a single job without stopping the client
+HANDLED_EXCEPTIONS = (requests.exceptions.HTTPError, *FAILURE_MESSAGES)
+
+
+def print_failure(error):
+    """
+    Prints the log message for an exception raised while processing a job.
+
+    Parameters
+    ----------
+    error : Exception
+        one of the HANDLED_EXCEPTIONS
+    """
+    if isinstance(error, requests.exceptions.HTTPError):
+        print(f"FAILURE: HTTP error\
+              {error.response.status_code} occurred: {error}")
+        return
+    for exception_type, message in FAILURE_MESSAGES.items():
+        if isinstance(error, exception_type):
+            print(message)
+            return
+
+
+def client_from_environment(database, rate_limiter=None):
+    """
+    Returns the Client run by the entry points. It leases jobs from the
+    job queue in `database`, and writes its results in the background,
+    while the next job is fetched, with the saver set by the environment.
+    @param rate_limiter: paces the API calls of a client with one key
+    """
+    job_queue = JobQueue(database, get_prefetch_count())
+    client = Client(database, job_queue, rate_limiter)
+    client.saver = WriteBehindSaver(
+        saver_from_environment(Manifest(), job_queue))
+    return client
+
+
+@contextmanager
+def saves_flushed_on_exit(client):
+    """
+    Flushes the client's queued saves when the block exits. Stopping the
+    container exits normally, so they are flushed then too.
+    """
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        yield client
+    finally:
+        client.saver.close()
+
+
 if __name__ == '__main__':
-    load_dotenv()
-    if not is_environment_variables_present():
-        print('Need client environment variables.')
-        sys.exit(1)
+    exit_if_environment_variables_missing()
 
     try:
         redis_client = load_redis()
     except redis.exceptions.ConnectionError:
         print('There is no Redis database to connect to.')
         sys.exit(1)
-    client = Client(redis_client, JobQueue(redis_client))
+    job_client = client_from_environment(
+        redis_client, RateLimiter(redis_client, os.getenv('API_KEY')))
 
-    while True:
-        try:
-            job_ = client.job_operation()
-            print(f'SUCCESS: {job_["url"]} complete.')
-        except redis.exceptions.ConnectionError:
-            print('FAILURE: Could not connect to Redis.')
-        except NoJobsAvailableException:
-            print('FAILURE: No Jobs Available.')
-        except APITimeoutException:
-            print('FAILURE: Request to API timed out.')
-        except requests.exceptions.HTTPError as err:
-            print(f"FAILURE: HTTP error\
-                  {err.response.status_code} occurred: {err}")
-        except JobQueueException:
-            print("The Job Queue is down.")
-        except AMQPConnectionError:
-            print("RabbitMQ is still loading")
-
-        time.sleep(3.6)
+    with saves_flushed_on_exit(job_client):
+        while True:
+            try:
+                job_client.job_operation()
+            except HANDLED_EXCEPTIONS as error:
+                print_failure(error)
+                time.sleep(FAILED_FETCH_DELAY)
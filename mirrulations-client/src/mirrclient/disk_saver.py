@@ -1,8 +1,67 @@
+import hashlib
 import os
-from json import dumps, load
+import shutil
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from functools import partial
+from json import dumps
+from mirrcore.blob_store import file_digest
+from mirrcore.compression import compress, read_json
+from mirrcore.manifest import item_details
+from mirrcore.shards import truncate_partial_line
+from mirrcore.temp_paths import temp_path_for
 
+# Appended to the path of a saved json to name the file listing the digest
+# of every version of it, one per line. Not written once the manifest is
+# complete, since it records the digest of every version.
+DIGEST_SUFFIX = '.sha256'
 
-class DiskSaver():
+
+def json_digest(data):
+    """
+    Returns the sha256 digest of json data. Keys are sorted first, so
+    data that compares equal has the same digest.
+    """
+    return hashlib.sha256(
+        dumps(data, sort_keys=True).encode('utf8')).hexdigest()
+
+
+def versioned_path(path, i):
+    """
+    Returns the path of version `i` of a json file,
+    Ex: /data/file.json -> /data/file(1).json
+    """
+    return f'{os.path.splitext(path)[0]}({i}).json'
+
+
+class DiskSaver():  # pylint: disable=too-many-public-methods
+
+    def __init__(self, manifest=None, compression=None):
+        """
+        Parameters
+        ----------
+        manifest : Manifest
+            Records every file that is written. If None, nothing is
+            recorded. Once it has recorded every file saved before it
+            existed, save_json() asks it whether json was saved instead
+            of the file system.
+        compression : str
+            The codec json and extracted text are compressed with,
+            Ex: 'gzip'. Files keep their names. If None, they are saved
+            uncompressed.
+        """
+        self.manifest = manifest
+        self.manifest_complete = False
+        self.compression = compression
+        # Set to a BlobStore to keep one copy of identical attachments
+        self.blob_store = None
+        # Set to a GroupSync to flush written files to the disk in groups
+        self.group_sync = None
+        # Files waiting to be moved into place, by the path _exists()
+        # waits for them at
+        self.unpublished = Counter()
+        self.unpublished_lock = threading.Lock()
 
     def make_path(self, _dir):
         try:
@@ -10,14 +69,36 @@ class DiskSaver():
         except FileExistsError:
             print(f'Directory already exists in root: /data{_dir}')
 
-    def save_to_disk(self, path, data):
-        with open(path, 'x', encoding='utf8') as file:
-            file.write(dumps(data))
-            print(f'Wrote json to Disk: {path}')
+    def save_to_disk(self, path, data, key=None, on_saved=None):
+        """
+        Writes json to a new file at path, and raises FileExistsError if
+        there is a file there.
+        @param key: the path whose _exists() waits for this file, path
+            if None
+        @param on_saved: called once the file is in place
+        """
+        body = self._encode(dumps(data))
+        published = self._write_bytes(
+            path, body, exclusive=True, key=key,
+            on_published=partial(self._saved_json, path, len(body), data,
+                                 on_saved))
+        print(f'Wrote json to Disk: {path}')
+        return published
+
+    def _saved_json(self, path, size, data, on_saved):
+        if self.manifest is not None:
+            self.manifest.record(path, size=size, digest=json_digest(data),
+                                 **item_details(data))
+        if on_saved is not None:
+            on_saved()
 
     def save_json(self, path, data):
         """
         writes the results to disk. used by docket document and comment jobs
+        If json was saved at the path, the digest of the data is looked up
+        among the digests of its versions, see read_digests(). Data that
+        was saved before is skipped and new data is saved as the next
+        version, Ex: file(1).json.
         Parameters
         ----------
         data : dict
@@ -26,47 +107,327 @@ class DiskSaver():
         _dir = path.rsplit('/', 1)[0]
         self.make_path(_dir)
         data = data['results']
-        if os.path.exists(path) is False:
-            self.save_to_disk(path, data)
-        else:
-            self.check_for_duplicates(path, data, 1)
-
-    def save_duplicate_json(self, path, data, i):
-        path_without_file_type = path.strip(".json")
-        path = f'{path_without_file_type}({i}).json'
-        if os.path.exists(path) is False:
-            print(f'JSON is different than duplicate: Labeling ({i})')
-            self.save_to_disk(path, data)
-        else:
-            self.check_for_duplicates(path, data, i + 1)
+        digest = json_digest(data)
+        # The digest is listed once the file is in place, unless the
+        # manifest records it
+        add_digest = None if self._has_complete_manifest() else \
+            partial(self._add_digest, path, digest)
+        if not self._is_saved(path):
+            try:
+                return self.save_to_disk(path, data, on_saved=add_digest)
+            except FileExistsError:
+                # Saved by another writer, or before the manifest lost
+                # its latest records in a power failure
+                pass
+        digests = self.read_digests(path)
+        if self.is_duplicate(digests, digest):
+            return None
+        return self.save_duplicate_json(path, data, len(digests), add_digest)
+
+    def save_duplicate_json(self, path, data, i, on_saved=None):
+        print(f'JSON is different than duplicate: Labeling ({i})')
+        return self.save_to_disk(versioned_path(path, i), data, key=path,
+                                 on_saved=on_saved)
+
+    def _add_digest(self, path, digest):
+        # Written in one call to a file opened for appending, so a kill
+        # leaves at most a last line without its newline, which
+        # read_digests() removes
+        descriptor = os.open(f'{path}{DIGEST_SUFFIX}',
+                             os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(descriptor, f'{digest}\n'.encode('utf8'))
+        finally:
+            os.close(descriptor)
+
+    def read_digests(self, path):
+        """
+        Returns the digests of every version of the json at `path`.
+        With a complete manifest they are the digests it recorded.
+        Otherwise they are read from the path's digest file. Files saved
+        before digest files were kept have their digest file written the
+        first time they are read, and versions the digest file does not
+        list, because the process was killed after saving them and before
+        adding their digest, are added to it.
+        """
+        if self._has_complete_manifest():
+            return self._recorded_digests(path)
+        digest_path = f'{path}{DIGEST_SUFFIX}'
+        if not os.path.exists(digest_path):
+            for digest in self._digests_of_saved_versions(path):
+                self._add_digest(path, digest)
+        truncate_partial_line(digest_path)
+        with open(digest_path, encoding='utf8') as file:
+            digests = file.read().split()
+        for digest in self._digests_of_unlisted_versions(path, digests):
+            self._add_digest(path, digest)
+            digests.append(digest)
+        return digests
+
+    def _recorded_digests(self, path):
+        # The digest of each version the manifest recorded. Versions
+        # recorded by Manifest.rebuild(), which reads no json, or whose
+        # record was lost, are read from their file.
+        digests = []
+        version_path = path
+        details = self.manifest.get(version_path)
+        while details is not None or os.path.exists(version_path):
+            if details is None or details['digest'] is None:
+                digests.append(
+                    json_digest(self.open_json_file(version_path)))
+            else:
+                digests.append(details['digest'])
+            version_path = versioned_path(path, len(digests))
+            details = self.manifest.get(version_path)
+        return digests
+
+    def _digests_of_unlisted_versions(self, path, digests):
+        # Returns the digests of the versions saved after the ones listed
+        unlisted = []
+        version_path = path if not digests else \
+            versioned_path(path, len(digests))
+        while os.path.exists(version_path):
+            unlisted.append(json_digest(self.open_json_file(version_path)))
+            version_path = versioned_path(path, len(digests) + len(unlisted))
+        return unlisted
+
+    def _digests_of_saved_versions(self, path):
+        """
+        Opens every saved version of the json at `path` and returns their
+        digests. Versions used to be named by appending (i) to the name of
+        the previous version, Ex: file.json, file(1).json, file(1)(2).json.
+        """
+        digests = []
+        version_path = path
+        i = 1
+        while os.path.exists(version_path):
+            digests.append(json_digest(self.open_json_file(version_path)))
+            version_path = versioned_path(version_path, i)
+            i += 1
+        return digests
 
     def save_binary(self, path, data):
         _dir = path.rsplit('/', 1)[0]
         self.make_path(_dir)
-        with open(path, "wb") as file:
-            file.write(data)
-            file.close()
+        published = self._write_bytes(
+            path, data, on_published=partial(self._record, path))
+        print(f'Wrote binary to Disk: {path}')
+        return published
+
+    def save_binary_file(self, path, file_path):
+        """
+        Copies a downloaded file to its path on disk.
+        The file is copied in chunks so memory use does not depend on
+        the size of the file. With a blob store, the file is stored once
+        per content and its path is linked to the stored copy.
+        Parameters
+        ----------
+        path : str
+            where the file should be saved
+        file_path : str
+            the temporary file holding the download
+        Returns
+        -------
+        Future
+            done once the file is in place, see _write_atomically(), or
+            None if it was linked to a blob that was already stored
+        """
+        self.make_path(path.rsplit('/', 1)[0])
+
+        def copy(temp_path):
+            shutil.copyfile(file_path, temp_path)
+
+        if self.blob_store is None:
+            published = self._write_atomically(
+                path, copy, on_published=partial(self._record, path))
             print(f'Wrote binary to Disk: {path}')
+            return published
+        digest = file_digest(file_path)
+        blob_path = self.blob_store.path(digest)
+        link = partial(self._link_to_blob, blob_path, path, digest)
+        if self._exists(blob_path):
+            link()
+            return None
+        # The path is linked once the blob is in place
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        return self._write_atomically(blob_path, copy, on_published=link)
+
+    def _link_to_blob(self, blob_path, path, digest):
+        self.blob_store.link(blob_path, path)
+        self._written(path)
+        print(f'Linked binary to blob on Disk: {path}')
+        self._record(path, digest=digest)
 
     def save_text(self, path, data):
         _dir = path.rsplit('/', 1)[0]
         self.make_path(_dir)
-        with open(path, "w", encoding="utf-8") as file:
-            file.write(data)
-            file.close()
-            print(f'Wrote extracted text to Disk: {path}')
+        body = self._encode(data)
+        published = self._write_bytes(
+            path, body, on_published=partial(self._record, path))
+        print(f'Wrote extracted text to Disk: {path}')
+        return published
+
+    def _encode(self, text):
+        if self.compression is None:
+            return text.encode('utf8')
+        return compress(text, self.compression)
+
+    def _write_bytes(self, path, body, **options):
+        return self._write_atomically(
+            path, lambda temp_path: _write_body(temp_path, body), **options)
+
+    # pylint: disable=too-many-arguments
+    def _write_atomically(self, path, write, exclusive=False,
+                          on_published=None, key=None):
+        """
+        Calls write() with a temporary path beside path, then moves the
+        temporary file to path and calls on_published(). A process killed
+        part way through leaves a hidden temporary file, never a truncated
+        file at path.
+
+        With a group sync, the file is moved once its group was flushed
+        to the disk, so a power failure never leaves a file at path whose
+        data was not written. Until then _exists(key) flushes the group
+        first, key being path if None.
+
+        With exclusive, FileExistsError is raised if path exists. The
+        group of an exclusive write is flushed before this returns, so
+        that the caller can save the data elsewhere instead.
+
+        @return a Future done once the file is in place and
+            on_published() returned, with path or the error raised
+        """
+        temp_path = temp_path_for(path)
+        try:
+            write(temp_path)
+        except BaseException:
+            _remove(temp_path)
+            raise
+        return self._publish_when_flushed(temp_path, path, exclusive,
+                                          on_published,
+                                          path if key is None else key)
+
+    def _publish_when_flushed(self, temp_path, path, exclusive,
+                              on_published, key):
+        # Publishes the written temporary file, once its group was
+        # flushed with a group sync
+        with self.unpublished_lock:
+            self.unpublished[key] += 1
+        published = Future()
+        publish = partial(self._publish,
+                          partial(self._move, temp_path, path, exclusive, key),
+                          on_published, published)
+        if self.group_sync is None:
+            publish()
+        else:
+            self.group_sync.add(temp_path, publish)
+            if not exclusive:
+                return published
+            self.group_sync.sync()
+        # Raises the error of a file that was moved, or not, on this thread
+        published.result()
+        return published
+
+    def _publish(self, move, on_published, published):
+        # Returns the path move() moved the file to, or None if it could
+        # not. Errors are passed to published instead of raised.
+        try:
+            path = move()
+        except OSError as error:
+            published.set_exception(error)
+            return None
+        try:
+            if on_published is not None:
+                on_published()
+        except Exception as error:  # pylint: disable=broad-except
+            published.set_exception(error)
+            return path
+        published.set_result(path)
+        return path
+
+    def _move(self, temp_path, path, exclusive, key):
+        try:
+            if exclusive:
+                # Linking fails if path exists, even if another writer
+                # created it after the file was written, so it is never
+                # overwritten. The temporary name is removed below.
+                os.link(temp_path, path)
+            else:
+                os.replace(temp_path, path)
+        finally:
+            _remove(temp_path)
+            with self.unpublished_lock:
+                self.unpublished[key] -= 1
+                if not self.unpublished[key]:
+                    del self.unpublished[key]
+        return path
+
+    def _exists(self, path):
+        """
+        Returns whether there is a file at path, once the files waiting
+        to be moved there were flushed.
+        """
+        self._flush_waiting(path)
+        return os.path.exists(path)
+
+    def _is_saved(self, path):
+        """
+        Returns whether json was saved at path, asking the manifest
+        instead of the file system once it is complete.
+        """
+        if not self._has_complete_manifest():
+            return self._exists(path)
+        self._flush_waiting(path)
+        return self.manifest.has_path(path)
+
+    def _has_complete_manifest(self):
+        # Asked until it is complete, since the manifest may be rebuilt
+        # while the client runs
+        if not self.manifest_complete and self.manifest is not None:
+            self.manifest_complete = self.manifest.is_complete()
+        return self.manifest_complete
+
+    def _flush_waiting(self, path):
+        with self.unpublished_lock:
+            waiting = path in self.unpublished
+        if waiting:
+            self.group_sync.sync()
+
+    def close(self):
+        """
+        Flushes the files waiting to be moved into place.
+        """
+        if self.group_sync is not None:
+            self.group_sync.sync()
+
+    def _written(self, path):
+        # A file already in place, such as a shard that was appended to
+        if self.group_sync is not None:
+            self.group_sync.add(path)
+
+    def _record(self, path, **details):
+        if self.manifest is not None:
+            self.manifest.record(path, size=os.path.getsize(path), **details)
 
     def open_json_file(self, path):
-        with open(path, encoding='utf8') as file:
-            saved_data = load(file)
-        return saved_data
+        """
+        Returns the json saved at path, decompressing it if it was
+        saved compressed.
+        """
+        return read_json(path)
 
-    def is_duplicate(self, existing, new):
-        if existing == new:
+    def is_duplicate(self, digests, digest):
+        if digest in digests:
             print('Data is a duplicate, skipping this download')
             return True
         return False
 
-    def check_for_duplicates(self, path, data, i):
-        if self.is_duplicate(self.open_json_file(path), data) is False:
-            self.save_duplicate_json(path, data, i)
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _write_body(path, body):
+    with open(path, 'wb') as file:
+        file.write(body)
@@ -0,0 +1,147 @@
+import atexit
+import os
+import threading
+
+
+def group_sync_from_environment():
+    """
+    Returns a GroupSync flushing after every DISK_SYNC_FILES files or
+    DISK_SYNC_MS milliseconds, or None when neither is set, in which case
+    written files are left for the operating system to flush.
+    """
+    max_files = int(os.getenv('DISK_SYNC_FILES', '0'))
+    max_delay_ms = int(os.getenv('DISK_SYNC_MS', '0'))
+    if max_files <= 0 and max_delay_ms <= 0:
+        return None
+    return GroupSync(max_files, max_delay_ms)
+
+
+class GroupSync:
+    """
+    Flushes the files written by a DiskSaver to the disk in groups, so
+    that a power failure loses at most the files written since the last
+    flush without paying for an fsync per file.
+
+    A file written under a temporary name is added with the function
+    that moves it into place, which is called only once its data has
+    been flushed, so a power failure never leaves a file at its final
+    path whose data was not written. A file that is appended to in place
+    is added without one.
+
+    A flush fsyncs each file added since the previous one, moves the
+    temporary files into place, then fsyncs each directory the files are
+    in, so only this saver's files are flushed and not every dirty page
+    on the host. It is made once `max_files` files have been added,
+    every `max_delay_ms` milliseconds on a background thread, and when
+    the process exits. Files are added while a flush runs, and go into
+    the next one.
+
+    Attributes
+    ----------
+    pending : list
+        (path, publish) of the files added since the last flush, publish
+        being None for a file that is already in place
+    """
+
+    def __init__(self, max_files=0, max_delay_ms=0):
+        """
+        Parameters
+        ----------
+        max_files : int
+            Files written between flushes, 0 for no limit
+        max_delay_ms : int
+            Milliseconds between flushes, 0 for no limit
+        """
+        self.max_files = max_files
+        self.max_delay = max_delay_ms / 1000
+        self.pending = []
+        self.lock = threading.Lock()
+        # Held for a whole flush, so sync() returns only once the files
+        # added before it are in place, even if another thread took them
+        self.flush_lock = threading.RLock()
+        self.closed = threading.Event()
+        if self.max_delay > 0:
+            threading.Thread(target=self._sync_periodically,
+                             daemon=True).start()
+        atexit.register(self.close)
+
+    def add(self, path, publish=None):
+        """
+        Records a file that was written, and flushes if one is due.
+        @param path: the file, Ex: /data/USTR/.../USTR-2015-0010-0002.json
+        @param publish: if given, path is a temporary file and publish()
+            moves it into place and returns the path it was moved to, or
+            None if it could not be moved
+        """
+        with self.lock:
+            self.pending.append((path, publish))
+            if not 0 < self.max_files <= len(self.pending):
+                return
+        self.sync()
+
+    def sync(self):
+        """
+        Flushes the files added since the last flush, and moves the
+        temporary ones into place.
+        """
+        with self.flush_lock:
+            with self.lock:
+                files, self.pending = self.pending, []
+            if not files:
+                return
+            try:
+                for path in dict.fromkeys(path for path, _ in files):
+                    _fsync(path)
+            except OSError:
+                # Nothing was moved, so they are flushed with the next group
+                with self.lock:
+                    self.pending[:0] = files
+                raise
+            _move_into_place(files)
+            print(f'Synced {len(files)} files to Disk')
+
+    def close(self):
+        """
+        Stops the background flushes and flushes the pending files.
+        """
+        self.closed.set()
+        self.sync()
+
+    def _sync_periodically(self):
+        while not self.closed.wait(self.max_delay):
+            try:
+                self.sync()
+            except OSError as error:
+                print(f'FAILURE: could not sync files to Disk: {error}')
+
+
+def _move_into_place(files):
+    # Moves the flushed files, then flushes the directories holding
+    # their final names
+    in_place = []
+    for path, publish in files:
+        if publish is None:
+            in_place.append(path)
+            continue
+        try:
+            moved = publish()
+        except Exception as error:  # pylint: disable=broad-except
+            print(f'FAILURE: could not move {path} into place: {error}')
+            continue
+        if moved is not None:
+            in_place.append(moved)
+    for directory in dict.fromkeys(os.path.dirname(path)
+                                   for path in in_place):
+        _fsync(directory)
+
+
+def _fsync(path):
+    try:
+        descriptor = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        # Removed since it was written, so there is nothing to flush
+        return
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
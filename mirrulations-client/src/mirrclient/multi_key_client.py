@@ -0,0 +1,129 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from mirrclient.client import FAILED_FETCH_DELAY, HANDLED_EXCEPTIONS, \
+    MAX_ATTACHMENT_WORKERS, print_failure, client_from_environment, \
+    saves_flushed_on_exit
+from mirrclient.streaming import size_download_slots
+from mirrcore.redis_check import load_redis
+from mirrcore.http_session import API_PREFIX, DOWNLOADS_PREFIX, POOL_SIZES, \
+    size_pool
+from mirrcore.key_pool import KeyPool
+
+
+def get_api_keys():
+    """
+    Returns the API keys in the comma separated API_KEYS environment
+    variable, or the single API_KEY when API_KEYS is not set.
+    """
+    api_keys = os.getenv('API_KEYS', os.getenv('API_KEY', ''))
+    return [key.strip() for key in api_keys.split(',') if key.strip()]
+
+
+def get_worker_count(num_api_keys):
+    """
+    Returns the number of jobs performed at the same time, from the
+    CLIENT_WORKERS environment variable (default two per API key).
+    """
+    return int(os.getenv('CLIENT_WORKERS', str(2 * num_api_keys)))
+
+
+def get_download_connections(workers):
+    """
+    Returns the number of attachments downloaded at the same time, from
+    the DOWNLOAD_CONNECTIONS environment variable (default enough for
+    every worker to download the attachments of a comment at once, and
+    at least the DOWNLOADS_POOL_SIZE).
+    """
+    default = max(workers * MAX_ATTACHMENT_WORKERS,
+                  POOL_SIZES[DOWNLOADS_PREFIX])
+    return int(os.getenv('DOWNLOAD_CONNECTIONS', str(default)))
+
+
+class MultiKeyClient:
+    """
+    Performs jobs for several API keys in one process, sharing the
+    Client's HTTP session, savers, Redis connection and broker
+    connection.
+
+    Jobs are taken from the job queue on the calling thread, because
+    the broker connection may only be used by one thread. The API call
+    and the saving of each job run on a pool of workers, and the
+    Client's KeyPool picks the key with budget for each call.
+
+    Attributes
+    ----------
+    client : Client
+        Performs the individual steps of a job, with a key_pool set
+    workers : int
+        The number of jobs that may be in progress at the same time.
+        When this many are running the next job is not taken.
+    """
+    def __init__(self, client, workers):
+        self.client = client
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers)
+
+    def run(self, max_jobs=None):
+        """
+        Takes jobs until `max_jobs` have been attempted (forever if None),
+        then waits for the jobs still in progress. They are waited for
+        also when taking jobs is stopped by an exception, such as the
+        SystemExit raised on SIGTERM, so their saves are queued before
+        the saver is closed.
+        """
+        jobs_attempted = 0
+        try:
+            while max_jobs is None or jobs_attempted < max_jobs:
+                jobs_attempted += 1
+                self._take_job()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def _take_job(self):
+        # Released when the job finishes on a worker
+        self.slots.acquire()  # pylint: disable=consider-using-with
+        try:
+            job = self.client.take_job()
+        except HANDLED_EXCEPTIONS as error:
+            self.slots.release()
+            print_failure(error)
+            time.sleep(FAILED_FETCH_DELAY)
+            return
+        future = self.executor.submit(self._perform, job)
+        future.add_done_callback(self._on_done)
+
+    def _perform(self, job):
+        try:
+            result = self.client.fetch_result(job)
+            # Prints the success once the saves were written
+            self.client.save_job(job, result)
+        except HANDLED_EXCEPTIONS as error:
+            print_failure(error)
+
+    def _on_done(self, future):
+        self.slots.release()
+        if future.exception() is not None:
+            print(f'FAILURE: Unexpected error: {future.exception()}')
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    api_keys_ = get_api_keys()
+    if not api_keys_ or os.getenv('ID') is None:
+        print('Need client environment variables.')
+        sys.exit(1)
+    workers_ = get_worker_count(len(api_keys_))
+    # Every worker may call the API at once
+    size_pool(API_PREFIX, max(workers_, POOL_SIZES[API_PREFIX]))
+    size_download_slots(get_download_connections(workers_))
+    # load_redis blocks until the database has finished loading
+    database = load_redis()
+    job_client = client_from_environment(database)
+    job_client.key_pool = KeyPool(database, api_keys_)
+    with saves_flushed_on_exit(job_client):
+        MultiKeyClient(job_client, workers_).run()
@@ -0,0 +1,230 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from json import dumps, loads
+from mirrclient.streaming import stage_file
+
+# Failed saves kept for retrying, the oldest is dropped when it is full
+MAX_SPOOLED_SAVES = 10000
+
+# Seconds between attempts to write the spooled saves
+RETRY_INTERVAL = 60
+
+# Directory the spooled saves are kept in, so they are retried after the
+# client restarts, hidden so the manifest does not take it for data
+SPOOL_DIRECTORY = '/data/.retry_spool'
+
+# File in the spool directory listing the kept saves, one json per line
+SPOOL_NAME = 'spool.jsonl'
+
+
+class RetrySpool:  # pylint: disable=too-many-instance-attributes
+    """
+    Holds the saves that failed on one backend of a Saver while the
+    other backends succeeded, so that they can be written later without
+    fetching the job again.
+
+    Binary files are staged, since the caller removes its file once the
+    save returns. With a directory, each save is kept there as it is
+    spooled, binary data in a file of its own, and the saves still
+    spooled are spooled again by load() when the client starts, so they
+    are not lost when it stops or is killed. The list of kept saves is
+    appended to by add() and rewritten by retry() and close().
+
+    Attributes
+    ----------
+    entries : deque
+        (saver, method name, path, data) for every save waiting to be
+        retried
+    directory : str
+        Where the spooled saves are kept. If None, close() drops them.
+    on_dropped : callable
+        Called with the path of each save that is dropped, if not None
+    """
+
+    def __init__(self, max_entries=MAX_SPOOLED_SAVES,
+                 retry_interval=RETRY_INTERVAL, directory=None):
+        """
+        Parameters
+        ----------
+        max_entries : int
+            Saves kept before the oldest is dropped
+        retry_interval : float
+            Seconds between retries made by retry_if_due()
+        directory : str
+            Where the spooled saves are kept
+        """
+        self.entries = deque()
+        self.max_entries = max_entries
+        self.retry_interval = retry_interval
+        self.directory = directory
+        self.on_dropped = None
+        self.last_retry = time.monotonic()
+        self.lock = threading.Lock()
+        # Held for a whole retry, so the saves it is writing are only
+        # removed from the kept list once they were written
+        self.retry_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, saver, method, path, data):
+        """
+        Spools a save that raised on `saver`, and keeps it in the
+        directory if there is one.
+        """
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+        if method == 'save_binary_file':
+            data = stage_file(data, self.directory)
+        entry = (saver, method, path, data)
+        record = None
+        if self.directory is not None:
+            # Binary data is kept as a file in the directory
+            record = self._record(*entry)
+            entry = (saver, record['method'], path, record.get('file', data))
+        with self.lock:
+            self.entries.append(entry)
+            if record is not None:
+                self._append_record(record)
+            if len(self.entries) > self.max_entries:
+                self._drop(self.entries.popleft())
+
+    def retry_if_due(self):
+        """
+        Retries the spooled saves if RETRY_INTERVAL seconds have passed
+        since the last retry.
+        """
+        with self.lock:
+            if time.monotonic() - self.last_retry < self.retry_interval:
+                return
+            self.last_retry = time.monotonic()
+        self.retry()
+
+    def retry(self):
+        """
+        Attempts each spooled save once. Saves that fail again stay in
+        the spool.
+        @return the number of saves that were written
+        """
+        with self.retry_lock:
+            with self.lock:
+                entries = list(self.entries)
+                self.entries.clear()
+            written = [entry for entry in entries if self._retried(entry)]
+            if self.directory is not None:
+                with self.lock:
+                    self._keep_entries()
+            for _, method, _, data in written:
+                if method == 'save_binary_file':
+                    os.remove(data)
+        return len(written)
+
+    def _retried(self, entry):
+        # Whether the save was written, spooling it again if not
+        saver, method, path, data = entry
+        try:
+            getattr(saver, method)(path, data)
+        except Exception:  # pylint: disable=broad-except
+            with self.lock:
+                self.entries.append(entry)
+            return False
+        return True
+
+    def load(self, savers):
+        """
+        Spools the saves close() kept when the client last stopped,
+        each for the saver in `savers` of the type it was spooled for.
+        """
+        savers = {type(saver).__name__: saver for saver in savers}
+        for record in self._kept_records():
+            saver = savers.get(record['saver'])
+            entry = (saver, record['method'], record['path'],
+                     record.get('file', record.get('data')))
+            if saver is None:
+                self._drop(entry)
+                continue
+            with self.lock:
+                self.entries.append(entry)
+
+    def close(self):
+        """
+        Keeps the saves still spooled in `directory`, replacing those
+        kept before, so load() retries them when the client starts
+        again. Without a directory they are dropped.
+        """
+        with self.retry_lock, self.lock:
+            entries = list(self.entries)
+            self.entries.clear()
+            if self.directory is not None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._keep_entries(entries)
+                return
+        for entry in entries:
+            self._drop(entry)
+
+    def _keep_entries(self, entries=None):
+        # Replaces the kept list with `entries`, the spooled saves if
+        # None. Written beside the list and renamed over it, so a crash
+        # leaves the old list or the new one. Called with the lock held.
+        entries = self.entries if entries is None else entries
+        spool_path = os.path.join(self.directory, SPOOL_NAME)
+        with open(f'{spool_path}.new', 'w', encoding='utf8') as file:
+            for entry in entries:
+                file.write(f'{dumps(self._record(*entry))}\n')
+        os.replace(f'{spool_path}.new', spool_path)
+
+    def _append_record(self, record):
+        # Written in one call to a file opened for appending, so a kill
+        # leaves at most a last line without its newline, which
+        # _kept_records() skips. Called with the lock held.
+        descriptor = os.open(os.path.join(self.directory, SPOOL_NAME),
+                             os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(descriptor, f'{dumps(record)}\n'.encode('utf8'))
+        finally:
+            os.close(descriptor)
+
+    def _kept_records(self):
+        # The saves that were kept, without the binary files that were
+        # written or dropped since
+        if self.directory is None:
+            return []
+        spool_path = os.path.join(self.directory, SPOOL_NAME)
+        if not os.path.exists(spool_path):
+            return []
+        with open(spool_path, encoding='utf8') as file:
+            records = [loads(line) for line in file if line.endswith('\n')]
+        return [record for record in records
+                if 'file' not in record or os.path.exists(record['file'])]
+
+    def _record(self, saver, method, path, data):
+        # The json line a save is kept as. Binary data is moved into the
+        # directory and kept as a save_binary_file.
+        record = {'saver': type(saver).__name__, 'method': method,
+                  'path': path}
+        if method not in ('save_binary', 'save_binary_file'):
+            record['data'] = data
+            return record
+        record['method'] = 'save_binary_file'
+        record['file'] = os.path.join(self.directory,
+                                      f'{uuid.uuid4().hex}.bin')
+        if method == 'save_binary':
+            with open(record['file'], 'wb') as file:
+                file.write(data)
+        elif os.path.dirname(data) != self.directory:
+            shutil.move(data, record['file'])
+        else:
+            record['file'] = data
+        return record
+
+    def _drop(self, entry):
+        _, method, path, data = entry
+        print(f'FAILURE: dropped spooled save of {path}')
+        if method == 'save_binary_file' and os.path.exists(data):
+            os.remove(data)
+        if self.on_dropped is not None:
+            self.on_dropped(path)
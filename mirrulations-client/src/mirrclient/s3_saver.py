@@ -1,7 +1,59 @@
+import hashlib
+import io
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from mirrcore.blob_store import file_digest
+from mirrcore.compression import compress
+from mirrcore.manifest import S3, item_details
+
+# Uploads to S3 that may run at the same time in a process, and the
+# number of connections kept open to S3 to serve them
+MAX_CONCURRENT_UPLOADS = int(os.getenv('S3_MAX_CONCURRENCY', '10'))
+
+# Files larger than this are uploaded in parts of this size, in parallel
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_CHUNK_SIZE,
+    multipart_chunksize=MULTIPART_CHUNK_SIZE,
+    max_concurrency=MAX_CONCURRENT_UPLOADS)
+
+
+@lru_cache(maxsize=None)
+def shared_s3_client(access_key, secret_access_key):
+    """
+    Returns the boto3 S3 client shared by every S3Saver in this process
+    that uses the same credentials. boto3 clients are thread safe, so
+    the client and its connection pool are reused by all uploads.
+    """
+    return boto3.client(
+        's3',
+        region_name='us-east-1',
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_access_key,
+        config=Config(max_pool_connections=MAX_CONCURRENT_UPLOADS))
+
+
+# User metadata key holding the sha256 digest of an uploaded object
+DIGEST_METADATA = 'sha256'
+
+
+def _bytes_digest(body):
+    if isinstance(body, str):
+        body = body.encode('utf8')
+    return hashlib.sha256(body).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _upload_executor():
+    return ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPLOADS)
 
 
 class S3Saver():
@@ -18,8 +70,13 @@ class S3Saver():
 
     save_binary(path = string, binary = bytes)
 
+    save_binary_file(path = string, file_path = string)
+
+    save_many(files = list)
+
     """
-    def __init__(self, bucket_name="mirrulations"):
+    def __init__(self, bucket_name="mirrulations", manifest=None,
+                 compression=None):
         """
         Constructor for S3Saver
         Gets AWS credentials from .env file
@@ -30,11 +87,23 @@ class S3Saver():
         -------
         bucket_name : str
             Name of the bucket to write data to.
+        manifest : Manifest
+            Records every object that is uploaded. If None, nothing is
+            recorded.
+        compression : str
+            The codec json and extracted text are compressed with,
+            Ex: 'gzip'. Objects keep their keys and are stored with a
+            Content-Encoding. If None, they are uploaded uncompressed.
         """
         self.access_key = None
         self.secret_access_key = None
         self.s3_client = self.get_s3_client()
         self.bucket_name = bucket_name
+        self.manifest = manifest
+        self.compression = compression
+        # Set to a BlobStore to upload identical attachments once. Needs
+        # the manifest to find the objects they are copied from.
+        self.blob_store = None
 
     def get_s3_client(self):
         """
@@ -43,12 +112,7 @@ class S3Saver():
         if self.get_credentials() is False:
             print("No AWS credentials provided, Unable to write to S3.")
             return False
-        return boto3.client(
-                    's3',
-                    region_name='us-east-1',
-                    aws_access_key_id=self.access_key,
-                    aws_secret_access_key=self.secret_access_key
-                    )
+        return shared_s3_client(self.access_key, self.secret_access_key)
 
     def get_credentials(self):
         """
@@ -79,12 +143,13 @@ class S3Saver():
         path = path.replace("/data/", "")
         if self.s3_client is False:
             return False
-        response = self.s3_client.put_object(
-            Bucket=self.bucket_name,
-            Key=path,
-            Body=json.dumps(data["results"])
-            )
+        body = json.dumps(data["results"])
+        digest = _bytes_digest(body)
+        if self.is_unchanged(path, digest):
+            return True
+        response = self._put_text(path, body, digest)
         print(f"Wrote json to S3: {path}")
+        self._record(path, digest=digest, **item_details(data["results"]))
         return response
 
     def save_binary(self, path, binary):
@@ -103,12 +168,102 @@ class S3Saver():
         path = path.replace("/data/", "")
         if self.s3_client is False:
             return False
-        response = self.s3_client.put_object(
-            Bucket=self.bucket_name,
-            Key=path,
-            Body=binary)
+        digest = _bytes_digest(binary)
+        if self.is_unchanged(path, digest):
+            return True
+        # Large binaries are sent as a multipart upload
+        self.s3_client.upload_fileobj(
+            io.BytesIO(binary), self.bucket_name, path,
+            ExtraArgs={'Metadata': {DIGEST_METADATA: digest}},
+            Config=TRANSFER_CONFIG)
         print(f"Wrote binary to S3: {path}")
-        return response
+        self._record(path, size=len(binary), digest=digest)
+        return True
+
+    def save_binary_file(self, path, file_path):
+        """
+        Uploads a downloaded file to Amazon S3 bucket
+        Bucket Structure: /AGENCYID/path/to/item
+
+        The upload is streamed from the file, and large files are sent
+        as a multipart upload, so the file is never read into memory.
+        With a blob store, a file whose content the manifest has at
+        another key is copied from it within the bucket instead.
+
+        Parameters
+        -------
+        path : str
+            Where to save the data to in the S3 bucket
+
+        file_path : str
+            The temporary file holding the download
+        """
+        path = path.replace("/data/", "")
+        if self.s3_client is False:
+            return False
+        digest = file_digest(file_path)
+        if self.is_unchanged(path, digest):
+            return True
+        if self.blob_store is None or not self._copy_identical(path, digest):
+            self._upload_file(file_path, path, digest)
+        print(f"Wrote binary to S3: {path}")
+        self._record(path, size=os.path.getsize(file_path), digest=digest)
+        return True
+
+    def _upload_file(self, file_path, key, digest):
+        self.s3_client.upload_file(
+            file_path, self.bucket_name, key,
+            ExtraArgs={'Metadata': {DIGEST_METADATA: digest}},
+            Config=TRANSFER_CONFIG)
+
+    def _copy_identical(self, key, digest):
+        """
+        Copies an object the manifest records with the same digest to key
+        in the bucket, without sending the data again. The copy keeps the
+        digest metadata of its source.
+        @return False if there is no such object to copy from, in which
+            case the file is uploaded
+        """
+        if self.manifest is None:
+            return False
+        for source in self.manifest.paths_with_digest(digest, S3):
+            source_key = self.manifest.relative_path(source).lstrip('/')
+            if source_key == key:
+                continue
+            try:
+                self.s3_client.copy(
+                    {'Bucket': self.bucket_name, 'Key': source_key},
+                    self.bucket_name, key, Config=TRANSFER_CONFIG)
+            except ClientError:
+                # The object was removed from the bucket since
+                continue
+            return True
+        return False
+
+    def save_many(self, files):
+        """
+        Uploads several files at the same time, on a pool of
+        MAX_CONCURRENT_UPLOADS threads shared by the process.
+
+        Parameters
+        -------
+        files : list
+            (path, file_path) pairs, as passed to save_binary_file()
+
+        Returns
+        -------
+        dict
+            the result of save_binary_file() for each path. If an upload
+            raised, its result is the exception.
+        """
+        uploads = {path: _upload_executor().submit(self.save_binary_file,
+                                                   path, file_path)
+                   for path, file_path in files}
+        results = {}
+        for path, upload in uploads.items():
+            error = upload.exception()
+            results[path] = upload.result() if error is None else error
+        return results
 
     def save_text(self, path, text):
         """
@@ -126,9 +281,63 @@ class S3Saver():
         path = path.replace("/data/", "")
         if self.s3_client is False:
             return False
-        response = self.s3_client.put_object(
-            Bucket=self.bucket_name,
-            Key=path,
-            Body=text)
+        digest = _bytes_digest(text)
+        if self.is_unchanged(path, digest):
+            return True
+        response = self._put_text(path, text, digest)
         print(f"Wrote extracted text to S3: {path}")
+        self._record(path, digest=digest)
         return response
+
+    def _put_text(self, key, text, digest):
+        """
+        Uploads text, compressed if the saver has a codec. The digest is
+        of the uncompressed text, so turning compression on does not
+        upload unchanged objects again.
+        """
+        extra_args = {}
+        if self.compression is not None:
+            text = compress(text, self.compression)
+            extra_args['ContentEncoding'] = self.compression
+        return self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=key,
+            Body=text,
+            Metadata={DIGEST_METADATA: digest},
+            **extra_args)
+
+    def is_unchanged(self, key, digest):
+        """
+        Returns whether the object at key already has the digest, in which
+        case the upload is skipped. The digest is looked up in the manifest
+        when it has the object, and otherwise in the object's metadata.
+
+        Parameters
+        -------
+        key : str
+            The key of the object in the bucket
+        digest : str
+            The sha256 digest of the data about to be uploaded
+        """
+        stored_digest = None
+        if self.manifest is not None:
+            entry = self.manifest.get(f'/{key}', S3)
+            stored_digest = entry and entry['digest']
+        if stored_digest is None:
+            stored_digest = self._metadata_digest(key)
+        if stored_digest != digest:
+            return False
+        print(f"Unchanged in S3, skipping upload: {key}")
+        return True
+
+    def _metadata_digest(self, key):
+        try:
+            head = self.s3_client.head_object(Bucket=self.bucket_name,
+                                              Key=key)
+        except ClientError:
+            return None
+        return head.get('Metadata', {}).get(DIGEST_METADATA)
+
+    def _record(self, key, **details):
+        if self.manifest is not None:
+            self.manifest.record(f'/{key}', S3, **details)
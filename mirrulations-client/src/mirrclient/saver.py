@@ -1,27 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from mirrclient.retry_spool import RetrySpool
+
+# Backend saves that may run at the same time across every Saver
+MAX_PARALLEL_SAVES = 16
+
+
+@lru_cache(maxsize=None)
+def _save_executor():
+    # Shared so that the Savers made for each pdf do not start threads
+    return ThreadPoolExecutor(max_workers=MAX_PARALLEL_SAVES)
+
+
 class Saver:
     """
     A class which encapsulates the saving for the Client
     A Saver has a list of savers which are other classes
+
+    Each save is passed to every saver at the same time and returns
+    a dict of each saver's result, or the exception it raised. A saver
+    that fails while another succeeds does not fail the save, the save
+    is kept in the retry spool and written again later. If every saver
+    fails the first exception is raised.
     ...
     Methods
     -------
     save_json(path = string, data = response)
 
     save_binary(path = string, data, = response.content)
+
+    save_binary_file(path = string, file_path = string)
+
+    close()
     """
-    def __init__(self, savers=None) -> None:
+    def __init__(self, savers=None, spool=None) -> None:
         """
         Parameters
         ----------
         savers : list
             A list of Saver Objects Ex: S3Saver(), DiskSaver()
+        spool : RetrySpool
+            Keeps the saves that failed on some of the savers
         """
         self.savers = savers
+        self.spool = RetrySpool() if spool is None else spool
 
     def save_json(self, path, data):
         """
-        Iterates over the instance variable savers list
-        and calls the corresponding subclass save_json() method.
+        Calls the save_json() method of every saver at the same time.
 
         Parameters
         ----------
@@ -31,13 +57,11 @@ class Saver:
         data: dict
             The json as a dict to save.
         """
-        for saver in self.savers:
-            saver.save_json(path, data)
+        return self._save('save_json', path, data)
 
     def save_binary(self, path, binary):
         """
-        Iterates over the instance variable savers list
-        and calls the corresponding subclass save_binary() method.
+        Calls the save_binary() method of every saver at the same time.
 
         Parameters
         ----------
@@ -47,13 +71,25 @@ class Saver:
         binary: bytes
             The binary response.content returns.
         """
-        for saver in self.savers:
-            saver.save_binary(path, binary)
+        return self._save('save_binary', path, binary)
+
+    def save_binary_file(self, path, file_path):
+        """
+        Calls the save_binary_file() method of every saver at the same time.
+
+        Parameters
+        ----------
+        path : str
+            A string denoting where the binary file should be saved to.
+
+        file_path : str
+            A file holding the binary data, such as a streamed download.
+        """
+        return self._save('save_binary_file', path, file_path)
 
     def save_text(self, path, text):
         """
-        Iterates over the instance variable savers list
-        and calls the corresponding subclass save_text() method.
+        Calls the save_text() method of every saver at the same time.
 
         Parameters
         ----------
@@ -63,5 +99,37 @@ class Saver:
         text : str
             The extracted text to be saved
         """
+        return self._save('save_text', path, text)
+
+    def close(self):
+        """
+        Retries the spooled saves, closes the savers that finish their
+        writes when they are closed, such as a ShardSaver uploading its
+        open shards, and closes the spool, which keeps the saves that
+        still failed for when the client starts again.
+        """
+        self.spool.retry()
         for saver in self.savers:
-            saver.save_text(path, text)
+            if hasattr(saver, 'close'):
+                saver.close()
+        self.spool.close()
+
+    def _save(self, method, path, data):
+        self.spool.retry_if_due()
+        if len(self.savers) == 1:
+            saver = self.savers[0]
+            return {saver: getattr(saver, method)(path, data)}
+        futures = {saver: _save_executor().submit(getattr(saver, method),
+                                                  path, data)
+                   for saver in self.savers}
+        results = {saver: future.exception() or future.result()
+                   for saver, future in futures.items()}
+        failed = [saver for saver, result in results.items()
+                  if isinstance(result, Exception)]
+        if len(failed) == len(self.savers):
+            raise results[failed[0]]
+        for saver in failed:
+            print(f'FAILURE: {type(saver).__name__} could not save {path}: '
+                  f'{results[saver]}')
+            self.spool.add(saver, method, path, data)
+        return results
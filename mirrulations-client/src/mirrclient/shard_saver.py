@@ -0,0 +1,284 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from json import dumps
+from mirrclient.disk_saver import DiskSaver, json_digest
+from mirrclient.s3_saver import S3Saver
+from mirrcore.manifest import item_details
+from mirrcore.shards import INDEX_NAME, SHARD_PREFIX, SHARD_SUFFIX, \
+    read_index, shard_name, truncate_partial_line
+
+# Size a shard may grow to before it is sealed and the next item starts
+# a new one. Sealed shards are never written again.
+MAX_SHARD_BYTES = 64 * 1024 * 1024
+
+# Seconds after a shard is changed before it is uploaded, open, with the
+# next save. Most dockets never fill a shard, so without this their json
+# would only reach S3 when the client stops.
+UPLOAD_SECONDS = 10 * 60
+
+# Packed directories whose digests are kept in memory. The least recently
+# used is forgotten, after its shard is uploaded, and read back from its
+# index if an item is saved there again.
+MAX_DIRECTORIES = 1024
+
+
+class _PackedDirectory:
+    """
+    What a ShardSaver knows about one packed directory: the digests of
+    the items in it, the shard being appended to and when it was first
+    changed since it was last uploaded, None if it has not been.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.digests = {}
+        self.shard = 0
+        self.changed_at = None
+        if os.path.exists(self.index_path()):
+            truncate_partial_line(self.index_path())
+        for entry in read_index(directory):
+            self.digests.setdefault(entry['id'], set()).add(entry['digest'])
+            self.shard = int(
+                entry['shard'][len(SHARD_PREFIX):-len(SHARD_SUFFIX)])
+
+    def shard_path(self):
+        return os.path.join(self.directory, shard_name(self.shard))
+
+    def index_path(self):
+        return os.path.join(self.directory, INDEX_NAME)
+
+    def append(self, item_id, line, digest):
+        """
+        Appends a line to the current shard and its entry to the index.
+        @return the size of the shard after the line was added
+        """
+        with open(self.shard_path(), 'ab') as file:
+            offset = file.tell()
+            file.write(line)
+        entry = {'id': item_id, 'shard': shard_name(self.shard),
+                 'offset': offset, 'length': len(line), 'digest': digest}
+        # The entry is written once its line is in the shard, so a crash
+        # leaves at most a line the index does not point to, or an entry
+        # without its newline, which read_index skips
+        with open(self.index_path(), 'a', encoding='utf8') as file:
+            file.write(f'{dumps(entry)}\n')
+        self.digests.setdefault(item_id, set()).add(digest)
+        if self.changed_at is None:
+            self.changed_at = time.monotonic()
+        return offset + len(line)
+
+    def snapshot(self):
+        """
+        Marks the shard as uploaded.
+        @return the path of the shard, the path of the index and the
+            index as it is now, which only points to lines already in
+            the shard
+        """
+        with open(self.index_path(), encoding='utf8') as file:
+            index = file.read()
+        self.changed_at = None
+        return self.shard_path(), self.index_path(), index
+
+    def seal(self):
+        """
+        Starts a new shard for the items appended after this.
+        @return the snapshot of the sealed shard
+        """
+        sealed = self.snapshot()
+        self.shard += 1
+        return sealed
+
+
+class ShardSaver(DiskSaver):
+    """
+    A DiskSaver that packs the json of dockets, documents and comments
+    into append-only shards, one set per directory, instead of writing
+    a file for each item. A docket with a million comments has a few
+    dozen files in text-<docket id>/comments instead of a million.
+
+    Items are read back by id with mirrcore.shards.ShardReader.
+    Attachments and extracted text are still saved as files.
+
+    Json that was already saved is skipped, and changed json is appended
+    as a new version of the item. When a shard reaches max_shard_bytes it
+    is sealed and, with a copy of the index, queued for `uploader`. A
+    shard that is still open is queued upload_interval seconds after it
+    changed, and again after it changes again. The queued shards are
+    uploaded by upload_queued(), which PackedS3Saver calls with each
+    save so the uploads do not hold up packing, and every changed shard
+    is uploaded on close().
+
+    Attributes
+    ----------
+    uploader : S3Saver
+        Uploads shards. If None, they are only kept on disk.
+    max_shard_bytes : int
+        Size at which a shard is sealed
+    upload_interval : float
+        Seconds after a change an open shard is uploaded
+    max_directories : int
+        Packed directories remembered, the least recently used first
+        forgotten
+    """
+
+    def __init__(self, manifest=None, compression=None, uploader=None):
+        """
+        Parameters
+        ----------
+        manifest : Manifest
+            Records every item that is packed and every file that is
+            written, as DiskSaver does.
+        compression : str
+            The codec extracted text is compressed with
+        uploader : S3Saver
+            Uploads sealed shards and their index
+        """
+        super().__init__(manifest, compression)
+        self.uploader = uploader
+        self.max_shard_bytes = MAX_SHARD_BYTES
+        self.upload_interval = UPLOAD_SECONDS
+        self.max_directories = MAX_DIRECTORIES
+        self.directories = OrderedDict()
+        self.uploads = []
+        self.lock = threading.Lock()
+
+    def save_json(self, path, data):
+        """
+        Appends the json to the shard of the directory of `path`,
+        unless the same json was saved for the item before.
+        Parameters
+        ----------
+        path : str
+            the path the item would have as a file, Ex: .../<id>.json
+        data : dict
+            the results data to be packed
+        """
+        item_id = os.path.splitext(os.path.basename(path))[0]
+        data = data['results']
+        digest = json_digest(data)
+        with self.lock:
+            packed = self._packed_directory(os.path.dirname(path))
+            if self.is_duplicate(packed.digests.get(item_id, ()), digest):
+                return
+            size, shard_path = self._append(packed, item_id, data, digest)
+        # The files that were appended to, not the path of the item
+        self._written(shard_path)
+        self._written(packed.index_path())
+        print(f'Packed json to Disk: {path}')
+        if self.manifest is not None:
+            self.manifest.record(path, size=size, digest=digest,
+                                 **item_details(data))
+
+    def close(self):
+        """
+        Flushes the written files and uploads every shard that changed
+        since it was last uploaded, so the json of dockets that never
+        filled a shard reaches S3 when the client stops.
+        """
+        with self.lock:
+            self.uploads.extend(packed.snapshot()
+                                for packed in self.directories.values()
+                                if packed.changed_at is not None)
+        super().close()
+        self.upload_queued()
+
+    def upload_queued(self):
+        """
+        Uploads the queued shards and their index. Uploads run outside
+        the lock, so other threads keep packing. If an upload raises, the
+        shard and the ones after it are queued again for the next call.
+        """
+        with self.lock:
+            uploads, self.uploads = self.uploads, []
+        if self.uploader is None:
+            return
+        for i, (shard_path, index_path, index) in enumerate(uploads):
+            try:
+                self.uploader.save_binary_file(shard_path, shard_path)
+                self.uploader.save_text(index_path, index)
+            except Exception:
+                with self.lock:
+                    self.uploads[:0] = uploads[i:]
+                raise
+
+    def _packed_directory(self, directory):
+        if directory in self.directories:
+            self.directories.move_to_end(directory)
+            return self.directories[directory]
+        self.make_path(directory)
+        packed = _PackedDirectory(directory)
+        # The last shard may have been sealed before a restart
+        if os.path.exists(packed.shard_path()) and \
+                os.path.getsize(packed.shard_path()) >= self.max_shard_bytes:
+            packed.shard += 1
+        self.directories[directory] = packed
+        if len(self.directories) > self.max_directories:
+            self._forget_least_recent()
+        return packed
+
+    def _forget_least_recent(self):
+        # Its changes are uploaded, since close() no longer sees them
+        _, forgotten = self.directories.popitem(last=False)
+        if forgotten.changed_at is not None and self.uploader is not None:
+            self.uploads.append(forgotten.snapshot())
+
+    def _append(self, packed, item_id, data, digest):
+        # Returns the size of the packed line and the shard it was
+        # appended to. A shard the line fills is sealed, and it and the
+        # shards that changed upload_interval ago are queued for upload.
+        line = f'{dumps(data)}\n'.encode('utf8')
+        shard_path = packed.shard_path()
+        if packed.append(item_id, line, digest) >= self.max_shard_bytes:
+            print(f'Sealed shard: {shard_path}')
+            sealed = packed.seal()
+            if self.uploader is not None:
+                self.uploads.append(sealed)
+        if self.uploader is not None:
+            self._queue_changed_before(time.monotonic() - self.upload_interval)
+        return len(line), shard_path
+
+    def _queue_changed_before(self, changed_before):
+        # Queues the open shards that changed before `changed_before`
+        self.uploads.extend(packed.snapshot()
+                            for packed in self.directories.values()
+                            if packed.changed_at is not None and
+                            packed.changed_at <= changed_before)
+
+
+class PackedS3Saver(S3Saver):
+    """
+    The S3Saver used with a ShardSaver. Json is uploaded in the shards
+    instead of one object per item, so save_json uploads the shards the
+    ShardSaver queued instead of the item.
+
+    Attributes
+    ----------
+    shard_saver : ShardSaver
+        Packs the json whose shards are uploaded. If None, save_json
+        does nothing.
+    """
+
+    def __init__(self, bucket_name="mirrulations", manifest=None,
+                 compression=None):
+        super().__init__(bucket_name, manifest, compression)
+        self.shard_saver = None
+
+    def save_json(self, path, data):
+        # A Saver runs this beside ShardSaver.save_json, so the shards
+        # are uploaded on this thread, and a failed upload is retried
+        # when the Saver retries this save
+        if self.shard_saver is not None:
+            self.shard_saver.upload_queued()
+
+
+def build_packed_savers(manifest=None, compression=None):
+    """
+    Returns the ShardSaver and PackedS3Saver that save to disk and to the
+    mirrulations S3 bucket in packed storage.
+    """
+    s3_saver = PackedS3Saver(bucket_name="mirrulations", manifest=manifest,
+                             compression=compression)
+    s3_saver.shard_saver = ShardSaver(manifest, compression, s3_saver)
+    return [s3_saver.shard_saver, s3_saver]
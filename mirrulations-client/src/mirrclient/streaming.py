@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from mirrcore.http_session import DOWNLOADS_PREFIX, POOL_SIZES, \
+    get_session, size_pool
+
+# Bytes read from the response and written to the temporary file at a time
+CHUNK_SIZE = 1024 * 1024
+
+# Most downloads from one host that may run at the same time in a process,
+# from the DOWNLOAD_CONNECTIONS environment variable. By default one for
+# each connection kept open to downloads.regulations.gov. A client with
+# more workers raises it with size_download_slots().
+MAX_CONNECTIONS_PER_HOST = int(os.getenv(
+    'DOWNLOAD_CONNECTIONS', str(POOL_SIZES[DOWNLOADS_PREFIX])))
+
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+
+def _host_slot(url):
+    host = urlparse(url).netloc
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(
+                MAX_CONNECTIONS_PER_HOST)
+        return _host_slots[host]
+
+
+def size_download_slots(max_connections):
+    """
+    Lets max_connections downloads from one host run at the same time,
+    such as the attachments of every job a client's workers perform, and
+    keeps as many connections open to downloads.regulations.gov.
+    Called before any download starts.
+    """
+    global MAX_CONNECTIONS_PER_HOST  # pylint: disable=global-statement
+    with _host_slots_lock:
+        MAX_CONNECTIONS_PER_HOST = max_connections
+        _host_slots.clear()
+    size_pool(DOWNLOADS_PREFIX, max_connections)
+
+
+@contextmanager
+def download_to_temp_file(url, timeout=10):
+    """
+    Streams a download into a temporary file so that only CHUNK_SIZE
+    bytes of it are held in memory at a time.
+
+    Yields the path of the temporary file, which is removed when
+    the with block exits, or when the download fails part way through.
+    An error status raises requests.exceptions.HTTPError before anything
+    is written.
+    At most MAX_CONNECTIONS_PER_HOST downloads
+    from the same host run at once, any others wait for a free slot.
+
+    Parameters
+    ----------
+    url : str
+        The file to download
+        Ex: https://downloads.regulations.gov/####
+    timeout : int
+        Seconds to wait for the server to respond
+    """
+    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+        temp_path = temp_file.name
+    try:
+        with _host_slot(url), \
+                get_session().get(url, stream=True,
+                                  timeout=timeout) as response, \
+                open(temp_path, 'wb') as file:
+            # An error page is never saved as the attachment
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                file.write(chunk)
+        yield temp_path
+    finally:
+        os.remove(temp_path)
+
+
+def stage_file(file_path, directory=None):
+    """
+    Returns the path of a temporary copy of `file_path`, for a save that
+    is written after the caller may have removed its file. The copy is
+    a hard link when the file system allows it, so no data is copied.
+    The caller removes the copy once it has been saved.
+    @param directory: where the copy is made, the temporary directory if
+        None
+    """
+    with tempfile.NamedTemporaryFile(delete=False, dir=directory) as staged:
+        staged_path = staged.name
+    os.remove(staged_path)
+    try:
+        os.link(file_path, staged_path)
+    except OSError:
+        shutil.copyfile(file_path, staged_path)
+    return staged_path
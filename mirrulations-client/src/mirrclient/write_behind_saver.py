@@ -0,0 +1,230 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+from mirrclient.streaming import stage_file
+
+# Saves that may wait in the queue before new saves block
+MAX_PENDING_SAVES = 64
+
+# Background threads writing the queued saves
+WRITER_THREADS = 4
+
+# Attempts made for each save before it is reported as failed
+MAX_ATTEMPTS = 3
+
+# Seconds waited after the first failed attempt, doubled after each retry
+RETRY_DELAY = 1
+
+_STOP = object()
+
+
+def unfinished_writes(result):
+    """
+    Returns the Futures of the writes a save returned, either its own or
+    those in the dict of results a Saver returns.
+    """
+    results = result.values() if isinstance(result, dict) else [result]
+    return [write for write in results if isinstance(write, Future)]
+
+
+def _resolve_when_done(written, path, writes):
+    # Sets the result of written once every write is done, or the error
+    # of the first that failed
+    if not writes:
+        written.set_result(path)
+        return
+    writes[0].add_done_callback(
+        partial(_resolve_after, written, path, writes[1:]))
+
+
+def _resolve_after(written, path, writes, write):
+    error = write.exception()
+    if error is None:
+        _resolve_when_done(written, path, writes)
+        return
+    print(f'FAILURE: could not save {path}: {error}')
+    written.set_exception(error)
+
+
+class WriteBehindSaver:
+    """
+    Wraps a Saver so that saves are queued and written by background
+    threads, and the job that produced them can move on without waiting
+    for S3 or the disk.
+
+    The queue is bounded, so when the writers fall behind the next save
+    blocks until there is room. A save that raises is retried with an
+    increasing delay, and after MAX_ATTEMPTS it is printed and its Future
+    fails with the error.
+
+    Each save returns a Future that is done once the save was written,
+    see JobSaves. A save that leaves writes in progress, such as a
+    DiskSaver moving its files into place once their group is flushed,
+    is written once they are done.
+
+    Attributes
+    ----------
+    saver : Saver
+        Performs the writes
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, saver, max_pending=MAX_PENDING_SAVES,
+                 writers=WRITER_THREADS, max_attempts=MAX_ATTEMPTS,
+                 retry_delay=RETRY_DELAY):
+        """
+        Parameters
+        ----------
+        saver : Saver
+            The saver the queued saves are passed to
+        max_pending : int
+            Saves that may be queued before a new save blocks
+        writers : int
+            Number of background threads
+        max_attempts : int
+            Attempts made for each save
+        retry_delay : float
+            Seconds waited before the first retry
+        """
+        self.saver = saver
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.threads = [threading.Thread(target=self._write, daemon=True)
+                        for _ in range(writers)]
+        for thread in self.threads:
+            thread.start()
+
+    def save_json(self, path, data):
+        return self._queue('save_json', path, data)
+
+    def save_binary(self, path, binary):
+        return self._queue('save_binary', path, binary)
+
+    def save_binary_file(self, path, file_path):
+        """
+        Queues a copy of `file_path`, since the caller may remove the
+        file as soon as this returns.
+        """
+        return self._queue('save_binary_file', path, stage_file(file_path))
+
+    def save_text(self, path, text):
+        return self._queue('save_text', path, text)
+
+    def _queue(self, method, path, data):
+        written = Future()
+        self.pending.put((method, path, data, written))
+        return written
+
+    def flush(self):
+        """
+        Blocks until every queued save has been written or has failed.
+        """
+        self.pending.join()
+
+    def close(self):
+        """
+        Flushes the queue, stops the background threads and closes the
+        saver.
+        """
+        self.flush()
+        for _ in self.threads:
+            self.pending.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        self.saver.close()
+
+    def _write(self):
+        while True:
+            item = self.pending.get()
+            try:
+                if item is _STOP:
+                    return
+                self._save_with_retries(*item)
+            finally:
+                self.pending.task_done()
+
+    def _save(self, method, path, data, written):
+        # written is done once the writes the save left in progress are
+        result = getattr(self.saver, method)(path, data)
+        _resolve_when_done(written, path, unfinished_writes(result))
+
+    def _save_with_retries(self, method, path, data, written):
+        delay = self.retry_delay
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    self._save(method, path, data, written)
+                    return
+                except Exception as error:  # pylint: disable=broad-except
+                    if attempt == self.max_attempts:
+                        print(f'FAILURE: could not save {path}: {error}')
+                        written.set_exception(error)
+                        return
+                    time.sleep(delay)
+                    delay *= 2
+        finally:
+            if method == 'save_binary_file':
+                os.remove(data)
+
+
+class JobSaves:
+    """
+    Passes the saves of one job to a saver and keeps the Future of each
+    save a WriteBehindSaver queued, or that a Saver left in progress, so
+    the job is completed only once all of them were written.
+    """
+
+    def __init__(self, saver):
+        self.saver = saver
+        self.queued = []
+        self.remaining = 0
+        self.callbacks = None
+        self.lock = threading.Lock()
+
+    def save_json(self, path, data):
+        self._keep(self.saver.save_json(path, data))
+
+    def save_binary(self, path, binary):
+        self._keep(self.saver.save_binary(path, binary))
+
+    def save_binary_file(self, path, file_path):
+        self._keep(self.saver.save_binary_file(path, file_path))
+
+    def save_text(self, path, text):
+        self._keep(self.saver.save_text(path, text))
+
+    def _keep(self, save):
+        with self.lock:
+            self.queued.extend(unfinished_writes(save))
+
+    def when_written(self, on_written, on_failed):
+        """
+        Calls on_written() once every save was written, or on_failed(error)
+        with the error of a save that could not be written. They are
+        called on the thread that finished the last save, or right away
+        if no save was queued.
+        """
+        with self.lock:
+            self.callbacks = (on_written, on_failed)
+            self.remaining = len(self.queued)
+            queued = list(self.queued)
+        if not queued:
+            on_written()
+        for save in queued:
+            save.add_done_callback(self._done)
+
+    def _done(self, _):
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining:
+                return
+        errors = [save.exception() for save in self.queued
+                  if save.exception() is not None]
+        on_written, on_failed = self.callbacks
+        if errors:
+            on_failed(errors[0])
+        else:
+            on_written()
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+from mirrclient.async_client import AsyncClient, FAILED_FETCH_DELAY
+from mirrclient.exceptions import NoJobsAvailableException
+
+
+class ClientSpy:
+    """
+    Stands in for a Client. Saves block until `release_saves` is set so
+    tests can check what happens while saves are still in flight.
+    """
+    def __init__(self, num_jobs):
+        self.jobs = [{'job_id': i, 'url': f'http://a.b.c/{i}'}
+                     for i in range(num_jobs)]
+        self.fetched = []
+        self.saved = []
+        self.taken_on = set()
+        self.release_saves = threading.Event()
+
+    def take_job(self):
+        if not self.jobs:
+            raise NoJobsAvailableException
+        self.taken_on.add(threading.get_ident())
+        return self.jobs.pop(0)
+
+    def fetch_result(self, job):
+        self.fetched.append(job['job_id'])
+        return {'data': job['job_id']}
+
+    def save_job(self, job, result):
+        self.release_saves.wait(5)
+        self.saved.append((job['job_id'], result['data']))
+
+
+def test_api_calls_do_not_wait_for_saves():
+    client = ClientSpy(3)
+    async_client = AsyncClient(client, max_pending_saves=4, delay=0)
+
+    async def run():
+        await async_client.run(max_jobs=3)
+
+    async def release_after_fetches():
+        while len(client.fetched) < 3:
+            await asyncio.sleep(0.01)
+        # All three API calls went out before any save finished
+        assert not client.saved
+        client.release_saves.set()
+
+    async def main():
+        await asyncio.gather(run(), release_after_fetches())
+
+    asyncio.run(main())
+    assert sorted(client.saved) == [(0, 0), (1, 1), (2, 2)]
+
+
+def test_pending_saves_limit_api_calls():
+    client = ClientSpy(3)
+    async_client = AsyncClient(client, max_pending_saves=1, delay=0)
+
+    async def main():
+        task = asyncio.ensure_future(async_client.run(max_jobs=3))
+        await asyncio.sleep(0.1)
+        # The second call waits for the first save to finish
+        assert client.fetched == [0]
+        client.release_saves.set()
+        await task
+
+    asyncio.run(main())
+    assert client.saved == [(0, 0), (1, 1), (2, 2)]
+
+
+async def no_wait(_):
+    pass
+
+
+def test_no_jobs_available_is_reported(mocker, capsys):
+    mocker.patch('asyncio.sleep', side_effect=no_wait)
+    client = ClientSpy(0)
+    asyncio.run(AsyncClient(client, delay=0).run(max_jobs=2))
+    assert capsys.readouterr().out == 'FAILURE: No Jobs Available.\n' * 2
+
+
+def test_failed_fetch_waits_before_trying_again(mocker):
+    sleep = mocker.patch('asyncio.sleep', side_effect=no_wait)
+    client = ClientSpy(0)
+    asyncio.run(AsyncClient(client, delay=0).run(max_jobs=2))
+    delays = [call.args[0] for call in sleep.call_args_list]
+    assert len(delays) == 2
+    assert all(3 < delay <= FAILED_FETCH_DELAY for delay in delays)
+
+
+def test_api_calls_are_spaced_by_delay(mocker):
+    client = ClientSpy(2)
+    client.release_saves.set()
+    sleep = mocker.patch('asyncio.sleep', side_effect=no_wait)
+
+    asyncio.run(AsyncClient(client, delay=3.6).run(max_jobs=2))
+    delays = [call.args[0] for call in sleep.call_args_list]
+    assert len(delays) == 2
+    assert all(0 < delay <= 3.6 for delay in delays)
+
+
+def test_failed_save_is_reported(capsys):
+    client = ClientSpy(1)
+
+    def failing_save(job, result):
+        raise NoJobsAvailableException
+    client.save_job = failing_save
+
+    asyncio.run(AsyncClient(client, delay=0).run(max_jobs=1))
+    assert capsys.readouterr().out == 'FAILURE: No Jobs Available.\n'
+
+
+def test_jobs_are_taken_on_one_thread():
+    client = ClientSpy(20)
+    client.release_saves.set()
+    asyncio.run(AsyncClient(client, delay=0).run(max_jobs=20))
+    assert len(client.saved) == 20
+    assert len(client.taken_on) == 1
@@ -1,5 +1,8 @@
 # pylint: disable=W0212
 import os
+import sys
+import threading
+from unittest.mock import MagicMock
 import responses
 from pytest import fixture
 import pytest
@@ -7,8 +10,13 @@ import requests_mock
 from requests.exceptions import ReadTimeout
 import boto3
 from mirrcore.path_generator import PathGenerator
-from mirrclient.client import Client, is_environment_variables_present
+import requests
+from mirrclient.client import Client, is_environment_variables_present, \
+    print_failure, exit_if_environment_variables_missing, \
+    get_prefetch_count, saver_from_environment, saves_flushed_on_exit, \
+    is_permanent_failure
 from mirrclient.exceptions import NoJobsAvailableException, APITimeoutException
+from mirrclient.write_behind_saver import WriteBehindSaver
 from mirrmock.mock_redis import ReadyRedis, InactiveRedis, MockRedisWithStorage
 from mirrmock.mock_job_queue import MockJobQueue
 
@@ -70,6 +78,18 @@ def test_client_has_no_id():
     assert is_environment_variables_present() is False
 
 
+def test_exit_if_environment_variables_missing(mocker):
+    mocker.patch('mirrclient.client.load_dotenv')
+    del os.environ['ID']
+    with pytest.raises(SystemExit):
+        exit_if_environment_variables_missing()
+
+
+def test_does_not_exit_with_environment_variables(mocker):
+    mocker.patch('mirrclient.client.load_dotenv')
+    exit_if_environment_variables_missing()
+
+
 def create_mock_mirrulations_bucket():
     conn = boto3.resource("s3", region_name="us-east-1")
     conn.create_bucket(Bucket="mirrulations")
@@ -118,6 +138,29 @@ def test_api_call_has_api_key(mock_requests):
         client._perform_job('http://regulations.gov/job')
 
 
+def test_api_call_takes_rate_limiter_token(mock_requests, mocker):
+    rate_limiter = mocker.Mock()
+    client = Client(MockRedisWithStorage(), MockJobQueue(), rate_limiter)
+    with mock_requests:
+        mock_requests.get('http://regulations.gov/job', json={})
+        response = client._perform_job('http://regulations.gov/job')
+    rate_limiter.acquire.assert_called_once()
+    rate_limiter.update.assert_called_once_with(response)
+
+
+def test_api_call_uses_key_from_key_pool(mock_requests, mocker):
+    rate_limiter = mocker.Mock()
+    client = Client(MockRedisWithStorage(), MockJobQueue(), rate_limiter)
+    client.key_pool = mocker.Mock()
+    client.key_pool.acquire.return_value = 'POOLED_KEY'
+    with mock_requests:
+        mock_requests.get('http://regulations.gov/job', json={})
+        response = client._perform_job('http://regulations.gov/job')
+        assert mock_requests.last_request.qs['api_key'] == ['pooled_key']
+    client.key_pool.update.assert_called_once_with('POOLED_KEY', response)
+    rate_limiter.acquire.assert_not_called()
+
+
 def test_cannot_connect_to_database():
     client = Client(InactiveRedis(), MockJobQueue())
     assert not client._can_connect_to_database()
@@ -142,6 +185,32 @@ def test_get_job_from_job_queue_gets_job():
     assert client._get_job_from_job_queue() == {'job': 'This is a job'}
 
 
+def test_push_mode_skips_polling_checks():
+    # InactiveRedis would fail the ping made when polling
+    client = Client(InactiveRedis(), MockJobQueue())
+    client.job_queue.prefetch_count = 4
+    client.job_queue.add_job({'job': 'This is a job'})
+    assert client._get_job_from_job_queue() == {'job': 'This is a job'}
+
+
+def test_no_job_returned_raises_exception(mocker):
+    job_queue = MockJobQueue()
+    job_queue.prefetch_count = 4
+    mocker.patch.object(job_queue, 'get_job', return_value=None)
+    client = Client(ReadyRedis(), job_queue)
+    with pytest.raises(NoJobsAvailableException):
+        client._get_job_from_job_queue()
+
+
+def test_prefetch_count_from_environment():
+    os.environ['PREFETCH_COUNT'] = '10'
+    assert get_prefetch_count() == 10
+    os.environ['PREFETCH_COUNT'] = '0'
+    assert get_prefetch_count() is None
+    del os.environ['PREFETCH_COUNT']
+    assert get_prefetch_count() == 4
+
+
 def test_get_job():
     client = Client(ReadyRedis(), MockJobQueue())
     client.job_queue = MockJobQueue()
@@ -153,19 +222,16 @@ def test_get_job():
         'agency': 'other_agency'
     }
     client.job_queue.add_job(job)
-    assert client._get_job() == job
+    assert client.take_job() == job
 
 
-def test_client_hsets_redis_values():
-    mock_redis = ReadyRedis()
-    client = Client(mock_redis, MockJobQueue())
-    mock_redis.set('jobs_in_progress', ['foo', 'var'])
-    mock_redis.set('client_jobs', ['foo', 'bar'])
+def test_client_leases_job_with_its_id():
+    client = Client(ReadyRedis(), MockJobQueue())
     job = {'job_id': 1,
            'url': 'fake.com'}
-    client._set_redis_values(job)
-    assert mock_redis.get('jobs_in_progress') == [1, 'fake.com']
-    assert mock_redis.get('client_jobs') == [1, '-1']
+    client.job_queue.add_job(job)
+    client._get_job_from_job_queue()
+    assert client.job_queue.leased == [(job, '-1')]
 
 
 # Document HTM Tests
@@ -223,9 +289,9 @@ def test_get_document_htm_returns_none():
 def test_client_downloads_document_htm(capsys, mocker):
     mocker.patch('mirrclient.disk_saver.DiskSaver.make_path',
                  return_value=None)
-    mocker.patch('mirrclient.disk_saver.DiskSaver.save_binary',
+    mocker.patch('mirrclient.disk_saver.DiskSaver.save_binary_file',
                  return_value=None)
-    mocker.patch('mirrclient.s3_saver.S3Saver.save_binary',
+    mocker.patch('mirrclient.s3_saver.S3Saver.save_binary_file',
                  return_value=None)
     mock_redis = ReadyRedis()
     client = Client(mock_redis, MockJobQueue())
@@ -269,7 +335,8 @@ def test_client_downloads_document_htm(capsys, mocker):
             '- http://downloads.regulations.gov/USTR-2015-0010-0001/'
             'content.htm to path:  '
             '/USTR/USTR-2015-0010/text-USTR-2015-0010/documents/'
-            '1_content.htm\n')
+            '1_content.htm\n'),
+        'SUCCESS: http://regulations.gov/documents complete.\n'
     ]
     assert captured.out == "".join(print_data)
 
@@ -292,14 +359,12 @@ def test_handles_none_in_comment_file_formats(path_generator):
     """
     Test for handling of the NoneType Error caused by null fileformats
     """
-    mock_redis = ReadyRedis()
-    client = Client(mock_redis, MockJobQueue())
+    client = Client(ReadyRedis(), MockJobQueue())
     client.api_key = 1234
-    client.job_queue.add_job({'job_id': 1,
-                              'url': 'http://regulations.gov/job',
-                              "job_type": "comments"})
-    mock_redis.set('jobs_in_progress', [1,
-                                        'http://regulations.gov/job'])
+    job = {'job_id': 1,
+           'url': 'http://regulations.gov/job',
+           "job_type": "comments"}
+    client.job_queue.add_job(job)
     test_json = {
                 "data": {
                     "id": "agencyID-001-0002",
@@ -317,9 +382,7 @@ def test_handles_none_in_comment_file_formats(path_generator):
     responses.add(responses.GET, 'http://regulations.gov/job',
                   json=test_json, status=200)
     client.job_operation()
-    assert mock_redis.get('jobs_in_progress') == [1,
-                                                  'http://regulations.gov/job']
-    assert mock_redis.get('client_jobs') == [1, '-1']
+    assert client.job_queue.completed == [(job, 0, 0)]
 
     attachment_paths = path_generator.get_attachment_json_paths(test_json)
     assert attachment_paths == []
@@ -337,7 +400,6 @@ def test_client_downloads_attachment_results(mocker, capsys):
     client.job_queue.add_job({'job_id': 1,
                               'url': 'http://regulations.gov/comments',
                               "job_type": "comments"})
-    mock_redis.set('jobs_in_progress', [1, 'http://regulations.gov/comments'])
 
     test_json = {
                 "data": {
@@ -366,10 +428,8 @@ def test_client_downloads_attachment_results(mocker, capsys):
                   json='\bx17', status=200)
 
     client.job_operation()
-    job_stat_results = client.cache.get_jobs_done()
-    assert job_stat_results['num_comments_done'] == 1
-    assert job_stat_results['num_attachments_done'] == 1
-    assert job_stat_results['num_pdf_attachments_done'] == 1
+    # The job is completed with its attachment and pdf attachment counts
+    assert client.job_queue.completed[0][1:] == (1, 1)
 
     captured = capsys.readouterr()
     print_data = [
@@ -382,7 +442,8 @@ def test_client_downloads_attachment_results(mocker, capsys):
         'Performing job.\n',
         'Downloading Job 1\n',
         'Found 1 attachment(s) for Comment - FDA-2016-D-2335-1566\n',
-        'Downloaded 1/1 attachment(s) for Comment - FDA-2016-D-2335-1566\n'
+        'Downloaded 1/1 attachment(s) for Comment - FDA-2016-D-2335-1566\n',
+        'SUCCESS: http://regulations.gov/comments complete.\n'
     ]
     assert captured.out == "".join(print_data)
 
@@ -455,17 +516,15 @@ def test_two_attachments_in_comment(mocker):
                   json=test_json, status=200)
 
     client.job_operation()
-    results = client.cache.get_jobs_done()
-    assert results['num_comments_done'] == 1
-    assert results['num_attachments_done'] == 2
-    assert results['num_pdf_attachments_done'] == 1
+    # The job is completed with its attachment and pdf attachment counts
+    assert client.job_queue.completed[0][1:] == (2, 1)
 
 
 # Exception Tests
 def test_get_job_is_empty():
     client = Client(ReadyRedis(), MockJobQueue())
     with pytest.raises(NoJobsAvailableException):
-        client._get_job()
+        client.take_job()
 
 
 def test_client_perform_job_times_out(mock_requests):
@@ -496,4 +555,158 @@ def test_client_handles_api_timeout():
     with pytest.raises(APITimeoutException):
         client.job_operation()
 
-    assert mock_redis.get('invalid_jobs') == [1, 'http://regulations.gov/job']
+    # A timeout may pass, so the job is queued again
+    assert [job['job_id'] for job in client.job_queue.retried] == [1]
+    assert not client.job_queue.failed
+
+
+@responses.activate
+def test_job_with_a_permanent_error_is_invalid():
+    client = Client(ReadyRedis(), MockJobQueue())
+    client.job_queue.add_job({'job_id': 1,
+                              'url': 'http://regulations.gov/job'})
+    responses.get("http://regulations.gov/job", status=404)
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.job_operation()
+    assert [job['job_id'] for job in client.job_queue.failed] == [1]
+    assert not client.job_queue.retried
+
+
+@pytest.mark.parametrize('error', [
+    requests.exceptions.HTTPError(response=MagicMock(status_code=429)),
+    requests.exceptions.HTTPError(response=MagicMock(status_code=503)),
+    requests.exceptions.ConnectionError(),
+    APITimeoutException(),
+    OSError('disk full')])
+def test_failures_that_may_pass_are_not_permanent(error):
+    assert not is_permanent_failure(error)
+
+
+@pytest.mark.parametrize('status', [400, 403, 404])
+def test_4xx_failures_are_permanent(status):
+    error = requests.exceptions.HTTPError(
+        response=MagicMock(status_code=status))
+    assert is_permanent_failure(error)
+
+
+def test_print_failure_prints_http_status(capsys):
+    response = requests.models.Response()
+    response.status_code = 503
+    print_failure(requests.exceptions.HTTPError('down', response=response))
+    assert '503 occurred: down' in capsys.readouterr().out
+
+
+def test_print_failure_prints_message_for_exception_type(capsys):
+    print_failure(APITimeoutException())
+    assert capsys.readouterr().out == 'FAILURE: Request to API timed out.\n'
+
+
+@responses.activate
+def test_single_attachment_is_streamed_to_saver(mocker):
+    mocker.stopall()
+    save_binary_file = mocker.patch(
+        'mirrclient.saver.Saver.save_binary_file', return_value=None)
+    responses.get('https://downloads.regulations.gov/1/attachment_1.pdf',
+                  body=b'\x17')
+    client = Client(ReadyRedis(), MockJobQueue())
+    client._download_single_attachment(
+        'https://downloads.regulations.gov/1/attachment_1.pdf',
+        '/USTR/USTR-1/binary-USTR-1/comments_attachments/1_attachment_1.pdf',
+        client.saver)
+    path, temp_path = save_binary_file.call_args.args
+    assert path == ('/data/USTR/USTR-1/binary-USTR-1/comments_attachments/'
+                    '1_attachment_1.pdf')
+    assert not os.path.exists(temp_path)
+
+
+@responses.activate
+def test_attachments_in_comment_download_concurrently(mocker):
+    # Each download waits until the other has started
+    both_started = threading.Barrier(2, timeout=5)
+    download = mocker.patch.object(Client, '_download_single_attachment',
+                                   side_effect=lambda url, path, saver:
+                                   both_started.wait())
+    client = Client(ReadyRedis(), MockJobQueue())
+    comment_json = {
+        "data": {
+            "id": "agencyID-001-0002",
+            "type": "comments",
+            "attributes": {"agencyId": "agencyID", "docketId": "agencyID-001"}
+        },
+        "included": [{
+            "attributes": {
+                "fileFormats": [
+                    {"fileUrl": "https://downloads.regulations.gov/1.pdf"},
+                    {"fileUrl": "https://downloads.regulations.gov/2.doc"}]
+            }
+        }]
+    }
+    urls = client._download_all_attachments_from_comment(comment_json,
+                                                         client.saver)
+    downloaded = sorted(call.args[:2] for call in download.call_args_list)
+    assert downloaded == [
+        ('https://downloads.regulations.gov/1.pdf',
+         '/agencyID/agencyID-001/binary-agencyID-001/comments_attachments/'
+         'agencyID-001-0002_1.pdf'),
+        ('https://downloads.regulations.gov/2.doc',
+         '/agencyID/agencyID-001/binary-agencyID-001/comments_attachments/'
+         'agencyID-001-0002_2.doc')]
+    assert sorted(urls) == ['https://downloads.regulations.gov/1.pdf',
+                            'https://downloads.regulations.gov/2.doc']
+
+
+def test_saver_from_environment(monkeypatch):
+    monkeypatch.setenv('STORAGE_COMPRESSION', 'gzip')
+    monkeypatch.setenv('BLOB_STORE', 'true')
+    monkeypatch.setenv('DISK_SYNC_FILES', '100')
+    monkeypatch.delenv('PACKED_STORAGE', raising=False)
+    disk_saver, s3_saver = saver_from_environment(None).savers
+    assert disk_saver.compression == s3_saver.compression == 'gzip'
+    assert disk_saver.blob_store is not None
+    assert s3_saver.blob_store is not None
+    assert disk_saver.group_sync.max_files == 100
+
+
+def test_saves_are_flushed_when_the_client_stops(mocker):
+    mocker.patch('signal.signal')
+    client = MagicMock()
+    with pytest.raises(SystemExit):
+        with saves_flushed_on_exit(client):
+            sys.exit(0)
+    client.saver.close.assert_called_once()
+
+
+DOCKET_JOB = {'job_id': 1, 'url': 'http://regulations.gov/job',
+              'job_type': 'dockets', 'reg_id': 'USTR-2015-0010',
+              'agency': 'USTR'}
+DOCKET_RESULT = {'data': {'id': 'USTR-2015-0010', 'type': 'dockets',
+                          'attributes': {'agencyId': 'USTR',
+                                         'docketId': 'USTR-2015-0010'}}}
+
+
+def test_job_is_completed_after_its_saves_are_written(mocker, capsys):
+    mocker.stopall()
+    client = Client(ReadyRedis(), MockJobQueue())
+    saver = MagicMock()
+    client.saver = WriteBehindSaver(saver)
+    client.save_job(DOCKET_JOB, DOCKET_RESULT)
+    client.saver.close()
+    assert saver.save_json.call_args.args[0] == \
+        '/data/USTR/USTR-2015-0010/text-USTR-2015-0010/docket/' \
+        'USTR-2015-0010.json'
+    assert client.job_queue.completed == [(DOCKET_JOB, 0, 0)]
+    assert 'SUCCESS: http://regulations.gov/job complete.' in \
+        capsys.readouterr().out
+
+
+def test_job_fails_when_its_saves_cannot_be_written(mocker, capsys):
+    mocker.stopall()
+    client = Client(ReadyRedis(), MockJobQueue())
+    saver = MagicMock()
+    saver.save_json.side_effect = OSError('disk full')
+    client.saver = WriteBehindSaver(saver, max_attempts=1)
+    client.save_job(DOCKET_JOB, DOCKET_RESULT)
+    client.saver.close()
+    assert not client.job_queue.completed
+    assert client.job_queue.retried == [DOCKET_JOB]
+    assert 'SUCCESS' not in capsys.readouterr().out
@@ -1,34 +1,14 @@
+import gzip
+import os
 from json import dumps
 from unittest.mock import patch, mock_open, MagicMock
-from pytest import fixture, mark
-from mirrclient.disk_saver import DiskSaver
-
-
-@fixture(name='save_duplicate_json')
-def mock_save_duplicate(mocker):
-    mocker.patch.object(
-        DiskSaver,
-        'save_duplicate_json',
-        return_value=None
-    )
-
-
-@fixture(name='duplicate_check')
-def mock_check_for_duplicate(mocker):
-    mocker.patch.object(
-        DiskSaver,
-        'check_for_duplicates',
-        return_value=None,
-    )
-
-
-@fixture(name='is_duplicate')
-def mock_is_duplicate(mocker):
-    mocker.patch.object(
-        DiskSaver,
-        'is_duplicate',
-        return_value=True
-    )
+import pytest
+from mirrclient.disk_saver import DiskSaver, json_digest, DIGEST_SUFFIX
+from mirrclient.group_sync import GroupSync
+from mirrcore.blob_store import BlobStore, file_digest
+from mirrcore.manifest import Manifest
+from mirrcore.temp_paths import TEMP_SUFFIX
+from mirrcore.compression import read_text
 
 
 def test_save_path_directory_does_not_already_exist():
@@ -49,120 +29,393 @@ def test_save_path_directory_already_exists(capsys):
         assert captured.out == print_data
 
 
-def test_save_json():
+def test_save_json(tmp_path):
     saver = DiskSaver()
-    path = '/USTR/file.json'
+    path = f'{tmp_path}/USTR/file.json'
     data = {'results': 'Hello world'}
-    with patch('mirrclient.disk_saver.open', mock_open()) as mocked_file:
-        with patch('os.makedirs') as mock_dir:
-            saver.save_json(path, data)
-            mock_dir.assert_called_once_with('/USTR')
-            mocked_file.assert_called_once_with(path, 'x', encoding='utf8')
-            mocked_file().write.assert_called_once_with(dumps(data['results']))
+    saver.save_json(path, data)
+    with open(path, encoding='utf8') as file:
+        assert file.read() == dumps(data['results'])
+
+
+def test_save_binary(tmp_path):
+    saver = DiskSaver()
+    path = f'{tmp_path}/USTR/file.pdf'
+    saver.save_binary(path, b'Some Binary')
+    with open(path, 'rb') as file:
+        assert file.read() == b'Some Binary'
+
+
+def test_save_text(tmp_path):
+    saver = DiskSaver()
+    path = f'{tmp_path}/USTR/file.txt'
+    saver.save_text(path, 'text')
+    with open(path, encoding='utf8') as file:
+        assert file.read() == 'text'
 
 
-def test_save_binary():
+def test_file_is_written_under_temporary_name_then_renamed(tmp_path):
     saver = DiskSaver()
-    path = '/USTR/file.pdf'
-    data = 'Some Binary'
-    with patch('mirrclient.disk_saver.open', mock_open()) as mocked_file:
-        with patch('os.makedirs') as mock_dir:
-            saver.save_binary(path, data)
-            mock_dir.assert_called_once_with('/USTR')
-            mocked_file.assert_called_once_with(path, 'wb')
-            mocked_file().write.assert_called_once_with(data)
+    path = f'{tmp_path}/file.txt'
+    with patch('os.replace', wraps=os.replace) as replace:
+        saver.save_text(path, 'text')
+    temp_path = replace.call_args.args[0]
+    assert replace.call_args.args[1] == path
+    assert os.path.basename(temp_path).startswith('.file.txt.')
+    assert temp_path.endswith(TEMP_SUFFIX)
+    assert os.listdir(tmp_path) == ['file.txt']
 
 
-def test_save_text():
+def test_failed_write_leaves_no_file(tmp_path):
     saver = DiskSaver()
-    path = '/USTR/file.txt'
-    data = 'text'
-    with patch('mirrclient.disk_saver.open', mock_open()) as mocked_file:
-        with patch('os.makedirs') as mock_dir:
-            saver.save_text(path, data)
-            mock_dir.assert_called_once_with('/USTR')
-            mocked_file.assert_called_once_with(path, 'w', encoding="utf-8")
-            mocked_file().write.assert_called_once_with(data)
+    path = f'{tmp_path}/file.txt'
+    with patch('os.replace', side_effect=OSError('killed')):
+        with pytest.raises(OSError):
+            saver.save_text(path, 'text')
+    assert not os.listdir(tmp_path)
+
+
+def test_existing_version_is_not_overwritten(tmp_path):
+    path = f'{tmp_path}/file(1).json'
+    (tmp_path / 'file(1).json').write_text('{}')
+    with pytest.raises(FileExistsError):
+        DiskSaver().save_to_disk(path, {'data': 1})
+    assert os.listdir(tmp_path) == ['file(1).json']
+
+
+def test_version_created_during_write_is_not_overwritten(tmp_path, mocker):
+    path = f'{tmp_path}/file(1).json'
+    write_body = mocker.patch('mirrclient.disk_saver._write_body')
+    # Another writer saves the same version while this one writes
+    write_body.side_effect = lambda temp_path, body: [
+        (tmp_path / 'file(1).json').write_text('{"first": 1}'),
+        (tmp_path / os.path.basename(temp_path)).write_bytes(body)]
+    with pytest.raises(FileExistsError):
+        DiskSaver().save_to_disk(path, {'data': 1})
+    assert os.listdir(tmp_path) == ['file(1).json']
+    assert (tmp_path / 'file(1).json').read_text() == '{"first": 1}'
+
+
+def test_file_is_moved_into_place_when_its_group_is_flushed(tmp_path):
+    saver = DiskSaver(manifest=MagicMock())
+    saver.group_sync = GroupSync(max_files=10)
+    saver.save_text(f'{tmp_path}/file.txt', 'text')
+    # Only the flushed temporary file is moved to its path
+    assert os.listdir(tmp_path)[0].endswith(TEMP_SUFFIX)
+    saver.manifest.record.assert_not_called()
+    saver.close()
+    assert os.listdir(tmp_path) == ['file.txt']
+    saver.manifest.record.assert_called_once_with(f'{tmp_path}/file.txt',
+                                                  size=4)
+
+
+def test_save_returns_future_done_once_file_is_in_place(tmp_path):
+    saver = DiskSaver()
+    saver.group_sync = GroupSync(max_files=10)
+    published = saver.save_text(f'{tmp_path}/file.txt', 'text')
+    assert not published.done()
+    saver.close()
+    assert published.result() == f'{tmp_path}/file.txt'
+
+
+def test_file_that_cannot_be_moved_fails_its_future(tmp_path, mocker):
+    saver = DiskSaver()
+    saver.group_sync = GroupSync(max_files=10)
+    published = saver.save_text(f'{tmp_path}/file.txt', 'text')
+    mocker.patch('os.replace', side_effect=OSError('disk is full'))
+    saver.close()
+    assert str(published.exception()) == 'disk is full'
+    assert os.listdir(tmp_path) == []
+
+
+def test_json_is_in_place_when_its_save_returns(tmp_path):
+    saver = DiskSaver()
+    saver.group_sync = GroupSync(max_files=10)
+    saver.save_json(f'{tmp_path}/file.json', {'results': {'data': 1}})
+    assert (tmp_path / 'file.json').read_text() == dumps({'data': 1})
+
+
+def test_json_waiting_for_its_group_is_seen_by_later_saves(tmp_path):
+    saver = DiskSaver()
+    saver.group_sync = GroupSync(max_files=10)
+    path = f'{tmp_path}/file.json'
+    saver.save_json(path, {'results': {'data': 1}})
+    saver.save_json(path, {'results': {'data': 1}})
+    saver.save_json(path, {'results': {'data': 2}})
+    saver.save_json(path, {'results': {'data': 2}})
+    saver.close()
+    assert sorted(os.listdir(tmp_path)) == \
+        ['file(1).json', 'file.json', f'file.json{DIGEST_SUFFIX}']
+    assert saver.read_digests(path) == \
+        [json_digest({'data': 1}), json_digest({'data': 2})]
 
 
 def test_is_duplicate_is_a_duplicate():
-    existing = {'is_duplicate': True}
-    new = {'is_duplicate': True}
     saver = DiskSaver()
-    is_duplicate = saver.is_duplicate(existing, new)
-    assert is_duplicate
+    assert saver.is_duplicate(['abc', 'def'], 'def')
 
 
 def test_is_duplicate_is_not_a_duplicate():
-    existing = {'is_duplicate': True}
-    new = {'is_duplicate': False}
     saver = DiskSaver()
-    is_duplicate = saver.is_duplicate(existing, new)
-    assert not is_duplicate
+    assert not saver.is_duplicate(['abc', 'def'], 'ghi')
+
+
+def test_json_digest_ignores_key_order():
+    assert json_digest({'a': 1, 'b': 2}) == json_digest({'b': 2, 'a': 1})
+    assert json_digest({'a': 1}) != json_digest({'a': 2})
 
 
 def test_open_json():
     saver = DiskSaver()
     path = 'data/USTR/file.json'
     data = {'results': 'Hello world'}
-    mock = mock_open(read_data=dumps(data))
-    with patch('mirrclient.disk_saver.open', mock) as mocked_file:
-        saver.open_json_file(path)
-        mocked_file.assert_called_once_with(path, encoding='utf8')
+    mock = mock_open(read_data=dumps(data).encode('utf8'))
+    with patch('mirrcore.compression.open', mock) as mocked_file:
+        assert saver.open_json_file(path) == data
+        mocked_file.assert_called_once_with(path, 'rb')
 
 
-def test_save_duplicate_json():
-    path = 'data/USTR/file.json'
+def test_save_duplicate_json(tmp_path):
+    path = f'{tmp_path}/file.json'
     data = {'data': 'Hello world'}
+    DiskSaver().save_duplicate_json(path, data, 1)
+    with open(f'{tmp_path}/file(1).json', encoding='utf8') as file:
+        assert file.read() == dumps(data)
+
+
+def test_save_json_writes_digest_file(tmp_path):
+    path = f'{tmp_path}/USTR/file.json'
+    DiskSaver().save_json(path, {'results': {'data': 'Hello world'}})
+    with open(f'{path}{DIGEST_SUFFIX}', encoding='utf8') as file:
+        assert file.read() == f"{json_digest({'data': 'Hello world'})}\n"
+
+
+def test_do_not_save_duplicate_data(tmp_path, capsys, mocker):
+    path = f'{tmp_path}/USTR/file.json'
     saver = DiskSaver()
-    mock = MagicMock()
-    mock.mock_open()
-    with patch('mirrclient.disk_saver.open', mock) as mocked_file:
-        saver.save_duplicate_json(path, data, 1)
-        mocked_file.assert_called_once_with(f'data/USTR/file({1}).json', 'x',
-                                            encoding='utf8')
+    saver.save_json(path, {'results': {'data': 'Hello world'}})
+    open_json_file = mocker.spy(saver, 'open_json_file')
+    saver.save_json(path, {'results': {'data': 'Hello world'}})
+    assert 'Data is a duplicate' in capsys.readouterr().out
+    # The digest file answers the question without parsing the json
+    open_json_file.assert_not_called()
+    assert sorted(os.listdir(f'{tmp_path}/USTR')) == \
+        ['file.json', f'file.json{DIGEST_SUFFIX}']
 
 
-@mark.usefixtures("duplicate_check")
-def test_do_not_save_duplicate_data(capsys):
-    path = '/USTR/file.json'
-    data = {'results': {'data': 'Hello world'}}
+def test_changed_data_is_saved_as_next_version(tmp_path):
+    path = f'{tmp_path}/USTR/file.json'
     saver = DiskSaver()
-    mock = MagicMock()
-    mock.return_value(True)
-    with patch('os.path.exists', mock):
-        with patch('os.makedirs') as mock_dir:
-            saver.save_json(path, data)
-            mock_dir.assert_called_once_with('/USTR')
-            print_data = ''
-            captured = capsys.readouterr()
-            assert captured.out == print_data
+    for version in range(3):
+        saver.save_json(path, {'results': {'data': version}})
+    saver.save_json(path, {'results': {'data': 1}})
+    assert sorted(os.listdir(f'{tmp_path}/USTR')) == \
+        ['file(1).json', 'file(2).json', 'file.json',
+         f'file.json{DIGEST_SUFFIX}']
+    assert saver.open_json_file(f'{tmp_path}/USTR/file(2).json') == \
+        {'data': 2}
 
 
-@mark.usefixtures("duplicate_check")
-def test_do_not_save_duplicate_json_data(capsys):
-    path = 'data/USTR/file.json'
-    data = {'results': {'data': 'Hello world'}}
+def test_digest_cut_off_while_it_was_added_is_removed(tmp_path):
+    path = f'{tmp_path}/USTR/file.json'
     saver = DiskSaver()
-    mock = MagicMock()
-    mock.return_value(True)
-    with patch('os.path.exists', mock):
-        saver.save_duplicate_json(path, data, 1)
-        print_data = ''
-        captured = capsys.readouterr()
-        assert captured.out == print_data
+    saver.save_json(path, {'results': {'data': 0}})
+    with open(f'{path}{DIGEST_SUFFIX}', 'a', encoding='utf8') as file:
+        file.write(json_digest({'data': 1})[:10])
+    saver.save_json(path, {'results': {'data': 2}})
+    assert saver.read_digests(path) == \
+        [json_digest({'data': 0}), json_digest({'data': 2})]
+    assert saver.open_json_file(f'{tmp_path}/USTR/file(1).json') == \
+        {'data': 2}
 
 
-@mark.usefixtures("is_duplicate")
-def test_check_for_duplicates(capsys):
-    path = 'data/USTR/file.json'
-    data = {'data': 'Hello world'}
+def test_digest_file_is_built_for_existing_versions(tmp_path):
+    directory = tmp_path / 'USTR'
+    directory.mkdir()
+    # Versions saved before digest files were written
+    (directory / 'file.json').write_text(dumps({'data': 0}))
+    (directory / 'file(1).json').write_text(dumps({'data': 1}))
+    (directory / 'file(1)(2).json').write_text(dumps({'data': 2}))
     saver = DiskSaver()
-    mock = mock_open(read_data=dumps(data))
-    with patch('mirrclient.disk_saver.open', mock) as mocked_file:
-        saver.open_json_file(path)
-        mocked_file.assert_called_once_with(path, encoding='utf8')
-        saver.check_for_duplicates(path, data, 1)
-        print_data = ''
-        captured = capsys.readouterr()
-        assert captured.out == print_data
+    path = f'{directory}/file.json'
+    assert saver.read_digests(path) == [json_digest({'data': i})
+                                        for i in range(3)]
+    saver.save_json(path, {'results': {'data': 2}})
+    saver.save_json(path, {'results': {'data': 3}})
+    assert saver.open_json_file(f'{directory}/file(3).json') == {'data': 3}
+
+
+def test_version_saved_without_its_digest_is_added(tmp_path):
+    path = f'{tmp_path}/USTR/file.json'
+    saver = DiskSaver()
+    saver.save_json(path, {'results': {'data': 0}})
+    # Killed after saving version 1 and before adding its digest
+    saver.save_to_disk(f'{tmp_path}/USTR/file(1).json', {'data': 1})
+    saver.save_json(path, {'results': {'data': 1}})
+    saver.save_json(path, {'results': {'data': 2}})
+    assert saver.read_digests(path) == [json_digest({'data': i})
+                                        for i in range(3)]
+    assert saver.open_json_file(f'{tmp_path}/USTR/file(2).json') == \
+        {'data': 2}
+
+
+def test_first_version_saved_without_its_digest_is_added(tmp_path):
+    path = f'{tmp_path}/USTR/file.json'
+    saver = DiskSaver()
+    saver.save_json(path, {'results': {'data': 0}})
+    # Killed after creating the digest file and before writing to it
+    with open(f'{path}{DIGEST_SUFFIX}', 'w', encoding='utf8'):
+        pass
+    saver.save_json(path, {'results': {'data': 1}})
+    assert saver.read_digests(path) == [json_digest({'data': i})
+                                        for i in range(2)]
+
+
+def test_versioned_path_keeps_name_ending_in_json_characters(tmp_path):
+    DiskSaver().save_duplicate_json(f'{tmp_path}/session.json', {}, 1)
+    assert os.listdir(tmp_path) == ['session(1).json']
+
+
+def test_save_binary_file(tmp_path):
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17' * 100)
+    path = f'{tmp_path}/USTR/file.pdf'
+    DiskSaver().save_binary_file(path, str(source))
+    with open(path, 'rb') as file:
+        assert file.read() == b'\x17' * 100
+
+
+def test_saves_are_recorded_in_manifest(tmp_path):
+    manifest = MagicMock()
+    manifest.is_complete.return_value = False
+    saver = DiskSaver(manifest)
+    data = {'data': {'id': 'USTR-1', 'type': 'dockets',
+                     'attributes': {'lastModifiedDate': '2020-01-01'}}}
+    saver.save_json(f'{tmp_path}/USTR/file.json', {'results': data})
+    manifest.record.assert_called_once_with(
+        f'{tmp_path}/USTR/file.json', size=len(dumps(data)),
+        digest=json_digest(data), item_id='USTR-1', item_type='dockets',
+        last_modified='2020-01-01')
+    saver.save_text(f'{tmp_path}/USTR/file.txt', 'text')
+    manifest.record.assert_called_with(f'{tmp_path}/USTR/file.txt', size=4)
+
+
+def test_compressed_json_and_text_keep_their_names(tmp_path):
+    path = f'{tmp_path}/USTR/file.json'
+    saver = DiskSaver(compression='gzip')
+    saver.save_json(path, {'results': {'data': 0}})
+    saver.save_json(path, {'results': {'data': 0}})
+    saver.save_json(path, {'results': {'data': 1}})
+    saver.save_text(f'{tmp_path}/USTR/file.txt', 'text')
+    assert sorted(os.listdir(f'{tmp_path}/USTR')) == \
+        ['file(1).json', 'file.json', f'file.json{DIGEST_SUFFIX}',
+         'file.txt']
+    with open(path, 'rb') as file:
+        assert gzip.decompress(file.read()) == b'{"data": 0}'
+    assert saver.open_json_file(f'{tmp_path}/USTR/file(1).json') == \
+        {'data': 1}
+    assert read_text(f'{tmp_path}/USTR/file.txt') == 'text'
+
+
+def test_uncompressed_json_is_read_by_compressing_saver(tmp_path):
+    directory = tmp_path / 'USTR'
+    directory.mkdir()
+    # Saved before compression was turned on
+    (directory / 'file.json').write_text(dumps({'data': 0}))
+    saver = DiskSaver(compression='gzip')
+    path = f'{directory}/file.json'
+    assert saver.read_digests(path) == [json_digest({'data': 0})]
+    saver.save_json(path, {'results': {'data': 0}})
+    assert sorted(os.listdir(directory)) == \
+        ['file.json', f'file.json{DIGEST_SUFFIX}']
+
+
+def test_identical_binary_files_are_linked_to_one_blob(tmp_path):
+    manifest = MagicMock()
+    saver = DiskSaver(manifest)
+    saver.blob_store = BlobStore(str(tmp_path))
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17' * 100)
+    saver.save_binary_file(f'{tmp_path}/USTR/a.pdf', str(source))
+    saver.save_binary_file(f'{tmp_path}/USTR/b.pdf', str(source))
+    stat_a = os.stat(f'{tmp_path}/USTR/a.pdf')
+    assert stat_a.st_ino == os.stat(f'{tmp_path}/USTR/b.pdf').st_ino
+    assert stat_a.st_nlink == 3
+    manifest.record.assert_called_with(
+        f'{tmp_path}/USTR/b.pdf', size=100, digest=file_digest(source))
+
+
+def test_blob_waiting_for_its_group_is_linked_once_in_place(tmp_path):
+    saver = DiskSaver()
+    saver.blob_store = BlobStore(str(tmp_path))
+    saver.group_sync = GroupSync(max_files=10)
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17' * 100)
+    saver.save_binary_file(f'{tmp_path}/USTR/a.pdf', str(source))
+    assert not os.path.exists(f'{tmp_path}/USTR/a.pdf')
+    saver.save_binary_file(f'{tmp_path}/USTR/b.pdf', str(source))
+    saver.close()
+    assert os.stat(f'{tmp_path}/USTR/a.pdf').st_nlink == 3
+
+
+def complete_manifest(root):
+    manifest = Manifest(str(root))
+    manifest.rebuild()
+    return manifest
+
+
+def test_complete_manifest_is_asked_if_json_was_saved(tmp_path, mocker):
+    saver = DiskSaver(complete_manifest(tmp_path))
+    path = f'{tmp_path}/USTR/file.json'
+    exists = mocker.spy(os.path, 'exists')
+    saver.save_json(path, {'results': {'data': 1}})
+    saver.save_json(path, {'results': {'data': 1}})
+    assert path not in [call.args[0] for call in exists.call_args_list]
+    assert saver.manifest.has_path(path)
+    assert not os.path.exists(f'{tmp_path}/USTR/file(1).json')
+
+
+def test_json_missing_from_manifest_is_not_overwritten(tmp_path):
+    saver = DiskSaver(complete_manifest(tmp_path))
+    os.makedirs(f'{tmp_path}/USTR')
+    # Saved, but its record was lost
+    (tmp_path / 'USTR' / 'file.json').write_text(dumps({'data': 1}))
+    saver.save_json(f'{tmp_path}/USTR/file.json', {'results': {'data': 2}})
+    assert (tmp_path / 'USTR' / 'file.json').read_text() == \
+        dumps({'data': 1})
+    assert (tmp_path / 'USTR' / 'file(1).json').read_text() == \
+        dumps({'data': 2})
+
+
+def test_incomplete_manifest_is_not_asked(tmp_path, mocker):
+    saver = DiskSaver(Manifest(str(tmp_path)))
+    has_path = mocker.spy(saver.manifest, 'has_path')
+    saver.save_json(f'{tmp_path}/USTR/file.json', {'results': {'data': 1}})
+    has_path.assert_not_called()
+
+
+def test_json_missing_from_manifest_is_versioned_with_group_sync(tmp_path):
+    saver = DiskSaver(complete_manifest(tmp_path))
+    saver.group_sync = GroupSync(max_files=10)
+    os.makedirs(f'{tmp_path}/USTR')
+    (tmp_path / 'USTR' / 'file.json').write_text(dumps({'data': 1}))
+    saver.save_json(f'{tmp_path}/USTR/file.json', {'results': {'data': 2}})
+    assert (tmp_path / 'USTR' / 'file(1).json').read_text() == \
+        dumps({'data': 2})
+    assert saver.read_digests(f'{tmp_path}/USTR/file.json') == \
+        [json_digest({'data': 1}), json_digest({'data': 2})]
+
+
+def test_complete_manifest_records_digests_instead_of_digest_file(tmp_path,
+                                                                  mocker):
+    saver = DiskSaver(complete_manifest(tmp_path))
+    path = f'{tmp_path}/USTR/file.json'
+    saver.save_json(path, {'results': {'data': 1}})
+    saver.save_json(path, {'results': {'data': 2}})
+    open_json_file = mocker.spy(saver, 'open_json_file')
+    saver.save_json(path, {'results': {'data': 2}})
+    open_json_file.assert_not_called()
+    assert sorted(os.listdir(f'{tmp_path}/USTR')) == \
+        ['file(1).json', 'file.json']
+    assert saver.read_digests(path) == \
+        [json_digest({'data': 1}), json_digest({'data': 2})]
@@ -0,0 +1,108 @@
+import threading
+import pytest
+from mirrclient.group_sync import GroupSync, group_sync_from_environment
+
+
+def write_files(directory, count):
+    paths = [f'{directory}/{i}.json' for i in range(count)]
+    for path in paths:
+        with open(path, 'w', encoding='utf8') as file:
+            file.write('{}')
+    return paths
+
+
+def test_sync_after_max_files(mocker, tmp_path):
+    fsync = mocker.patch('os.fsync')
+    group_sync = GroupSync(max_files=3)
+    for path in write_files(tmp_path, 7):
+        group_sync.add(path)
+    # Two flushes of three files and their directory
+    assert fsync.call_count == 8
+    assert group_sync.pending == [(f'{tmp_path}/6.json', None)]
+
+
+def test_sync_every_max_delay_without_writes(tmp_path):
+    group_sync = GroupSync(max_delay_ms=10)
+    moved = threading.Event()
+    path = write_files(tmp_path, 1)[0]
+    group_sync.add(path, lambda: moved.set() or path)
+    # Flushed by the timer although nothing else is written
+    assert moved.wait(5)
+    group_sync.close()
+    assert not group_sync.pending
+
+
+def test_temporary_files_are_flushed_before_they_are_moved(mocker):
+    calls = []
+    mocker.patch('mirrclient.group_sync._fsync', side_effect=calls.append)
+    group_sync = GroupSync(max_files=10)
+    group_sync.add('/data/a/.1.json.tmp', lambda: calls.append('moved 1')
+                   or '/data/a/1.json')
+    group_sync.add('/data/b/2.json')
+    group_sync.sync()
+    assert calls == ['/data/a/.1.json.tmp', '/data/b/2.json', 'moved 1',
+                     '/data/a', '/data/b']
+
+
+def test_failed_move_does_not_stop_the_others(mocker, capsys):
+    fsync = mocker.patch('mirrclient.group_sync._fsync')
+    group_sync = GroupSync(max_files=10)
+
+    def fail():
+        raise FileExistsError('exists')
+    group_sync.add('/data/a/.1.json.tmp', fail)
+    group_sync.add('/data/a/.2.json.tmp', lambda: '/data/a/2.json')
+    group_sync.sync()
+    assert 'FAILURE: could not move /data/a/.1.json.tmp into place' in \
+        capsys.readouterr().out
+    assert fsync.call_args.args[0] == '/data/a'
+
+
+def test_sync_flushes_pending_files_only(mocker, tmp_path):
+    fsync = mocker.patch('os.fsync')
+    group_sync = GroupSync(max_files=10)
+    group_sync.sync()
+    fsync.assert_not_called()
+    group_sync.add(write_files(tmp_path, 1)[0])
+    group_sync.sync()
+    assert fsync.call_count == 2
+
+
+def test_sync_flushes_each_file_once_then_its_directory(mocker):
+    fsync = mocker.patch('mirrclient.group_sync._fsync')
+    group_sync = GroupSync(max_files=10)
+    for path in ['/data/a/1.json', '/data/a/1.json', '/data/b/2.json']:
+        group_sync.add(path)
+    group_sync.sync()
+    assert [call.args[0] for call in fsync.call_args_list] == \
+        ['/data/a/1.json', '/data/b/2.json', '/data/a', '/data/b']
+
+
+def test_removed_file_is_skipped(tmp_path):
+    group_sync = GroupSync(max_files=10)
+    group_sync.add(f'{tmp_path}/removed.json')
+    group_sync.add(write_files(tmp_path, 1)[0])
+    group_sync.sync()
+    assert not group_sync.pending
+
+
+def test_group_sync_is_read_from_environment(monkeypatch):
+    monkeypatch.delenv('DISK_SYNC_FILES', raising=False)
+    monkeypatch.delenv('DISK_SYNC_MS', raising=False)
+    assert group_sync_from_environment() is None
+    monkeypatch.setenv('DISK_SYNC_FILES', '100')
+    group_sync = group_sync_from_environment()
+    assert group_sync.max_files == 100
+    assert group_sync.max_delay == 0
+
+
+def test_files_that_could_not_be_flushed_are_kept(mocker, tmp_path):
+    mocker.patch('os.fsync', side_effect=OSError('I/O error'))
+    group_sync = GroupSync(max_files=10)
+    path = write_files(tmp_path, 1)[0]
+    publish = mocker.Mock(return_value=path)
+    group_sync.add(path, publish)
+    with pytest.raises(OSError):
+        group_sync.sync()
+    publish.assert_not_called()
+    assert group_sync.pending == [(path, publish)]
@@ -0,0 +1,135 @@
+import threading
+import pytest
+import requests
+from mirrclient.multi_key_client import MultiKeyClient, get_api_keys, \
+    get_worker_count, get_download_connections
+from mirrclient.exceptions import NoJobsAvailableException
+from mirrclient.client import FAILED_FETCH_DELAY
+
+
+class ClientSpy:
+    """
+    Stands in for a Client. API calls block until `release_calls` is
+    set so tests can check how many jobs are in progress at once.
+    """
+    def __init__(self, num_jobs):
+        self.jobs = [{'job_id': i, 'url': f'http://a.b.c/{i}'}
+                     for i in range(num_jobs)]
+        self.taken = []
+        self.saved = []
+        self.release_calls = threading.Event()
+        self.release_calls.set()
+
+    def take_job(self):
+        if not self.jobs:
+            raise NoJobsAvailableException
+        job = self.jobs.pop(0)
+        self.taken.append(job['job_id'])
+        return job
+
+    def fetch_result(self, job):
+        self.release_calls.wait(5)
+        return {'data': job['job_id']}
+
+    def save_job(self, job, result):
+        self.saved.append((job['job_id'], result['data']))
+
+
+def test_get_api_keys_from_list(monkeypatch):
+    monkeypatch.setenv('API_KEYS', 'KEY_1, KEY_2,,KEY_3')
+    monkeypatch.setenv('API_KEY', 'UNUSED')
+    assert get_api_keys() == ['KEY_1', 'KEY_2', 'KEY_3']
+
+
+def test_get_api_keys_falls_back_to_single_key(monkeypatch):
+    monkeypatch.delenv('API_KEYS', raising=False)
+    monkeypatch.setenv('API_KEY', 'KEY_1')
+    assert get_api_keys() == ['KEY_1']
+
+
+def test_get_api_keys_without_keys(monkeypatch):
+    monkeypatch.delenv('API_KEYS', raising=False)
+    monkeypatch.delenv('API_KEY', raising=False)
+    assert get_api_keys() == []
+
+
+def test_worker_count(monkeypatch):
+    monkeypatch.delenv('CLIENT_WORKERS', raising=False)
+    assert get_worker_count(3) == 6
+    monkeypatch.setenv('CLIENT_WORKERS', '10')
+    assert get_worker_count(3) == 10
+
+
+def test_download_connections(monkeypatch):
+    monkeypatch.delenv('DOWNLOAD_CONNECTIONS', raising=False)
+    # Each of the six workers may download eight attachments at once
+    assert get_download_connections(6) == 48
+    # At least as many as the connections kept open
+    assert get_download_connections(0) == 8
+    monkeypatch.setenv('DOWNLOAD_CONNECTIONS', '20')
+    assert get_download_connections(6) == 20
+
+
+def test_all_jobs_are_performed_and_saved():
+    client = ClientSpy(5)
+    MultiKeyClient(client, workers=2).run(max_jobs=5)
+    assert sorted(client.saved) == [(i, i) for i in range(5)]
+
+
+def test_workers_limit_jobs_in_progress():
+    client = ClientSpy(3)
+    client.release_calls.clear()
+    multi_key_client = MultiKeyClient(client, workers=2)
+    runner = threading.Thread(target=multi_key_client.run,
+                              kwargs={'max_jobs': 3})
+    runner.start()
+    runner.join(0.2)
+    # The third job waits for one of the first two to finish
+    assert client.taken == [0, 1]
+    client.release_calls.set()
+    runner.join(5)
+    assert client.taken == [0, 1, 2]
+
+
+def test_jobs_in_progress_finish_when_taking_jobs_stops():
+    client = ClientSpy(2)
+    client.release_calls.clear()
+    take_job = client.take_job
+
+    def stop_on_second_job():
+        if client.taken:
+            # SIGTERM raises SystemExit while the first job is in progress
+            threading.Timer(0.1, client.release_calls.set).start()
+            raise SystemExit(0)
+        return take_job()
+    client.take_job = stop_on_second_job
+    with pytest.raises(SystemExit):
+        MultiKeyClient(client, workers=2).run()
+    assert client.saved == [(0, 0)]
+
+
+def test_no_jobs_waits_before_trying_again(mocker, capsys):
+    sleep = mocker.patch('time.sleep')
+    client = ClientSpy(0)
+    MultiKeyClient(client, workers=2).run(max_jobs=1)
+    sleep.assert_called_once_with(FAILED_FETCH_DELAY)
+    assert 'FAILURE: No Jobs Available.' in capsys.readouterr().out
+
+
+def test_failed_api_call_is_printed(mocker, capsys):
+    client = ClientSpy(1)
+    response = requests.models.Response()
+    response.status_code = 500
+    mocker.patch.object(client, 'fetch_result',
+                        side_effect=requests.exceptions.HTTPError(
+                            response=response))
+    MultiKeyClient(client, workers=1).run(max_jobs=1)
+    assert 'FAILURE: HTTP error' in capsys.readouterr().out
+    assert not client.saved
+
+
+def test_unexpected_error_is_printed(mocker, capsys):
+    client = ClientSpy(1)
+    mocker.patch.object(client, 'save_job', side_effect=OSError('disk full'))
+    MultiKeyClient(client, workers=1).run(max_jobs=1)
+    assert 'FAILURE: Unexpected error: disk full' in capsys.readouterr().out
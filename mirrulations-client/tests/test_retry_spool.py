@@ -0,0 +1,145 @@
+import os
+from unittest.mock import MagicMock
+from mirrclient.disk_saver import DiskSaver
+from mirrclient.retry_spool import RetrySpool
+
+
+def test_retry_writes_spooled_saves():
+    saver = MagicMock()
+    spool = RetrySpool()
+    spool.add(saver, 'save_json', '/data/a.json', {'data': 1})
+    assert spool.retry() == 1
+    saver.save_json.assert_called_once_with('/data/a.json', {'data': 1})
+    assert len(spool) == 0
+
+
+def test_save_failing_again_stays_spooled():
+    saver = MagicMock()
+    saver.save_json.side_effect = OSError('S3 is down')
+    spool = RetrySpool()
+    spool.add(saver, 'save_json', '/data/a.json', {})
+    assert spool.retry() == 0
+    assert len(spool) == 1
+
+
+def test_retry_if_due_waits_for_interval():
+    saver = MagicMock()
+    spool = RetrySpool(retry_interval=3600)
+    spool.add(saver, 'save_text', '/data/a.txt', 'text')
+    spool.retry_if_due()
+    saver.save_text.assert_not_called()
+
+
+def test_binary_file_is_staged_until_retried(tmp_path):
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17')
+    written = []
+    saver = MagicMock()
+
+    def read(_, file_path):
+        with open(file_path, 'rb') as file:
+            written.append(file.read())
+    saver.save_binary_file.side_effect = read
+    spool = RetrySpool()
+    spool.add(saver, 'save_binary_file', '/data/a.pdf', str(source))
+    os.remove(source)
+    spool.retry()
+    assert written == [b'\x17']
+    assert not os.path.exists(saver.save_binary_file.call_args.args[1])
+
+
+def test_oldest_save_is_dropped_when_full(capsys):
+    saver = MagicMock()
+    spool = RetrySpool(max_entries=1)
+    spool.add(saver, 'save_text', '/data/a.txt', 'a')
+    spool.add(saver, 'save_text', '/data/b.txt', 'b')
+    assert [entry[2] for entry in spool.entries] == ['/data/b.txt']
+    assert 'dropped spooled save of /data/a.txt' in capsys.readouterr().out
+
+
+def test_dropped_save_is_reported():
+    on_dropped = MagicMock()
+    spool = RetrySpool(max_entries=1)
+    spool.on_dropped = on_dropped
+    spool.add(MagicMock(), 'save_text', '/data/a.txt', 'a')
+    spool.add(MagicMock(), 'save_text', '/data/b.txt', 'b')
+    on_dropped.assert_called_once_with('/data/a.txt')
+
+
+def test_close_without_directory_drops_saves():
+    on_dropped = MagicMock()
+    spool = RetrySpool()
+    spool.on_dropped = on_dropped
+    spool.add(MagicMock(), 'save_text', '/data/a.txt', 'a')
+    spool.close()
+    on_dropped.assert_called_once_with('/data/a.txt')
+
+
+def test_saves_kept_on_close_are_loaded(tmp_path):
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17')
+    spool = RetrySpool(directory=str(tmp_path / 'spool'))
+    spool.add(MagicMock(), 'save_json', '/data/a.json', {'data': 1})
+    spool.add(MagicMock(), 'save_binary', '/data/b.pdf', b'\x18')
+    spool.add(MagicMock(), 'save_binary_file', '/data/c.pdf', str(source))
+    spool.close()
+    saver = MagicMock()
+    loaded = RetrySpool(directory=str(tmp_path / 'spool'))
+    loaded.load([saver])
+    assert [entry[1:3] for entry in loaded.entries] == \
+        [('save_json', '/data/a.json'), ('save_binary_file', '/data/b.pdf'),
+         ('save_binary_file', '/data/c.pdf')]
+    assert loaded.entries[0][3] == {'data': 1}
+    with open(loaded.entries[1][3], 'rb') as file:
+        assert file.read() == b'\x18'
+    assert loaded.retry() == 3
+    saver.save_json.assert_called_once_with('/data/a.json', {'data': 1})
+    # The binary files are removed once they are written
+    assert os.listdir(tmp_path / 'spool') == ['spool.jsonl']
+
+
+def test_saves_for_a_saver_no_longer_used_are_dropped(tmp_path):
+    spool = RetrySpool(directory=str(tmp_path))
+    spool.add(DiskSaver(), 'save_text', '/data/a.txt', 'a')
+    spool.close()
+    on_dropped = MagicMock()
+    loaded = RetrySpool(directory=str(tmp_path))
+    loaded.on_dropped = on_dropped
+    loaded.load([MagicMock()])
+    assert len(loaded) == 0
+    on_dropped.assert_called_once_with('/data/a.txt')
+
+
+def test_saves_are_kept_as_they_are_spooled(tmp_path):
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17')
+    spool = RetrySpool(directory=str(tmp_path / 'spool'))
+    spool.add(MagicMock(), 'save_json', '/data/a.json', {'data': 1})
+    spool.add(MagicMock(), 'save_binary_file', '/data/b.pdf', str(source))
+    os.remove(source)
+    # Killed without close()
+    loaded = RetrySpool(directory=str(tmp_path / 'spool'))
+    loaded.load([MagicMock()])
+    assert [entry[2] for entry in loaded.entries] == \
+        ['/data/a.json', '/data/b.pdf']
+    with open(loaded.entries[1][3], 'rb') as file:
+        assert file.read() == b'\x17'
+
+
+def test_retried_saves_are_no_longer_kept(tmp_path):
+    spool = RetrySpool(directory=str(tmp_path))
+    spool.add(MagicMock(), 'save_json', '/data/a.json', {'data': 1})
+    spool.retry()
+    loaded = RetrySpool(directory=str(tmp_path))
+    loaded.load([MagicMock()])
+    assert len(loaded) == 0
+
+
+def test_save_cut_off_while_it_was_kept_is_skipped(tmp_path):
+    spool = RetrySpool(directory=str(tmp_path))
+    spool.add(MagicMock(), 'save_json', '/data/a.json', {'data': 1})
+    with open(tmp_path / 'spool.jsonl', 'a', encoding='utf8') as file:
+        file.write('{"saver": "Mag')
+    loaded = RetrySpool(directory=str(tmp_path))
+    loaded.load([MagicMock()])
+    assert [entry[2] for entry in loaded.entries] == ['/data/a.json']
@@ -1,8 +1,20 @@
+import gzip
+import hashlib
+import json
 import os
+from unittest.mock import MagicMock
 import boto3
 from moto import mock_s3
 from pytest import fixture
-from mirrclient.s3_saver import S3Saver
+from mirrclient.s3_saver import S3Saver, MULTIPART_CHUNK_SIZE
+from mirrcore.blob_store import BlobStore
+from mirrcore.manifest import Manifest
+
+
+def sha256_hex(body):
+    if isinstance(body, str):
+        body = body.encode('utf8')
+    return hashlib.sha256(body).hexdigest()
 
 
 def create_mock_mirrulations_bucket():
@@ -80,11 +92,10 @@ def test_save_binary_to_bucket():
     s3_bucket = S3Saver(bucket_name="test-mirrulations1")
     test_data = b'\x17'
     test_path = "data/test.binary"
-    response = s3_bucket.save_binary(test_path, test_data)
+    assert s3_bucket.save_binary(test_path, test_data)
     body = conn.Object("test-mirrulations1",
                        "data/test.binary").get()["Body"].read().decode("utf-8")
     assert body == '\x17'
-    assert response["ResponseMetadata"]['HTTPStatusCode'] == 200
 
 
 @mock_s3
@@ -122,3 +133,177 @@ def test_save_text_to_s3_no_credentials_returns_false(capsys):
     assert S3Saver().save_text("test", "test") is False
     assert capsys.readouterr().out == "No AWS credentials provided, "\
                                       "Unable to write to S3.\n"
+
+
+@mock_s3
+def test_save_binary_file_to_bucket(tmp_path):
+    conn = create_mock_mirrulations_bucket()
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17')
+    s3_bucket = S3Saver(bucket_name="test-mirrulations1")
+    assert s3_bucket.save_binary_file("/data/USTR/test.pdf", str(source))
+    body = conn.Object("test-mirrulations1",
+                       "USTR/test.pdf").get()["Body"].read()
+    assert body == b'\x17'
+
+
+def test_save_binary_file_to_s3_no_credentials_returns_false():
+    del os.environ['AWS_ACCESS_KEY']
+    del os.environ['AWS_SECRET_ACCESS_KEY']
+    assert S3Saver().save_binary_file("test", "test") is False
+
+
+@mock_s3
+def test_uploads_are_recorded_in_manifest(tmp_path):
+    create_mock_mirrulations_bucket()
+    manifest = MagicMock()
+    manifest.get.return_value = None
+    s3_bucket = S3Saver(bucket_name="test-mirrulations1", manifest=manifest)
+    results = {"data": {"id": "USTR-1", "type": "dockets"}}
+    s3_bucket.save_json("/data/USTR/test.json", {"results": results})
+    manifest.record.assert_called_once_with(
+        '/USTR/test.json', 's3', digest=sha256_hex(json.dumps(results)),
+        item_id='USTR-1', item_type='dockets', last_modified=None)
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17')
+    s3_bucket.save_binary_file("/data/USTR/test.pdf", str(source))
+    manifest.record.assert_called_with('/USTR/test.pdf', 's3', size=1,
+                                       digest=sha256_hex(b'\x17'))
+
+
+def test_savers_share_s3_client():
+    assert S3Saver().s3_client is S3Saver().s3_client
+
+
+@mock_s3
+def test_large_binary_is_uploaded_in_parts():
+    conn = create_mock_mirrulations_bucket()
+    s3_bucket = S3Saver(bucket_name="test-mirrulations1")
+    binary = b'\x17' * (MULTIPART_CHUNK_SIZE + 1)
+    s3_bucket.save_binary("/data/USTR/large.pdf", binary)
+    stored = conn.Object("test-mirrulations1", "USTR/large.pdf")
+    # Multipart uploads have an ETag ending in the number of parts
+    assert stored.e_tag.strip('"').endswith('-2')
+
+
+@mock_s3
+def test_save_many_uploads_every_file(tmp_path):
+    conn = create_mock_mirrulations_bucket()
+    files = []
+    for i in range(5):
+        source = tmp_path / f'download_{i}'
+        source.write_bytes(bytes([i]))
+        files.append((f"/data/USTR/{i}.pdf", str(source)))
+    results = S3Saver(bucket_name="test-mirrulations1").save_many(files)
+    assert results == {path: True for path, _ in files}
+    for i in range(5):
+        body = conn.Object("test-mirrulations1",
+                           f"USTR/{i}.pdf").get()["Body"].read()
+        assert body == bytes([i])
+
+
+@mock_s3
+def test_save_many_returns_failed_uploads(tmp_path):
+    create_mock_mirrulations_bucket()
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17')
+    results = S3Saver(bucket_name="test-mirrulations1").save_many(
+        [("/data/USTR/a.pdf", str(source)),
+         ("/data/USTR/b.pdf", str(tmp_path / 'missing'))])
+    assert results["/data/USTR/a.pdf"] is True
+    assert isinstance(results["/data/USTR/b.pdf"], OSError)
+
+
+@mock_s3
+def test_unchanged_object_is_not_uploaded_again(capsys, mocker):
+    conn = create_mock_mirrulations_bucket()
+    s3_bucket = S3Saver(bucket_name="test-mirrulations1")
+    s3_bucket.save_text("/data/USTR/test.txt", "text")
+    stored = conn.Object("test-mirrulations1", "USTR/test.txt")
+    assert stored.metadata == {'sha256': sha256_hex('text')}
+    put_object = mocker.spy(s3_bucket.s3_client, 'put_object')
+    assert s3_bucket.save_text("/data/USTR/test.txt", "text") is True
+    put_object.assert_not_called()
+    assert "Unchanged in S3, skipping upload: USTR/test.txt" in \
+        capsys.readouterr().out
+    s3_bucket.save_text("/data/USTR/test.txt", "new text")
+    put_object.assert_called_once()
+
+
+@mock_s3
+def test_unchanged_binary_file_is_not_uploaded_again(tmp_path, mocker):
+    create_mock_mirrulations_bucket()
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17')
+    s3_bucket = S3Saver(bucket_name="test-mirrulations1")
+    s3_bucket.save_binary_file("/data/USTR/test.pdf", str(source))
+    upload_file = mocker.spy(s3_bucket.s3_client, 'upload_file')
+    s3_bucket.save_binary_file("/data/USTR/test.pdf", str(source))
+    s3_bucket.save_binary("/data/USTR/test.pdf", b'\x17')
+    upload_file.assert_not_called()
+
+
+@mock_s3
+def test_manifest_digest_avoids_head_request(mocker):
+    create_mock_mirrulations_bucket()
+    manifest = MagicMock()
+    manifest.get.return_value = {'digest': sha256_hex('text')}
+    s3_bucket = S3Saver(bucket_name="test-mirrulations1", manifest=manifest)
+    head_object = mocker.spy(s3_bucket.s3_client, 'head_object')
+    assert s3_bucket.save_text("/data/USTR/test.txt", "text") is True
+    manifest.get.assert_called_once_with('/USTR/test.txt', 's3')
+    head_object.assert_not_called()
+
+
+@mock_s3
+def test_compressed_text_keeps_its_key():
+    conn = create_mock_mirrulations_bucket()
+    s3_bucket = S3Saver(bucket_name="test-mirrulations1",
+                        compression='gzip')
+    s3_bucket.save_text("/data/USTR/test.txt", "text")
+    s3_bucket.save_json("/data/USTR/test.json", {'results': {'data': 1}})
+    stored = conn.Object("test-mirrulations1", "USTR/test.txt")
+    assert 'gzip' in stored.content_encoding.split(',')
+    assert gzip.decompress(stored.get()["Body"].read()) == b'text'
+    # The digest is of the uncompressed text
+    assert stored.metadata == {'sha256': sha256_hex('text')}
+    body = conn.Object("test-mirrulations1", "USTR/test.json").get()["Body"]
+    assert json.loads(gzip.decompress(body.read())) == {'data': 1}
+
+
+@mock_s3
+def test_identical_files_are_uploaded_once(tmp_path, mocker):
+    conn = create_mock_mirrulations_bucket()
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17' * 10)
+    s3_bucket = S3Saver(bucket_name="test-mirrulations1",
+                        manifest=Manifest(str(tmp_path)))
+    s3_bucket.blob_store = BlobStore()
+    upload_file = mocker.spy(s3_bucket.s3_client, 'upload_file')
+    s3_bucket.save_binary_file("/data/USTR/a.pdf", str(source))
+    s3_bucket.save_binary_file("/data/USTR/b.pdf", str(source))
+    upload_file.assert_called_once()
+    assert upload_file.call_args.args[2] == 'USTR/a.pdf'
+    # Only the attachments themselves are stored
+    stored = conn.Bucket("test-mirrulations1").objects.all()
+    assert sorted(item.key for item in stored) == \
+        ['USTR/a.pdf', 'USTR/b.pdf']
+    assert conn.Object("test-mirrulations1", "USTR/b.pdf").metadata == \
+        {'sha256': sha256_hex(b'\x17' * 10)}
+
+
+@mock_s3
+def test_identical_file_is_uploaded_when_its_copy_is_gone(tmp_path, mocker):
+    conn = create_mock_mirrulations_bucket()
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17' * 10)
+    s3_bucket = S3Saver(bucket_name="test-mirrulations1",
+                        manifest=Manifest(str(tmp_path)))
+    s3_bucket.blob_store = BlobStore()
+    s3_bucket.save_binary_file("/data/USTR/a.pdf", str(source))
+    conn.Object("test-mirrulations1", "USTR/a.pdf").delete()
+    upload_file = mocker.spy(s3_bucket.s3_client, 'upload_file')
+    s3_bucket.save_binary_file("/data/USTR/b.pdf", str(source))
+    upload_file.assert_called_once()
+    body = conn.Object("test-mirrulations1", "USTR/b.pdf").get()["Body"]
+    assert body.read() == b'\x17' * 10
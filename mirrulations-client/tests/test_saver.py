@@ -1,12 +1,15 @@
 from json import dumps
-from unittest.mock import patch, mock_open
+from unittest.mock import MagicMock
 import os
+import threading
+import pytest
 from pytest import fixture
 from moto import mock_s3
 import boto3
 from mirrclient.saver import Saver
 from mirrclient.s3_saver import S3Saver
 from mirrclient.disk_saver import DiskSaver
+from mirrclient.retry_spool import RetrySpool
 
 
 @fixture(autouse=True)
@@ -15,19 +18,28 @@ def mock_env():
     os.environ['AWS_SECRET_ACCESS_KEY'] = 'test_secret_key'
 
 
-def test_saving_to_disk():
-    test_path = '/USTR/file.json'
+def test_saving_to_disk(tmp_path):
+    test_path = f'{tmp_path}/USTR/file.json'
     test_data = {'results': 'Hello world'}
+    saver = Saver(savers=[DiskSaver()])
+    saver.save_json(test_path, test_data)
+    with open(test_path, encoding='utf8') as file:
+        assert file.read() == dumps(test_data['results'])
+
+
+def test_close_closes_savers_that_can_be_closed():
+    closable = MagicMock()
+    saver = Saver(savers=[closable, DiskSaver()])
+    saver.close()
+    closable.close.assert_called_once()
 
-    with patch('mirrclient.disk_saver.open', mock_open()) as mocked_file:
-        with patch('os.makedirs') as mock_dir:
-            saver = Saver(savers=[DiskSaver()])
-            saver.save_json(test_path, test_data)
-            mock_dir.assert_called_once_with('/USTR')
-            mocked_file.assert_called_once_with(test_path, 'x',
-                                                encoding='utf8')
-            mocked_file().write.assert_called_once_with(
-                dumps(test_data['results']))
+
+def test_close_retries_and_keeps_the_spool():
+    spool = MagicMock()
+    saver = Saver(savers=[DiskSaver()], spool=spool)
+    saver.close()
+    spool.retry.assert_called_once()
+    spool.close.assert_called_once()
 
 
 @mock_s3
@@ -47,70 +59,112 @@ def test_saving_to_s3():
     assert body == test_data["results"]
 
 
+def read_file(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read()
+
+
+def saved_in_s3(conn, key):
+    return conn.Object("test-mirrulations1", key).get()["Body"].read()
+
+
 @mock_s3
-def test_saver_saves_json_to_multiple_places():
+def test_saver_saves_json_to_multiple_places(tmp_path):
     conn = boto3.resource("s3", region_name="us-east-1")
     conn.create_bucket(Bucket="test-mirrulations1")
-    test_path = '/USTR/file.json'
+    test_path = f'{tmp_path}/USTR/file.json'
     test_data = {'results': 'Hello world'}
+    saver = Saver(savers=[
+        DiskSaver(),
+        S3Saver(bucket_name="test-mirrulations1")])
+    saver.save_json(test_path, test_data)
+    body = dumps(test_data['results']).encode('utf8')
+    assert read_file(test_path) == body
+    assert saved_in_s3(conn, test_path) == body
 
-    with patch('mirrclient.disk_saver.open', mock_open()) as mocked_file:
-        with patch('os.makedirs') as mock_dir:
-            saver = Saver(savers=[
-                DiskSaver(),
-                S3Saver(bucket_name="test-mirrulations1")])
-            saver.save_json(test_path, test_data)
-            mock_dir.assert_called_once_with('/USTR')
-            mocked_file.assert_called_once_with(test_path, 'x',
-                                                encoding='utf8')
-            mocked_file().write.assert_called_once_with(
-                dumps(test_data['results']))
-            body = conn.Object("test-mirrulations1",
-                               "/USTR/file.json").get()["Body"].read()\
-                .decode("utf-8").strip('/"')
-            assert body == test_data["results"]
+
+@mock_s3
+def test_saver_saves_binary_to_multiple_places(tmp_path):
+    conn = boto3.resource("s3", region_name="us-east-1")
+    conn.create_bucket(Bucket="test-mirrulations1")
+    test_path = f'{tmp_path}/USTR/file.pdf'
+    saver = Saver(savers=[
+        DiskSaver(),
+        S3Saver(bucket_name="test-mirrulations1")])
+    saver.save_binary(test_path, b'\x17')
+    assert read_file(test_path) == b'\x17'
+    assert saved_in_s3(conn, test_path) == b'\x17'
 
 
 @mock_s3
-def test_saver_saves_binary_to_multiple_places():
+def test_saver_saves_text_to_multiple_places(tmp_path):
     conn = boto3.resource("s3", region_name="us-east-1")
     conn.create_bucket(Bucket="test-mirrulations1")
-    test_path = '/USTR/file.pdf'
-    test_data = b'\x17'
-
-    with patch('mirrclient.disk_saver.open', mock_open()) as mocked_file:
-        with patch('os.makedirs') as mock_dir:
-            saver = Saver(savers=[
-                DiskSaver(),
-                S3Saver(bucket_name="test-mirrulations1")])
-            saver.save_binary(test_path, test_data)
-            mock_dir.assert_called_once_with('/USTR')
-            mocked_file.assert_called_once_with(test_path, 'wb')
-            mocked_file().write.assert_called_once_with(test_data)
-            body = conn.Object("test-mirrulations1",
-                               "/USTR/file.pdf").get()["Body"].read()\
-                .decode("utf-8")
-            assert body == '\x17'
+    test_path = f'{tmp_path}/USTR/file.txt'
+    saver = Saver(savers=[
+        DiskSaver(),
+        S3Saver(bucket_name="test-mirrulations1")])
+    saver.save_text(test_path, 'test')
+    assert read_file(test_path) == b'test'
+    assert saved_in_s3(conn, test_path) == b'test'
 
 
 @mock_s3
-def test_saver_saves_text_to_multiple_places():
+def test_saver_saves_binary_file_to_multiple_places(tmp_path):
     conn = boto3.resource("s3", region_name="us-east-1")
     conn.create_bucket(Bucket="test-mirrulations1")
-    test_path = '/USTR/file.txt'
-    test_data = 'test'
-
-    with patch('mirrclient.disk_saver.open', mock_open()) as mocked_file:
-        with patch('os.makedirs') as mock_dir:
-            saver = Saver(savers=[
-                DiskSaver(),
-                S3Saver(bucket_name="test-mirrulations1")])
-            saver.save_text(test_path, test_data)
-            mock_dir.assert_called_once_with('/USTR')
-            mocked_file.assert_called_once_with(test_path, 'w',
-                                                encoding="utf-8")
-            mocked_file().write.assert_called_once_with(test_data)
-            body = conn.Object("test-mirrulations1",
-                               "/USTR/file.txt").get()["Body"].read()\
-                .decode("utf-8")
-            assert body == test_data
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17')
+    test_path = f'{tmp_path}/USTR/file.pdf'
+
+    saver = Saver(savers=[
+        DiskSaver(),
+        S3Saver(bucket_name="test-mirrulations1")])
+    saver.save_binary_file(test_path, str(source))
+    with open(test_path, 'rb') as file:
+        assert file.read() == b'\x17'
+    body = conn.Object("test-mirrulations1",
+                       test_path).get()["Body"].read()
+    assert body == b'\x17'
+
+
+def test_saves_run_on_every_saver_at_once():
+    both_started = threading.Barrier(2, timeout=5)
+    savers = [MagicMock(), MagicMock()]
+    for saver in savers:
+        saver.save_json.side_effect = lambda path, data: both_started.wait()
+    Saver(savers=savers).save_json('/data/a.json', {})
+    for saver in savers:
+        saver.save_json.assert_called_once_with('/data/a.json', {})
+
+
+def test_failed_saver_is_spooled_without_failing_the_save(capsys):
+    disk, s3 = MagicMock(), MagicMock()
+    disk.save_json.return_value = None
+    error = OSError('S3 is down')
+    s3.save_json.side_effect = error
+    spool = RetrySpool()
+    results = Saver(savers=[disk, s3], spool=spool).save_json(
+        '/data/a.json', {})
+    assert results == {disk: None, s3: error}
+    assert list(spool.entries) == [(s3, 'save_json', '/data/a.json', {})]
+    assert 'could not save /data/a.json' in capsys.readouterr().out
+
+
+def test_save_raises_when_every_saver_fails():
+    savers = [MagicMock(), MagicMock()]
+    for saver in savers:
+        saver.save_text.side_effect = OSError('disk full')
+    spool = RetrySpool()
+    with pytest.raises(OSError):
+        Saver(savers=savers, spool=spool).save_text('/data/a.txt', 'text')
+    assert not spool.entries
+
+
+def test_spooled_saves_are_retried_when_due():
+    saver = MagicMock()
+    spool = RetrySpool(retry_interval=0)
+    spool.add(saver, 'save_text', '/data/a.txt', 'text')
+    Saver(savers=[MagicMock()], spool=spool).save_json('/data/b.json', {})
+    saver.save_text.assert_called_once_with('/data/a.txt', 'text')
+    assert not spool.entries
@@ -0,0 +1,180 @@
+import os
+from unittest.mock import MagicMock
+import pytest
+from mirrclient.disk_saver import json_digest
+from mirrclient.shard_saver import ShardSaver, PackedS3Saver, \
+    build_packed_savers
+from mirrcore.shards import ShardReader
+
+
+def comment(i):
+    return {'data': {'id': f'USTR-1-{i}', 'type': 'comments',
+                     'attributes': {'lastModifiedDate': '2020-01-01'}}}
+
+
+def test_json_is_packed_into_one_shard(tmp_path):
+    saver = ShardSaver()
+    for i in range(100):
+        saver.save_json(f'{tmp_path}/comments/USTR-1-{i}.json',
+                        {'results': comment(i)})
+    assert sorted(os.listdir(tmp_path / 'comments')) == \
+        ['index.jsonl', 'shard-00000.jsonl']
+    reader = ShardReader(f'{tmp_path}/comments')
+    assert len(reader.ids()) == 100
+    assert reader.get('USTR-1-42') == comment(42)
+
+
+def test_duplicate_json_is_not_packed_again(tmp_path, capsys):
+    path = f'{tmp_path}/comments/USTR-1-1.json'
+    saver = ShardSaver()
+    saver.save_json(path, {'results': comment(1)})
+    # A new saver reads what was packed from the index
+    ShardSaver().save_json(path, {'results': comment(1)})
+    assert 'Data is a duplicate' in capsys.readouterr().out
+    changed = {'data': {'id': 'USTR-1-1', 'type': 'comments'}}
+    saver.save_json(path, {'results': changed})
+    reader = ShardReader(f'{tmp_path}/comments')
+    assert reader.get('USTR-1-1') == changed
+    assert reader.get('USTR-1-1', version=0) == comment(1)
+
+
+def test_shard_and_index_are_synced(tmp_path):
+    saver = ShardSaver()
+    saver.group_sync = MagicMock()
+    saver.save_json(f'{tmp_path}/comments/USTR-1-1.json',
+                    {'results': comment(1)})
+    assert [call.args[0] for call in saver.group_sync.add.call_args_list] == \
+        [f'{tmp_path}/comments/shard-00000.jsonl',
+         f'{tmp_path}/comments/index.jsonl']
+
+
+def test_saving_continues_after_index_line_was_cut_off(tmp_path):
+    directory = f'{tmp_path}/comments'
+    ShardSaver().save_json(f'{directory}/USTR-1-1.json',
+                           {'results': comment(1)})
+    with open(f'{directory}/index.jsonl', 'a', encoding='utf8') as index:
+        index.write('{"id": "USTR-1-2", "sha')
+    ShardSaver().save_json(f'{directory}/USTR-1-3.json',
+                           {'results': comment(3)})
+    reader = ShardReader(directory)
+    assert reader.ids() == ['USTR-1-1', 'USTR-1-3']
+    assert reader.get('USTR-1-3') == comment(3)
+
+
+def test_full_shard_is_sealed_and_uploaded(tmp_path):
+    uploader = MagicMock()
+    saver = ShardSaver(uploader=uploader)
+    saver.max_shard_bytes = 200
+    for i in range(5):
+        saver.save_json(f'{tmp_path}/comments/USTR-1-{i}.json',
+                        {'results': comment(i)})
+    uploader.save_binary_file.assert_not_called()
+    saver.upload_queued()
+    shard = f'{tmp_path}/comments/shard-00000.jsonl'
+    uploader.save_binary_file.assert_called_once_with(shard, shard)
+    assert uploader.save_text.call_args.args[0] == \
+        f'{tmp_path}/comments/index.jsonl'
+    assert os.path.exists(f'{tmp_path}/comments/shard-00001.jsonl')
+    reader = ShardReader(f'{tmp_path}/comments')
+    assert [reader.get(f'USTR-1-{i}') for i in range(5)] == \
+        [comment(i) for i in range(5)]
+
+
+def test_open_shard_is_uploaded_after_upload_interval(tmp_path, mocker):
+    monotonic = mocker.patch('time.monotonic', return_value=100.0)
+    uploader = MagicMock()
+    saver = ShardSaver(uploader=uploader)
+    saver.upload_interval = 60
+    saver.save_json(f'{tmp_path}/comments/USTR-1-1.json',
+                    {'results': comment(1)})
+    saver.upload_queued()
+    uploader.save_binary_file.assert_not_called()
+    monotonic.return_value = 160.0
+    saver.save_json(f'{tmp_path}/docket/USTR-1.json',
+                    {'results': comment(2)})
+    saver.upload_queued()
+    shard = f'{tmp_path}/comments/shard-00000.jsonl'
+    uploader.save_binary_file.assert_called_once_with(shard, shard)
+    # The shard stays open for the next items
+    assert not os.path.exists(f'{tmp_path}/comments/shard-00001.jsonl')
+
+
+def test_changed_shards_are_uploaded_on_close(tmp_path):
+    uploader = MagicMock()
+    saver = ShardSaver(uploader=uploader)
+    for i in range(3):
+        saver.save_json(f'{tmp_path}/comments/USTR-1-{i}.json',
+                        {'results': comment(i)})
+    saver.close()
+    shard = f'{tmp_path}/comments/shard-00000.jsonl'
+    uploader.save_binary_file.assert_called_once_with(shard, shard)
+    index = uploader.save_text.call_args.args[1]
+    assert len(index.splitlines()) == 3
+    # Nothing changed since
+    saver.close()
+    uploader.save_binary_file.assert_called_once()
+
+
+def test_least_recently_used_directory_is_forgotten(tmp_path):
+    uploader = MagicMock()
+    saver = ShardSaver(uploader=uploader)
+    saver.max_directories = 2
+    for directory in ['a', 'b', 'a', 'c']:
+        saver.save_json(f'{tmp_path}/{directory}/USTR-1-1.json',
+                        {'results': comment(1)})
+    assert list(saver.directories) == [f'{tmp_path}/a', f'{tmp_path}/c']
+    saver.upload_queued()
+    shard = f'{tmp_path}/b/shard-00000.jsonl'
+    uploader.save_binary_file.assert_called_once_with(shard, shard)
+    # A forgotten directory is read back from its index
+    saver.save_json(f'{tmp_path}/b/USTR-1-1.json', {'results': comment(1)})
+    assert len(ShardReader(f'{tmp_path}/b').versions['USTR-1-1']) == 1
+
+
+def test_failed_uploads_are_queued_again(tmp_path):
+    uploader = MagicMock()
+    uploader.save_binary_file.side_effect = [None, OSError(), None, None]
+    saver = ShardSaver(uploader=uploader)
+    for directory in ['a', 'b', 'c']:
+        saver.save_json(f'{tmp_path}/{directory}/USTR-1-1.json',
+                        {'results': comment(1)})
+    with pytest.raises(OSError):
+        saver.close()
+    # The shard that failed and the one after it are uploaded next time
+    saver.upload_queued()
+    assert [call.args[0] for call in
+            uploader.save_binary_file.call_args_list] == \
+        [f'{tmp_path}/{directory}/shard-00000.jsonl'
+         for directory in ['a', 'b', 'b', 'c']]
+
+
+def test_packed_items_are_recorded_in_manifest(tmp_path):
+    manifest = MagicMock()
+    path = f'{tmp_path}/comments/USTR-1-1.json'
+    ShardSaver(manifest).save_json(path, {'results': comment(1)})
+    manifest.record.assert_called_once()
+    assert manifest.record.call_args.args == (path,)
+    assert manifest.record.call_args.kwargs['digest'] == \
+        json_digest(comment(1))
+    assert manifest.record.call_args.kwargs['item_id'] == 'USTR-1-1'
+
+
+def test_packed_s3_saver_does_not_upload_items():
+    s3_saver = PackedS3Saver()
+    s3_saver.s3_client = MagicMock()
+    assert s3_saver.save_json('/data/USTR/a.json', {'results': {}}) is None
+    s3_saver.s3_client.put_object.assert_not_called()
+
+
+def test_packed_s3_saver_uploads_queued_shards():
+    s3_saver = PackedS3Saver()
+    s3_saver.shard_saver = MagicMock()
+    s3_saver.save_json('/data/USTR/a.json', {'results': {}})
+    s3_saver.shard_saver.upload_queued.assert_called_once()
+
+
+def test_build_packed_savers():
+    shard_saver, s3_saver = build_packed_savers()
+    assert isinstance(s3_saver, PackedS3Saver)
+    assert shard_saver.uploader is s3_saver
+    assert s3_saver.shard_saver is shard_saver
@@ -0,0 +1,96 @@
+# pylint: disable=protected-access
+import os
+import pytest
+import requests
+import responses
+from mirrclient import streaming
+from mirrclient.streaming import download_to_temp_file
+
+
+@responses.activate
+def test_download_written_to_temp_file():
+    responses.get('https://downloads.regulations.gov/1/attachment_1.pdf',
+                  body=b'\x17' * 10)
+    url = 'https://downloads.regulations.gov/1/attachment_1.pdf'
+    with download_to_temp_file(url) as temp_path:
+        with open(temp_path, 'rb') as file:
+            assert file.read() == b'\x17' * 10
+    assert not os.path.exists(temp_path)
+
+
+@responses.activate
+def test_download_read_in_chunks(mocker):
+    mocker.patch.object(streaming, 'CHUNK_SIZE', 4)
+    responses.get('https://downloads.regulations.gov/1/attachment_1.pdf',
+                  body=b'0123456789')
+    url = 'https://downloads.regulations.gov/1/attachment_1.pdf'
+    with download_to_temp_file(url) as temp_path:
+        assert os.path.getsize(temp_path) == 10
+
+
+@responses.activate
+def test_temp_file_removed_when_save_fails():
+    responses.get('https://downloads.regulations.gov/1/attachment_1.pdf',
+                  body=b'\x17')
+    url = 'https://downloads.regulations.gov/1/attachment_1.pdf'
+    temp_paths = []
+    try:
+        with download_to_temp_file(url) as temp_path:
+            temp_paths.append(temp_path)
+            raise OSError('disk full')
+    except OSError:
+        pass
+    assert not os.path.exists(temp_paths[0])
+
+
+@responses.activate
+def test_temp_file_removed_when_download_fails(mocker):
+    responses.get('https://downloads.regulations.gov/1/attachment_1.pdf',
+                  body=b'\x17')
+    mocker.patch('requests.Response.iter_content',
+                 side_effect=ConnectionResetError('reset'))
+    named_temporary_file = mocker.spy(streaming.tempfile,
+                                      'NamedTemporaryFile')
+    url = 'https://downloads.regulations.gov/1/attachment_1.pdf'
+    with pytest.raises(ConnectionResetError):
+        with download_to_temp_file(url):
+            pass
+    temp_path = named_temporary_file.spy_return.name
+    assert not os.path.exists(temp_path)
+
+
+@pytest.mark.parametrize('status', [403, 404, 503])
+@responses.activate
+def test_error_status_is_raised_and_not_saved(mocker, status):
+    responses.get('https://downloads.regulations.gov/1/attachment_1.pdf',
+                  body=b'<Error>AccessDenied</Error>', status=status)
+    named_temporary_file = mocker.spy(streaming.tempfile,
+                                      'NamedTemporaryFile')
+    url = 'https://downloads.regulations.gov/1/attachment_1.pdf'
+    with pytest.raises(requests.exceptions.HTTPError):
+        with download_to_temp_file(url):
+            pytest.fail('an error page was yielded as the download')
+    assert not os.path.exists(named_temporary_file.spy_return.name)
+
+
+def test_download_slots_are_sized(mocker):
+    mocker.patch.object(streaming, '_host_slots', {})
+    mocker.patch.object(streaming, 'MAX_CONNECTIONS_PER_HOST', 8)
+    size_pool = mocker.patch('mirrclient.streaming.size_pool')
+    streaming.size_download_slots(3)
+    slot = streaming._host_slot('https://downloads.regulations.gov/1.pdf')
+    assert [slot.acquire(blocking=False) for _ in range(4)] == \
+        [True, True, True, False]
+    size_pool.assert_called_once_with('https://downloads.regulations.gov', 3)
+
+
+def test_downloads_share_slot_per_host(mocker):
+    mocker.patch.object(streaming, 'MAX_CONNECTIONS_PER_HOST', 2)
+    mocker.patch.object(streaming, '_host_slots', {})
+    slot = streaming._host_slot('https://downloads.regulations.gov/1.pdf')
+    assert slot is streaming._host_slot(
+        'https://downloads.regulations.gov/2.pdf')
+    assert slot is not streaming._host_slot('https://api.regulations.gov/v4')
+    assert slot.acquire(blocking=False)
+    assert slot.acquire(blocking=False)
+    assert not slot.acquire(blocking=False)
@@ -0,0 +1,200 @@
+import os
+import threading
+from unittest.mock import MagicMock
+from mirrclient.disk_saver import DiskSaver
+from mirrclient.group_sync import GroupSync
+from mirrclient.saver import Saver
+from mirrclient.write_behind_saver import JobSaves, WriteBehindSaver
+
+
+def test_saves_are_written_in_background():
+    saver = MagicMock()
+    write_behind = WriteBehindSaver(saver)
+    write_behind.save_json('/data/a.json', {'data': 1})
+    write_behind.save_binary('/data/a.pdf', b'\x17')
+    write_behind.save_text('/data/a.txt', 'text')
+    write_behind.close()
+    saver.close.assert_called_once()
+    saver.save_json.assert_called_once_with('/data/a.json', {'data': 1})
+    saver.save_binary.assert_called_once_with('/data/a.pdf', b'\x17')
+    saver.save_text.assert_called_once_with('/data/a.txt', 'text')
+
+
+def test_save_returns_before_write_finishes():
+    release = threading.Event()
+    saver = MagicMock()
+    saver.save_json.side_effect = lambda path, data: release.wait(5)
+    write_behind = WriteBehindSaver(saver, writers=1)
+    write_behind.save_json('/data/a.json', {})
+    assert not release.is_set()
+    release.set()
+    write_behind.close()
+    saver.save_json.assert_called_once()
+
+
+def test_full_queue_blocks_next_save():
+    release = threading.Event()
+    saver = MagicMock()
+    saver.save_json.side_effect = lambda path, data: release.wait(5)
+    write_behind = WriteBehindSaver(saver, max_pending=1, writers=1)
+    # One save is being written and one fills the queue
+    write_behind.save_json('/data/1.json', {})
+    write_behind.save_json('/data/2.json', {})
+    blocked = threading.Thread(target=write_behind.save_json,
+                               args=('/data/3.json', {}))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    release.set()
+    blocked.join(5)
+    write_behind.close()
+    assert saver.save_json.call_count == 3
+
+
+def test_failed_save_is_retried(mocker):
+    sleep = mocker.patch('time.sleep')
+    saver = MagicMock()
+    saver.save_json.side_effect = [OSError('S3 is down'), None]
+    write_behind = WriteBehindSaver(saver, retry_delay=1)
+    write_behind.save_json('/data/a.json', {})
+    write_behind.close()
+    assert saver.save_json.call_count == 2
+    sleep.assert_called_once_with(1)
+
+
+def test_save_failing_every_attempt_fails_its_future(mocker, capsys):
+    mocker.patch('time.sleep')
+    saver = MagicMock()
+    error = OSError('S3 is down')
+    saver.save_json.side_effect = error
+    write_behind = WriteBehindSaver(saver, max_attempts=3)
+    written = write_behind.save_json('/data/a.json', {})
+    write_behind.close()
+    assert saver.save_json.call_count == 3
+    assert written.exception() is error
+    assert 'FAILURE: could not save /data/a.json' in capsys.readouterr().out
+
+
+def read_file(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read()
+
+
+def test_binary_file_is_staged_until_written(tmp_path):
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17')
+    written = []
+    saver = MagicMock()
+    saver.save_binary_file.side_effect = lambda path, file_path: \
+        written.append(read_file(file_path))
+    write_behind = WriteBehindSaver(saver)
+    write_behind.save_binary_file('/data/a.pdf', str(source))
+    # The caller may remove its file as soon as the save is queued
+    os.remove(source)
+    write_behind.close()
+    assert written == [b'\x17']
+    staged_path = saver.save_binary_file.call_args.args[1]
+    assert not os.path.exists(staged_path)
+
+
+def test_binary_file_is_copied_when_it_cannot_be_linked(tmp_path, mocker):
+    mocker.patch('os.link', side_effect=OSError('cross-device link'))
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17')
+    written = []
+    saver = MagicMock()
+    saver.save_binary_file.side_effect = lambda path, file_path: \
+        written.append(read_file(file_path))
+    write_behind = WriteBehindSaver(saver)
+    write_behind.save_binary_file('/data/a.pdf', str(source))
+    write_behind.close()
+    assert written == [b'\x17']
+    assert source.exists()
+
+
+def test_flush_waits_for_queued_saves():
+    saver = MagicMock()
+    write_behind = WriteBehindSaver(saver)
+    for i in range(10):
+        write_behind.save_json(f'/data/{i}.json', {})
+    write_behind.flush()
+    assert saver.save_json.call_count == 10
+    write_behind.close()
+
+
+def test_save_returns_future_done_when_written():
+    write_behind = WriteBehindSaver(MagicMock())
+    written = write_behind.save_text('/data/a.txt', 'text')
+    write_behind.flush()
+    assert written.result() == '/data/a.txt'
+    write_behind.close()
+
+
+def test_job_is_completed_once_its_saves_are_written():
+    saver = MagicMock()
+    release = threading.Event()
+    saver.save_json.side_effect = lambda path, data: release.wait(5)
+    write_behind = WriteBehindSaver(saver)
+    saves = JobSaves(write_behind)
+    saves.save_json('/data/a.json', {})
+    saves.save_text('/data/a.txt', 'text')
+    completed = threading.Event()
+    saves.when_written(completed.set, MagicMock())
+    assert not completed.is_set()
+    release.set()
+    write_behind.close()
+    assert completed.is_set()
+
+
+def test_job_fails_when_a_save_cannot_be_written(mocker):
+    mocker.patch('time.sleep')
+    saver = MagicMock()
+    error = OSError('S3 is down')
+    saver.save_binary.side_effect = error
+    write_behind = WriteBehindSaver(saver, max_attempts=2)
+    saves = JobSaves(write_behind)
+    saves.save_json('/data/a.json', {})
+    saves.save_binary('/data/a.pdf', b'\x17')
+    on_written, on_failed = MagicMock(), MagicMock()
+    saves.when_written(on_written, on_failed)
+    write_behind.close()
+    on_failed.assert_called_once_with(error)
+    on_written.assert_not_called()
+
+
+def test_job_with_saves_written_before_returning_is_completed_at_once():
+    saves = JobSaves(MagicMock())
+    saves.save_json('/data/a.json', {})
+    on_written = MagicMock()
+    saves.when_written(on_written, MagicMock())
+    on_written.assert_called_once_with()
+
+
+def test_job_is_completed_once_its_files_are_moved_into_place(tmp_path):
+    disk_saver = DiskSaver()
+    disk_saver.group_sync = GroupSync(max_files=10)
+    write_behind = WriteBehindSaver(Saver([disk_saver]))
+    saves = JobSaves(write_behind)
+    saves.save_text(f'{tmp_path}/a.txt', 'text')
+    on_written = MagicMock()
+    saves.when_written(on_written, MagicMock())
+    write_behind.flush()
+    on_written.assert_not_called()
+    disk_saver.group_sync.sync()
+    on_written.assert_called_once_with()
+    write_behind.close()
+
+
+def test_job_fails_when_its_file_cannot_be_moved_into_place(tmp_path,
+                                                            mocker):
+    disk_saver = DiskSaver()
+    disk_saver.group_sync = GroupSync(max_files=10)
+    saves = JobSaves(Saver([disk_saver]))
+    saves.save_text(f'{tmp_path}/a.txt', 'text')
+    on_written, on_failed = MagicMock(), MagicMock()
+    saves.when_written(on_written, on_failed)
+    error = OSError('disk is full')
+    mocker.patch('os.replace', side_effect=error)
+    disk_saver.group_sync.sync()
+    on_failed.assert_called_once_with(error)
+    on_written.assert_not_called()
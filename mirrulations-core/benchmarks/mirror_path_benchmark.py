@@ -0,0 +1,40 @@
+"""
+Times parsing the paths of a tree with parse_paths(), and formatting
+them back with format_path().
+
+Run from mirrulations-core: python benchmarks/mirror_path_benchmark.py
+"""
+import timeit
+from mirrcore.mirror_path import format_path, parse_paths
+
+# Paths parsed in each run, about the comments of a large docket
+PATHS = 100000
+
+
+def make_paths():
+    """
+    Returns the paths of the json and attachment of each comment.
+    """
+    docket = '/data/USTR/USTR-2015-0010'
+    paths = []
+    for i in range(PATHS // 2):
+        item_id = f'USTR-2015-0010-{i:06d}'
+        paths.append(f'{docket}/text-USTR-2015-0010/comments/{item_id}.json')
+        paths.append(f'{docket}/binary-USTR-2015-0010/comments_attachments/'
+                     f'{item_id}_attachment_1.pdf')
+    return paths
+
+
+def format_paths(parsed):
+    return [format_path(mirror_path) for mirror_path in parsed]
+
+
+if __name__ == '__main__':
+    paths_ = make_paths()
+    parsed_ = parse_paths(paths_)
+    assert format_paths(parsed_) == paths_
+    for name, run in (('parse_paths', lambda: parse_paths(paths_)),
+                      ('format_path', lambda: format_paths(parsed_))):
+        seconds = min(timeit.repeat(run, number=1, repeat=5))
+        print(f'{name}: {seconds / PATHS * 1e9:.0f} ns per path, '
+              f'{PATHS / seconds:.0f} paths per second')
@@ -0,0 +1,46 @@
+"""
+Times making the paths of a page of search results one item at a time
+with get_path() and all at once with get_paths().
+
+Run from mirrulations-core: python benchmarks/path_generator_benchmark.py
+"""
+import timeit
+from mirrcore.path_generator import PathGenerator
+
+# regulations.gov returns at most 250 results in a page
+PAGE_SIZE = 250
+
+# Pages timed for each method
+PAGES = 200
+
+
+def make_page():
+    """
+    Returns a page of comment search results, as the work generator
+    receives them.
+    """
+    return [{'id': f'USTR-2015-0010-{i:04d}',
+             'type': 'comments',
+             'attributes': {'agencyId': 'USTR',
+                            'docketId': 'USTR-2015-0010'},
+             'links': {'self': 'https://api.regulations.gov/v4/comments/'
+                               f'USTR-2015-0010-{i:04d}'}}
+            for i in range(PAGE_SIZE)]
+
+
+def paths_one_at_a_time(page):
+    return [PathGenerator().get_path({'data': item}) for item in page]
+
+
+def paths_in_one_pass(page):
+    return PathGenerator().get_paths(page)
+
+
+if __name__ == '__main__':
+    page_ = make_page()
+    assert paths_one_at_a_time(page_) == paths_in_one_pass(page_)
+    for method in (paths_one_at_a_time, paths_in_one_pass):
+        seconds = min(timeit.repeat(lambda m=method: m(page_),
+                                    number=PAGES, repeat=5))
+        print(f'{method.__name__}: '
+              f'{seconds / PAGES * 1e6:.0f} us per page of {PAGE_SIZE}')
@@ -0,0 +1,86 @@
+import hashlib
+import os
+import shutil
+from mirrcore.temp_paths import temp_path_for
+
+# The directory under the data root holding the blobs
+BLOB_DIR = 'blobs'
+
+# Bytes hashed at a time, so memory use does not depend on the file size
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def uses_blob_store():
+    """
+    Returns whether the BLOB_STORE environment variable asks for
+    attachments to be stored once per content.
+    """
+    return os.getenv('BLOB_STORE', '').strip().lower() in ('1', 'true')
+
+
+def file_digest(file_path):
+    """
+    Returns the sha256 digest of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """
+    Stores attachments by the sha256 digest of their content, so that a
+    pdf uploaded with thousands of comments is kept once.
+
+    Each blob is at blobs/<first two characters>/<digest> under the data
+    root. The attachment's own path is a hard link to its blob, so the
+    layout of the tree and every reader of it are unchanged.
+    Ex: /data/blobs/3f/3f79bb7b435b05321651daefd374cd21...
+
+    Attributes
+    ----------
+    root : str
+        The directory the blobs are under
+    """
+
+    def __init__(self, data_root='/data'):
+        self.root = os.path.join(data_root, BLOB_DIR)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def add(self, file_path, digest):
+        """
+        Stores the file as the blob for its digest, unless that blob is
+        already stored.
+        @return the path of the blob
+        """
+        blob_path = self.path(digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            _replace_with_copy(file_path, blob_path)
+        return blob_path
+
+    @staticmethod
+    def link(blob_path, path):
+        """
+        Makes path a hard link to the blob, replacing any file there.
+        The blob is copied if the file systems do not allow the link.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = temp_path_for(path)
+        try:
+            os.link(blob_path, temp_path)
+        except OSError:
+            shutil.copyfile(blob_path, temp_path)
+        os.replace(temp_path, path)
+
+
+def _replace_with_copy(file_path, path):
+    # Readers never see a partly written blob, and a copy left by a
+    # crash has a hidden name the manifest skips
+    temp_path = temp_path_for(path)
+    shutil.copyfile(file_path, temp_path)
+    os.replace(temp_path, path)
@@ -0,0 +1,62 @@
+import gzip
+import json
+import os
+
+# The codec saved json and extracted text may be compressed with
+GZIP = 'gzip'
+
+# The first bytes of every gzip stream. Json and text never start with
+# them, so compressed files are recognised without a different name.
+GZIP_MAGIC = b'\x1f\x8b'
+
+# gzip's default level, most of the size reduction for little cpu
+COMPRESSION_LEVEL = 6
+
+
+def get_compression():
+    """
+    Returns the codec named by the STORAGE_COMPRESSION environment
+    variable, or None to save uncompressed (the default).
+    """
+    compression = os.getenv('STORAGE_COMPRESSION', '').strip().lower()
+    if compression in ('', 'none'):
+        return None
+    if compression != GZIP:
+        raise ValueError(f'Unknown STORAGE_COMPRESSION: {compression}')
+    return compression
+
+
+def compress(text, compression=GZIP):
+    """
+    Returns the utf8 bytes of text compressed with the codec.
+    The gzip header has no timestamp, so the same text always
+    compresses to the same bytes.
+    """
+    if compression != GZIP:
+        raise ValueError(f'Unknown compression: {compression}')
+    return gzip.compress(text.encode('utf8'), COMPRESSION_LEVEL, mtime=0)
+
+
+def decode(body):
+    """
+    Returns the text of a saved file's bytes, decompressing them if they
+    are compressed.
+    """
+    if body.startswith(GZIP_MAGIC):
+        body = gzip.decompress(body)
+    return body.decode('utf8')
+
+
+def read_text(path):
+    """
+    Returns the text saved at path, whether or not it was compressed.
+    """
+    with open(path, 'rb') as file:
+        return decode(file.read())
+
+
+def read_json(path):
+    """
+    Returns the json saved at path, whether or not it was compressed.
+    """
+    return json.loads(read_text(path))
@@ -9,11 +9,11 @@ class DataCounts:
 
     """
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, rate_limiter=None):
 
         self.url = "https://api.regulations.gov/v4"
         self.api_key = api_key
-        self.regulations_api = RegulationsAPI(api_key)
+        self.regulations_api = RegulationsAPI(api_key, rate_limiter)
 
     def get_counts(self):
         """
@@ -0,0 +1,50 @@
+import os
+from functools import lru_cache
+import requests
+from requests.adapters import HTTPAdapter
+
+# The regulations.gov API, and the host attachments are downloaded from
+API_PREFIX = 'https://api.regulations.gov'
+DOWNLOADS_PREFIX = 'https://downloads.regulations.gov'
+
+# Keep-alive connections kept open to each regulations.gov host.
+# The downloads pool is larger because attachments are fetched in parallel.
+# A client with more workers calling the API widens its pool with
+# size_pool().
+POOL_SIZES = {
+    API_PREFIX: int(os.getenv('API_POOL_SIZE', '4')),
+    DOWNLOADS_PREFIX: int(os.getenv('DOWNLOADS_POOL_SIZE', '8'))
+}
+
+# Connections kept open to any other host
+DEFAULT_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '4'))
+
+
+@lru_cache(maxsize=None)
+def get_session():
+    """
+    Returns the requests.Session shared by everything in this process
+    that talks to regulations.gov.
+
+    Reusing the session keeps connections alive between requests, so a
+    request to a host that was recently used skips the TCP and TLS
+    handshakes. Responses are requested gzip compressed.
+    """
+    session = requests.Session()
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    default_adapter = HTTPAdapter(pool_maxsize=DEFAULT_POOL_SIZE)
+    session.mount('https://', default_adapter)
+    session.mount('http://', default_adapter)
+    for prefix, pool_size in POOL_SIZES.items():
+        session.mount(prefix, HTTPAdapter(pool_maxsize=pool_size))
+    return session
+
+
+def size_pool(prefix, pool_size):
+    """
+    Keeps pool_size connections open to the host at prefix in the shared
+    session, such as one for each worker calling it at the same time.
+    Requests beyond the pool open a connection that is closed after
+    them.
+    """
+    get_session().mount(prefix, HTTPAdapter(pool_maxsize=pool_size))
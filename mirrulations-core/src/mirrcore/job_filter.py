@@ -0,0 +1,172 @@
+import hashlib
+import math
+import os
+
+# Prefix of the Redis keys of the filter: <prefix>:<generation>:<chunk>
+# hold the bitmap of a generation, <prefix>:generation the newest
+# generation and <prefix>:count the jobs added to it
+FILTER_KEY = 'job_filter'
+
+# Bits in each key of a bitmap. All the bits of a job are in one chunk, so
+# they are set or read with one BITFIELD, and Redis allocates the chunks
+# of a generation as they are first used.
+CHUNK_BITS = 32 * 1024
+
+# Megabytes of Redis memory the filter may use, overridden with
+# JOB_FILTER_MB. 64 MB remembers about 37 million jobs.
+MEMORY_BUDGET_MB = 64
+
+# The budget is split into this many generations. When the newest is full
+# a new one is started and the oldest, and the jobs only it remembers,
+# is dropped.
+GENERATIONS = 8
+
+# The chance that a job that was never added is taken for a duplicate
+ERROR_RATE = 0.001
+
+
+def job_key(url, last_modified):
+    """
+    Returns what identifies a job to the filter: the url of the item,
+    which holds its id, and its lastModifiedDate, so a changed item is
+    queued again.
+    """
+    return f'{url}@{last_modified}'
+
+
+class JobFilter:
+    """
+    Remembers the jobs that were queued, so that an item the work generator
+    finds again, such as the items on the lastModifiedDate it resumes from,
+    is not queued twice and downloaded with another API request.
+
+    It is a Bloom filter kept in Redis bitmaps, using a fixed amount of
+    memory however many jobs are added. The bits of each job are in one
+    chunk of the bitmap, so a page of jobs is checked with one BITFIELD
+    per job and generation, in one pipeline, and added once it is
+    published with one BITFIELD per job.
+
+    A job that was added is always found. A job that was not has an
+    ERROR_RATE chance of being taken for a duplicate, and jobs older than
+    the oldest generation are forgotten.
+
+    Attributes
+    ----------
+    bits : int
+        The size of the bitmap of each generation
+    chunks : int
+        The keys the bitmap of each generation is split into
+    chunk_bits : int
+        The size of each key, CHUNK_BITS unless the budget is smaller
+    capacity : int
+        The jobs a generation holds at ERROR_RATE
+    hashes : int
+        The bits set for each job
+    """
+
+    def __init__(self, database, memory_budget=None):
+        """
+        @param database: the Redis connection the filter is kept in
+        @param memory_budget: bytes the filter may use, JOB_FILTER_MB
+            megabytes by default
+        """
+        self.database = database
+        if memory_budget is None:
+            memory_budget = int(os.getenv('JOB_FILTER_MB',
+                                          str(MEMORY_BUDGET_MB))) * 1024 ** 2
+        generation_bits = max(1, memory_budget * 8 // GENERATIONS)
+        self.chunk_bits = min(CHUNK_BITS, generation_bits)
+        self.chunks = generation_bits // self.chunk_bits
+        self.bits = self.chunks * self.chunk_bits
+        self.hashes = math.ceil(-math.log2(ERROR_RATE))
+        self.capacity = int(self.bits * math.log(2) ** 2 /
+                            -math.log(ERROR_RATE))
+
+    def find_new(self, keys):
+        """
+        Checks which keys are not in the filter with one Redis pipeline,
+        without adding them, so a job that fails to be published is found
+        new again when it is retried.
+        @param keys: Ex: job_key(url, last_modified) for each job
+        @return for each key, whether it is new. False means it was
+            added before or repeats an earlier key, or with a chance of
+            ERROR_RATE, was not added.
+        """
+        if not keys:
+            return []
+        generation = int(self.database.get(f'{FILTER_KEY}:generation') or 0)
+        generations = range(max(0, generation - GENERATIONS + 1),
+                            generation + 1)
+        pipe = self.database.pipeline(transaction=False)
+        for key in keys:
+            self._get_bits(pipe, key, generations)
+        return _first_seen(keys, _are_new(pipe.execute(), len(generations)))
+
+    def add(self, keys):
+        """
+        Adds keys to the filter with one Redis pipeline, once their jobs
+        are published.
+        @param keys: Ex: job_key(url, last_modified) for each job
+        """
+        if not keys:
+            return
+        generation = int(self.database.get(f'{FILTER_KEY}:generation') or 0)
+        pipe = self.database.pipeline(transaction=False)
+        for key in keys:
+            chunk, offsets = self._positions(key)
+            pipe.execute_command(
+                'BITFIELD', f'{FILTER_KEY}:{generation}:{chunk}',
+                *_bit_operations(offsets, 'SET', 1))
+        pipe.incrby(f'{FILTER_KEY}:count', len(keys))
+        if pipe.execute()[-1] >= self.capacity:
+            self._start_generation(generation + 1)
+
+    def _get_bits(self, pipe, key, generations):
+        # Adds getting the key's bits in each generation to the pipeline
+        chunk, offsets = self._positions(key)
+        for generation in generations:
+            pipe.execute_command(
+                'BITFIELD', f'{FILTER_KEY}:{generation}:{chunk}',
+                *_bit_operations(offsets, 'GET'))
+
+    def _positions(self, key):
+        # Returns the chunk of the key and the offsets of its bits in it,
+        # by double hashing: the i-th bit is h1 + i * h2
+        digest = hashlib.blake2b(key.encode('utf8'), digest_size=16).digest()
+        chunk = int.from_bytes(digest[:8], 'big') % self.chunks
+        first = int.from_bytes(digest[8:12], 'big')
+        second = int.from_bytes(digest[12:], 'big') | 1
+        return chunk, [(first + i * second) % self.chunk_bits
+                       for i in range(self.hashes)]
+
+    def _start_generation(self, generation):
+        pipe = self.database.pipeline()
+        pipe.set(f'{FILTER_KEY}:generation', generation)
+        pipe.set(f'{FILTER_KEY}:count', 0)
+        pipe.delete(*[f'{FILTER_KEY}:{generation - GENERATIONS}:{chunk}'
+                      for chunk in range(self.chunks)])
+        pipe.execute()
+
+
+def _are_new(bits, generations):
+    # bits holds the bits of each key in each generation. A key was added
+    # before if one generation has all of its bits set.
+    return [not any(all(generation_bits)
+                    for generation_bits in bits[i:i + generations])
+            for i in range(0, len(bits), generations)]
+
+
+def _first_seen(keys, is_new):
+    # Only the first of a key that repeats in keys is new
+    seen = set()
+    first = []
+    for key, new in zip(keys, is_new):
+        first.append(new and key not in seen)
+        seen.add(key)
+    return first
+
+
+def _bit_operations(offsets, operation, *value):
+    # The arguments of a BITFIELD that gets or sets one bit at each offset
+    return [arg for offset in offsets
+            for arg in (operation, 'u1', offset, *value)]
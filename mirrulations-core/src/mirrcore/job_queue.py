@@ -1,17 +1,61 @@
 # pylint: disable=too-many-arguments
-from mirrcore.rabbitmq import RabbitMQ
+import json
+import time
+from collections import Counter
+from mirrcore.job_filter import JobFilter, job_key
+from mirrcore.weighted_queues import WeightedQueues
+from mirrcore.jobs_statistics import DOCKETS_DONE, DOCUMENTS_DONE, \
+    COMMENTS_DONE, ATTACHMENTS_DONE, PDF_ATTACHMENTS_DONE
 
+# Redis counters of the jobs waiting in the queue, by job type
+WAITING_COUNTS = {
+    'comments': 'num_jobs_comments_waiting',
+    'documents': 'num_jobs_documents_waiting',
+    'dockets': 'num_jobs_dockets_waiting'
+}
 
-class JobQueue:
+# Redis counters of the jobs completed, by job type
+DONE_COUNTS = {
+    'comments': COMMENTS_DONE,
+    'documents': DOCUMENTS_DONE,
+    'dockets': DOCKETS_DONE
+}
+
+# Redis sorted set of the ids of leased jobs, scored by the time their
+# lease expires, and hash of the leased jobs by id
+LEASES = 'job_leases'
+LEASED_JOBS = 'leased_jobs'
+
+# Seconds a client has to complete a job before it is put back in the
+# queue for another client
+LEASE_SECONDS = 60 * 60
+
+# Leases a job may expire, or times it may be retried, before it is
+# recorded in invalid_jobs instead of being queued again
+MAX_ATTEMPTS = 3
+
+
+class JobQueue:  # pylint: disable=too-many-public-methods
     """
     This class is an abstraction of the process of adding and
     getting jobs.  It hides the implementation details of
     how jobs are stored in a DB/memory.
     """
 
-    def __init__(self, database):
+    def __init__(self, database, prefetch_count=None, weights=None):
+        """
+        @param database: the Redis connection used for job counts
+        @param prefetch_count: if given, jobs are pushed by the broker
+            and this many are buffered locally instead of polling
+        @param weights: how many jobs of each type are taken in turn,
+            see mirrcore.weighted_queues
+        """
         self.database = database
-        self.rabbitmq = RabbitMQ('jobs_waiting_queue')
+        self.prefetch_count = prefetch_count
+        self.rabbitmq = WeightedQueues(prefetch_count, weights)
+        # Drops jobs for items that were queued with the same
+        # lastModifiedDate before
+        self.job_filter = JobFilter(database)
 
         if not self.database.exists('num_jobs_comments_waiting'):
             self.database.set('num_jobs_comments_waiting', 0)
@@ -20,22 +64,74 @@ class JobQueue:
         if not self.database.exists('num_jobs_dockets_waiting'):
             self.database.set('num_jobs_dockets_waiting', 0)
 
-    def add_job(self, url, job_type=None, reg_id=None, agency=None):
-        job_id = self.get_job_id()
+    def add_job(self, url, job_type=None, reg_id=None, agency=None,
+                last_modified=None):
+        """
+        Adds a job, unless a job with the same url and last_modified was
+        added before.
+        @param last_modified: the lastModifiedDate of the item, if None
+            the job is always added
+        @return whether the job was added
+        """
+        keys = [] if last_modified is None else [job_key(url, last_modified)]
+        if keys and not self.job_filter.find_new(keys)[0]:
+            return False
         job = {
-            'job_id': job_id,
+            'job_id': self.get_job_id(),
             'url': url,
             'job_type': job_type,
             'reg_id': reg_id,
             'agency': agency
             }
         self.rabbitmq.add(job)
-        if job_type == 'comments':
-            self.database.incr('num_jobs_comments_waiting')
-        elif job_type == 'documents':
-            self.database.incr('num_jobs_documents_waiting')
-        elif job_type == 'dockets':
-            self.database.incr('num_jobs_dockets_waiting')
+        # Only a published job is remembered, so a failed add is retried
+        self.job_filter.add(keys)
+        if job_type in WAITING_COUNTS:
+            self.database.incr(WAITING_COUNTS[job_type])
+        return True
+
+    def add_jobs(self, jobs):
+        """
+        Adds a batch of jobs, such as the jobs of a page of search results,
+        with three round trips instead of three per job: the block of job
+        ids is reserved with one INCRBY, the jobs are published in one
+        batch the broker confirms, and the waiting counts are increased
+        in one Redis transaction.
+        Jobs with a last_modified that were added before are dropped, and
+        the others are added to the job filter once they are published.
+        @param jobs: dicts with the url and job_type of each job, and
+            optionally its reg_id, agency and last_modified
+        @return the jobs that were added
+        """
+        jobs = self._unqueued(jobs)
+        if not jobs:
+            return []
+        last_job_id = self.database.incrby('last_job_id', len(jobs))
+        first_job_id = last_job_id - len(jobs) + 1
+        batch = [{'job_id': job_id,
+                  'url': job['url'],
+                  'job_type': job.get('job_type'),
+                  'reg_id': job.get('reg_id'),
+                  'agency': job.get('agency')}
+                 for job_id, job in enumerate(jobs, first_job_id)]
+        self.rabbitmq.add_batch(batch)
+        self.job_filter.add(_filter_keys(jobs))
+        self._increase_waiting_counts(batch)
+        return batch
+
+    def _unqueued(self, jobs):
+        # The filter is asked about every job with a last_modified at once
+        is_new = iter(self.job_filter.find_new(_filter_keys(jobs)))
+        return [job for job in jobs
+                if job.get('last_modified') is None or next(is_new)]
+
+    def _increase_waiting_counts(self, jobs):
+        counts = Counter(job['job_type'] for job in jobs
+                         if job['job_type'] in WAITING_COUNTS)
+        pipe = self.database.pipeline()
+        for job_type, count in counts.items():
+            pipe.incrby(WAITING_COUNTS[job_type], count)
+        pipe.execute()
 
     def get_num_jobs(self):
         return self.rabbitmq.size()
@@ -69,15 +165,173 @@ class JobQueue:
             the work server class
 
         """
-        if job_type == 'comments':
-            self.database.decr('num_jobs_comments_waiting')
-        elif job_type == 'documents':
-            self.database.decr('num_jobs_documents_waiting')
-        elif job_type == 'dockets':
-            self.database.decr('num_jobs_dockets_waiting')
+        if job_type in WAITING_COUNTS:
+            self.database.decr(WAITING_COUNTS[job_type])
+
+    def lease_job(self, client_id):
+        """
+        Takes a job from the queue and records that a client is working
+        on it. The jobs_in_progress and client_jobs entries, the lease
+        and the waiting count are updated in a single Redis transaction.
+        If the job is not completed within LEASE_SECONDS,
+        reap_expired_leases() puts it back in the queue.
+        The job is only acknowledged to the broker once its lease was
+        recorded, and is put back in the queue if that fails, so it is
+        never lost between the two.
+        @param client_id: the id of the client performing the job
+        @return the job, or None if there are no jobs
+        """
+        taken = self._take_job()
+        if taken is None:
+            return None
+        job, delivery = taken
+        pipe = self.database.pipeline()
+        pipe.hset('jobs_in_progress', job['job_id'], job['url'])
+        pipe.hset('client_jobs', job['job_id'], client_id)
+        pipe.zadd(LEASES, {job['job_id']: time.time() + LEASE_SECONDS})
+        pipe.hset(LEASED_JOBS, job['job_id'], json.dumps(job))
+        if job.get('job_type') in WAITING_COUNTS:
+            pipe.decr(WAITING_COUNTS[job['job_type']])
+        try:
+            pipe.execute()
+        except Exception:
+            self.rabbitmq.requeue(delivery)
+            raise
+        self.rabbitmq.ack(delivery)
+        return job
+
+    def complete_job(self, job, attachments=0, pdf_attachments=0):
+        """
+        Records that a leased job has finished. The job and its lease are
+        removed from jobs_in_progress and client_jobs, and the done counts
+        are increased, in a single Redis transaction.
+        @param job: the job returned by lease_job
+        @param attachments: the number of attachments downloaded
+        @param pdf_attachments: how many of those attachments are pdfs
+        """
+        pipe = self.database.pipeline()
+        _end_lease(pipe, job['job_id'])
+        if job.get('job_type') in DONE_COUNTS:
+            pipe.incr(DONE_COUNTS[job['job_type']])
+        if attachments:
+            pipe.incrby(ATTACHMENTS_DONE, attachments)
+        if pdf_attachments:
+            pipe.incrby(PDF_ATTACHMENTS_DONE, pdf_attachments)
+        pipe.execute()
+
+    def fail_job(self, job):
+        """
+        Records that a leased job failed in a way that would not change if
+        it was tried again. The job is recorded in invalid_jobs and its
+        lease is ended in a single Redis transaction, so
+        reap_expired_leases() does not queue it again.
+        @param job: the job returned by lease_job
+        """
+        pipe = self.database.pipeline()
+        _end_lease(pipe, job['job_id'])
+        pipe.hset('invalid_jobs', job['job_id'], job['url'])
+        pipe.execute()
+
+    def retry_job(self, job):
+        """
+        Records that a leased job failed in a way that may pass, such as a
+        rate limit, a timeout or an unavailable server. Its lease expires
+        right away, so reap_expired_leases() queues it again on its next
+        pass, and records it in invalid_jobs once this has happened
+        MAX_ATTEMPTS times.
+        @param job: the job returned by lease_job
+        """
+        self.database.zadd(LEASES, {job['job_id']: time.time()}, xx=True)
+
+    def record_dropped_save(self, path):
+        """
+        Records in invalid_jobs a save that a client dropped after it
+        failed and could not be kept for retrying, so the item can be
+        downloaded again.
+        @param path: the path the save was for, Ex: /data/USTR/...
+        """
+        self.database.hset('invalid_jobs', path, 'dropped save')
+
+    def reap_expired_leases(self, now=None):
+        """
+        Puts the jobs whose lease has expired, because the client working
+        on them crashed or retried them, back in the queue with new job
+        ids, and removes them from jobs_in_progress and client_jobs. A job
+        that has expired MAX_ATTEMPTS times is recorded in invalid_jobs
+        instead.
+        Several reapers may run at once: each lease is claimed by one.
+        @param now: the time leases are compared with, time.time() if None
+        @return the jobs that were put back in the queue
+        """
+        now = time.time() if now is None else now
+        # Only the reaper that removes a lease reaps its job
+        claimed = [job_id for job_id
+                   in self.database.zrangebyscore(LEASES, '-inf', now)
+                   if self.database.zrem(LEASES, job_id)]
+        if not claimed:
+            return []
+        jobs = [json.loads(job) for job
+                in self.database.hmget(LEASED_JOBS, claimed) if job]
+        for job in jobs:
+            job['attempts'] = job.get('attempts', 0) + 1
+        try:
+            self._record_invalid(
+                [job for job in jobs if job['attempts'] >= MAX_ATTEMPTS])
+            jobs = self._requeue(
+                [job for job in jobs if job['attempts'] < MAX_ATTEMPTS])
+        except Exception:
+            # The leases are reaped again on the next pass
+            self.database.zadd(LEASES, dict.fromkeys(claimed, now))
+            raise
+        pipe = self.database.pipeline()
+        for job_id in claimed:
+            _end_lease(pipe, job_id)
+        pipe.execute()
+        return jobs
+
+    def _record_invalid(self, jobs):
+        for job in jobs:
+            print(f'FAILURE: job {job["job_id"]} expired {job["attempts"]} '
+                  f'times: {job["url"]}')
+            self.database.hset('invalid_jobs', job['job_id'], job['url'])
+
+    def _requeue(self, jobs):
+        # New ids keep a late complete_job() for the old lease from ending
+        # the new one
+        if not jobs:
+            return []
+        last_job_id = self.database.incrby('last_job_id', len(jobs))
+        for job_id, job in enumerate(jobs, last_job_id - len(jobs) + 1):
+            print(f'Lease of job {job["job_id"]} expired, '
+                  f'queued again as job {job_id}')
+            job['job_id'] = job_id
+        self.rabbitmq.add_batch(jobs)
+        self._increase_waiting_counts(jobs)
+        return jobs
 
     def get_job(self):
-        return self.rabbitmq.get()
+        """
+        Without a prefetch_count, asks the broker for one job and returns
+        None if there are none. With a prefetch_count, waits until the
+        broker pushes a job, so new jobs are picked up as soon as they
+        are published.
+        """
+        taken = self._take_job()
+        if taken is None:
+            return None
+        job, delivery = taken
+        self.rabbitmq.ack(delivery)
+        return job
+
+    def _take_job(self):
+        # Takes a job as get_job() does without acknowledging it, and
+        # returns it with its delivery, or None
+        if self.prefetch_count is None:
+            return self.rabbitmq.get_unacked()
+        taken = self.rabbitmq.consume_unacked()
+        while taken is None:
+            taken = self.rabbitmq.consume_unacked()
+        return taken
 
     def get_job_id(self):
         job_id = self.database.incr('last_job_id')
@@ -93,3 +347,17 @@ class JobQueue:
         key = f'{endpoint}_last_timestamp'
         self.database.set(key, date_string.replace('T', ' ')
                           .replace('Z', ''))
+
+
+def _filter_keys(jobs):
+    # The job filter keys of the jobs that have a last_modified
+    return [job_key(job['url'], job['last_modified'])
+            for job in jobs if job.get('last_modified') is not None]
+
+
+def _end_lease(pipe, job_id):
+    # Adds removing the job and its lease from Redis to the pipeline
+    pipe.hdel('jobs_in_progress', job_id)
+    pipe.hdel('client_jobs', job_id)
+    pipe.zrem(LEASES, job_id)
+    pipe.hdel(LEASED_JOBS, job_id)
@@ -0,0 +1,74 @@
+import threading
+import time
+from mirrcore.rate_limiter import RateLimiter, CALLS_PER_HOUR
+
+
+class KeyPool:
+    """
+    Schedules API calls across several regulations.gov API keys.
+
+    Each key has its own RateLimiter, so its budget is shared with every
+    other process using the same key. acquire() hands out whichever key
+    has a token first, starting the search after the key handed out
+    last, so calls are spread over the keys and a key that is idle
+    picks up the calls another key has no budget for.
+
+    Attributes
+    ----------
+    limiters : dict
+        The RateLimiter for each API key
+    """
+
+    def __init__(self, database, api_keys, calls_per_hour=CALLS_PER_HOUR):
+        if not api_keys:
+            raise ValueError('A KeyPool needs at least one API key')
+        self.keys = list(api_keys)
+        self.limiters = {key: RateLimiter(database, key, calls_per_hour)
+                         for key in self.keys}
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until one of the keys has a token, then takes it.
+        @return the API key the token was taken from
+        """
+        api_key, wait_time = self.try_acquire()
+        while api_key is None:
+            time.sleep(wait_time)
+            api_key, wait_time = self.try_acquire()
+        return api_key
+
+    def try_acquire(self):
+        """
+        Takes a token from the first key that has one.
+        @return (api key, 0) if a token was taken, otherwise
+            (None, seconds until the next token is added to any key)
+        """
+        with self.lock:
+            start = self.next_index
+            self.next_index = (start + 1) % len(self.keys)
+        wait_times = []
+        for offset in range(len(self.keys)):
+            api_key = self.keys[(start + offset) % len(self.keys)]
+            wait_time = self.limiters[api_key].try_acquire()
+            if wait_time == 0:
+                return api_key, 0
+            wait_times.append(wait_time)
+        return None, min(wait_times)
+
+    def update(self, api_key, response):
+        """
+        Passes the rate limit headers of a response to the key's limiter.
+        @param api_key: the key the request was made with
+        @param response: the requests.Response from regulations.gov
+        """
+        self.limiters[api_key].update(response)
+
+    def budgets(self):
+        """
+        @return the budget of each key, by the Redis key of its bucket
+            so that the API keys themselves are not exposed
+        """
+        return {limiter.key: limiter.budget()
+                for limiter in self.limiters.values()}
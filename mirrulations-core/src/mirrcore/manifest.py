@@ -0,0 +1,259 @@
+import os
+import sqlite3
+import sys
+import threading
+from mirrcore.mirror_path import ITEM_TYPES, parse_paths
+from mirrcore.shards import INDEX_NAME, read_index
+from mirrcore.temp_paths import is_temp_name
+
+# Where the client and extractor containers mount the mirrored data
+DATA_ROOT = '/data'
+
+# The SQLite file holding the manifest, kept in the data directory
+MANIFEST_NAME = 'manifest.sqlite3'
+
+# Where a saved object is stored
+DISK = 'disk'
+S3 = 's3'
+
+# Optional details recorded for each object
+DETAIL_COLUMNS = ('item_id', 'item_type', 'last_modified', 'size', 'digest')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS objects (
+    location TEXT NOT NULL,
+    path TEXT NOT NULL,
+    item_id TEXT,
+    item_type TEXT,
+    last_modified TEXT,
+    size INTEGER,
+    digest TEXT,
+    PRIMARY KEY (location, path)
+);
+CREATE INDEX IF NOT EXISTS objects_item_id ON objects (item_id);
+CREATE INDEX IF NOT EXISTS objects_digest ON objects (digest);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+class Manifest:
+    """
+    An index of every object mirrored from regulations.gov, stored in an
+    SQLite database next to the data.
+
+    The savers record each path they write, so questions such as "has
+    this comment been downloaded" or "which pdfs are there" are answered
+    by an indexed lookup instead of by walking millions of files.
+
+    Paths are recorded relative to `root`, the directory the data is
+    mounted at in the current container, so containers that mount the
+    data at different places share the same entries.
+    Ex: /data/USTR/USTR-2015-0010/... is recorded as /USTR/USTR-2015-0010/...
+
+    Attributes
+    ----------
+    root : str
+        The directory the mirrored data is under
+    """
+
+    def __init__(self, root=DATA_ROOT):
+        self.root = root.rstrip('/')
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            os.path.join(root, MANIFEST_NAME), timeout=30,
+            isolation_level=None, check_same_thread=False)
+        # Readers in other containers do not block the writers. With WAL,
+        # NORMAL syncs at checkpoints instead of on every record: a
+        # crash of the client loses nothing, a power loss at most the
+        # latest records.
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def record(self, path, location=DISK, **details):
+        """
+        Records that an object was saved, replacing any earlier entry.
+        @param path: where the object was saved, Ex: /data/USTR/...
+        @param location: DISK or S3
+        @param details: any of item_id, item_type, last_modified, size
+            and digest
+        """
+        unknown = set(details) - set(DETAIL_COLUMNS)
+        if unknown:
+            raise ValueError(f'Unknown manifest details: {unknown}')
+        row = [location, self.relative_path(path)]
+        row += [details.get(column) for column in DETAIL_COLUMNS]
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)',
+                row)
+
+    def has_path(self, path, location=DISK):
+        """
+        @return True if an object has been saved at path
+        """
+        return self.get(path, location) is not None
+
+    def has_item(self, item_id):
+        """
+        @return True if the json of a docket, document or comment with
+            the id has been saved
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM objects WHERE item_id = ? LIMIT 1',
+                (item_id,)).fetchone()
+        return row is not None
+
+    def get(self, path, location=DISK):
+        """
+        @return dict with the details recorded for path, or None if
+            nothing has been saved there
+        """
+        with self.lock:
+            row = self.connection.execute(
+                f'SELECT {", ".join(DETAIL_COLUMNS)} FROM objects '
+                'WHERE location = ? AND path = ?',
+                (location, self.relative_path(path))).fetchone()
+        if row is None:
+            return None
+        return dict(zip(DETAIL_COLUMNS, row))
+
+    def paths(self, suffix='', location=DISK):
+        """
+        @return the full path of every object ending with suffix
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT path FROM objects WHERE location = ? AND path LIKE ?',
+                (location, f'%{suffix}')).fetchall()
+        return [f'{self.root}{path}' for (path,) in rows]
+
+    def paths_with_digest(self, digest, location=DISK):
+        """
+        @return the full path of every object whose content has the
+            digest, such as the copies of an attachment
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT path FROM objects WHERE location = ? AND digest = ?',
+                (location, digest)).fetchall()
+        return [f'{self.root}{path}' for (path,) in rows]
+
+    def is_complete(self):
+        """
+        @return True once rebuild() has recorded the files that were
+            saved before the manifest existed
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM settings WHERE name = 'complete'"
+            ).fetchone()
+        return row is not None
+
+    def rebuild(self):
+        """
+        Walks the files under root and records every one of them, and
+        every item packed in shards, then marks the manifest complete.
+        Only needed once, for data saved before the savers kept the
+        manifest up to date.
+        """
+        for directory, subdirectories, files in os.walk(self.root):
+            # Hidden directories, such as the client's retry spool, hold
+            # no data
+            subdirectories[:] = [name for name in subdirectories
+                                 if not name.startswith('.')]
+            paths = [os.path.join(directory, file)
+                     for file in files if _is_data_file(file)]
+            rows = [self._disk_row(path, parsed) for path, parsed
+                    in zip(paths, parse_paths(paths))]
+            if INDEX_NAME in files:
+                rows += self._packed_rows(directory)
+            # Each directory is recorded in one transaction
+            with self.lock:
+                self.connection.execute('BEGIN')
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO objects '
+                    '(location, path, item_id, item_type, size) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    rows)
+                self.connection.execute('COMMIT')
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO settings VALUES ('complete', '1')")
+
+    def close(self):
+        self.connection.close()
+
+    def relative_path(self, path):
+        """
+        @return path without the root directory in front of it
+        """
+        if path.startswith(f'{self.root}/'):
+            return path[len(self.root):]
+        return path
+
+    def _disk_row(self, path, parsed):
+        # parsed is the MirrorPath of path, or None outside the layout
+        item_id, item_type = None, None
+        if parsed is not None and parsed.kind in ITEM_TYPES:
+            item_id, item_type = parsed.item, ITEM_TYPES[parsed.kind]
+        elif path.endswith('.json'):
+            item_id = os.path.splitext(os.path.basename(path))[0]
+        return (DISK, self.relative_path(path), item_id, item_type,
+                os.path.getsize(path))
+
+    def _packed_rows(self, directory):
+        # Items packed by a ShardSaver are recorded at the path they
+        # would have as files, with their latest version
+        entries = {entry['id']: entry for entry in read_index(directory)}
+        item_type = ITEM_TYPES.get(os.path.basename(directory))
+        return [(DISK, self.relative_path(f'{directory}/{item_id}.json'),
+                 item_id, item_type, entry['length'])
+                for item_id, entry in entries.items()]
+
+
+def item_details(data):
+    """
+    Returns the id, type and lastModifiedDate of the json of a docket,
+    document or comment, as details for Manifest.record().
+    """
+    item = data.get('data') if isinstance(data, dict) else None
+    if not isinstance(item, dict):
+        return {}
+    return {
+        'item_id': item.get('id'),
+        'item_type': item.get('type'),
+        'last_modified': item.get('attributes', {}).get('lastModifiedDate')
+    }
+
+
+def _is_data_file(name):
+    # Skips the manifest itself, and the digest files and unfinished
+    # temporary files of DiskSaver
+    if is_temp_name(name):
+        return False
+    return not name.startswith(MANIFEST_NAME) and not name.endswith('.sha256')
+
+
+def load_manifest(root=DATA_ROOT):
+    """
+    Returns the Manifest of the data under root if it has been built,
+    otherwise None so that callers fall back to the file system.
+    """
+    if not os.path.exists(os.path.join(root, MANIFEST_NAME)):
+        return None
+    manifest = Manifest(root)
+    if not manifest.is_complete():
+        manifest.close()
+        return None
+    return manifest
+
+
+if __name__ == '__main__':
+    # Records the files that are already saved
+    # Ex: python -m mirrcore.manifest /data
+    Manifest(sys.argv[1] if len(sys.argv) > 1 else DATA_ROOT).rebuild()
@@ -0,0 +1,111 @@
+from collections import namedtuple
+
+# The directory an item's files are in names their kind. Attachments are
+# under binary-<docket id>, everything else under text-<docket id>.
+BINARY_KINDS = frozenset(['comments_attachments', 'documents_attachments'])
+TEXT_KINDS = frozenset(['docket', 'documents', 'comments'])
+EXTRACTED_TEXT_KINDS = frozenset(['comments_extracted_text',
+                                  'documents_extracted_text'])
+
+# The directory under the docket each kind is in, before the docket id
+KIND_TOPS = {kind: 'binary-' if kind in BINARY_KINDS else 'text-'
+             for kind in BINARY_KINDS | TEXT_KINDS | EXTRACTED_TEXT_KINDS}
+
+# The item type, as in the json of an item, of the json in each kind
+ITEM_TYPES = {'docket': 'dockets', 'documents': 'documents',
+              'comments': 'comments'}
+
+# Ends the name of a file of extracted text, before its extension
+EXTRACTED_SUFFIX = '_extracted'
+
+# The tool extracted text is saved under
+EXTRACTION_TOOL = 'pdfminer'
+
+MirrorPath = namedtuple('MirrorPath', ['root', 'agency', 'docket', 'kind',
+                                       'tool', 'item', 'attachment',
+                                       'extension'])
+MirrorPath.__doc__ = '''
+The parts of a path in the mirrored data, see docs/structure.md.
+Ex: /data/USTR/USTR-2015-0010/binary-USTR-2015-0010/comments_attachments/
+    USTR-2015-0010-0002_attachment_1.pdf
+is MirrorPath(root='/data', agency='USTR', docket='USTR-2015-0010',
+              kind='comments_attachments', tool=None,
+              item='USTR-2015-0010-0002', attachment='attachment_1',
+              extension='pdf')
+
+kind is the name of the directory the file is in. tool is only set for
+extracted text. attachment is the part of the file name after the item
+id, such as attachment_1 or content, or None for the json of an item.
+'''
+
+
+def parse_path(path):
+    """
+    Returns the MirrorPath of a path in the mirrored data.
+    The path is split from its end, so any root directory may come
+    before the agency.
+    @raise ValueError if the path is not laid out as in docs/structure.md
+    """
+    parts = path.rsplit('/', 5)
+    tool = None
+    if len(parts) == 6 and parts[3] in EXTRACTED_TEXT_KINDS:
+        # The tool's directory is between the kind and the file
+        tool = parts.pop(4)
+        parts[:1] = parts[0].rsplit('/', 1)
+    if len(parts) < 6:
+        raise ValueError(f'Not a path in the mirrored data: {path}')
+    # parts are the root, agency, docket, top directory, kind and name
+    if parts[4] not in KIND_TOPS or \
+            parts[3] != KIND_TOPS[parts[4]] + parts[2] or \
+            (tool is None) == (parts[4] in EXTRACTED_TEXT_KINDS):
+        raise ValueError(f'Not a path in the mirrored data: {path}')
+    return MirrorPath(parts[0], parts[1], parts[2], parts[4], tool,
+                      *_parse_name(parts[5], tool))
+
+
+def _parse_name(name, tool):
+    # Returns the item, attachment and extension in a file name
+    stem, _, extension = name.rpartition('.')
+    if tool is not None:
+        stem = stem[:-len(EXTRACTED_SUFFIX)]
+    item, _, attachment = stem.partition('_')
+    return item, attachment or None, extension
+
+
+def parse_paths(paths):
+    """
+    Returns the MirrorPath of each path, or None for a path that is not
+    in the mirrored data, so a tree or manifest can be parsed in bulk.
+    """
+    parsed = []
+    for path in paths:
+        try:
+            parsed.append(parse_path(path))
+        except ValueError:
+            parsed.append(None)
+    return parsed
+
+
+def format_path(mirror_path):
+    """
+    Returns the path a MirrorPath was parsed from,
+    format_path(parse_path(path)) == path.
+    """
+    directory = f'{mirror_path.root}/{mirror_path.agency}/' \
+        f'{mirror_path.docket}/{KIND_TOPS[mirror_path.kind]}' \
+        f'{mirror_path.docket}/{mirror_path.kind}'
+    name = mirror_path.item
+    if mirror_path.attachment is not None:
+        name = f'{name}_{mirror_path.attachment}'
+    if mirror_path.tool is not None:
+        directory = f'{directory}/{mirror_path.tool}'
+        name = f'{name}{EXTRACTED_SUFFIX}'
+    return f'{directory}/{name}.{mirror_path.extension}'
+
+
+def extracted_text_path(mirror_path, tool=EXTRACTION_TOOL):
+    """
+    Returns the MirrorPath of the text extracted from an attachment.
+    """
+    kind = mirror_path.kind.replace('_attachments', '_extracted_text')
+    return mirror_path._replace(kind=kind, tool=tool, extension='txt')
@@ -1,4 +1,26 @@
-class PathGenerator:
+from mirrcore.mirror_path import BINARY_KINDS, extracted_text_path, \
+    format_path, parse_path
+
+# Paths of the json of each type of item, formatted with the agency id,
+# docket id and item id
+DOCKET_JSON_PATH = '/{0}/{1}/text-{1}/docket/{1}.json'
+DOCUMENT_JSON_PATH = '/{0}/{1}/text-{1}/documents/{2}.json'
+COMMENT_JSON_PATH = '/{0}/{1}/text-{1}/comments/{2}.json'
+
+JSON_PATHS = {
+    'dockets': DOCKET_JSON_PATH.format,
+    'documents': DOCUMENT_JSON_PATH.format,
+    'comments': COMMENT_JSON_PATH.format
+}
+
+UNKNOWN_PATH = '/unknown/unknown.json'
+
+
+def _or_unknown(value):
+    return 'unknown' if value is None else value
+
+
+class PathGenerator:  # pylint: disable=too-many-public-methods
     """
     A Class which classifies any type of file into the correct directory
     following our data structure where every path is based on an agencyId, id,
@@ -34,6 +56,8 @@ class PathGenerator:
         Gets the path for a json with the 'documents' type
     get_comment_json_path(json = dict):
         Gets the path for a json with the 'comments' type
+    get_paths(items = list):
+        Gets the path of every item in a page of search results
     """
 
     def get_json_path(self, json):
@@ -43,14 +67,38 @@ class PathGenerator:
             return self.get_docket_json_path(json)
         if json['data']["type"] == "documents":
             return self.get_document_json_path(json)
-        return "/unknown/unknown.json"
+        return UNKNOWN_PATH
 
     def get_path(self, json):
         if 'data' not in json or json['data'] == []:
-            return "/unknown/unknown.json"
+            return UNKNOWN_PATH
         if json['data'].get("type") != -1:
             return self.get_json_path(json)
-        return "/unknown/unknown.json"
+        return UNKNOWN_PATH
+
+    def get_paths(self, items):
+        '''
+        Returns the path of each item in a page of search results, the
+        same path get_path({'data': item}) returns. The format of each
+        type's path is prepared once, and each item's fields are read
+        directly, so a page of 250 results takes one pass.
+        An item without a known type has the unknown path.
+        '''
+        return [self._get_item_path(item) for item in items]
+
+    def _get_item_path(self, item):
+        json_path = JSON_PATHS.get(item.get('type')) if item else None
+        if json_path is None:
+            return UNKNOWN_PATH
+        item_id = item.get('id')
+        attributes = item.get('attributes', {})
+        agency_id = _or_unknown(attributes.get('agencyId'))
+        if item['type'] == 'dockets':
+            return json_path(agency_id, _or_unknown(item_id), None)
+        docket_id = attributes.get('docketId')
+        if docket_id is None:
+            docket_id = self.parse_docket_id(item_id)
+        return json_path(agency_id, docket_id, _or_unknown(item_id))
 
     def _get_nested_keys_in_json(self, json_data, nested_keys, default_value):
         '''
@@ -108,16 +156,11 @@ class PathGenerator:
         return agency_id, docket_id, item_i_d
 
     def get_docket_json_path(self, json):
-        agency_i_d, docket_i_d, _ = self.get_attributes(json,
-                                                        is_docket=True)
-        return f'/{agency_i_d}/{docket_i_d}/text-{docket_i_d}/docket/' + \
-               f'{docket_i_d}.json'
+        return DOCKET_JSON_PATH.format(*self.get_attributes(json,
+                                                            is_docket=True))
 
     def get_document_json_path(self, json):
-        agency_i_d, docket_i_d, item_i_d = self.get_attributes(json)
-
-        return f'/{agency_i_d}/{docket_i_d}/text-{docket_i_d}/documents' + \
-               f'/{item_i_d}.json'
+        return DOCUMENT_JSON_PATH.format(*self.get_attributes(json))
 
     def get_document_htm_path(self, json):
         agency_id, docket_id, item_id = self.get_attributes(json)
@@ -126,10 +169,7 @@ class PathGenerator:
                f'documents/{item_id}_content.htm'
 
     def get_comment_json_path(self, json):
-        agency_i_d, docket_i_d, item_i_d = self.get_attributes(json)
-
-        return f'/{agency_i_d}/{docket_i_d}/text-{docket_i_d}/comments/' + \
-               f'{item_i_d}.json'
+        return COMMENT_JSON_PATH.format(*self.get_attributes(json))
 
     def _has_file_formats(self, attributes, attachment):
         if attributes.get("fileFormats"):
@@ -176,14 +216,12 @@ class PathGenerator:
         path : str
             the complete file path for the attachment that is being extracted
             ex. /path/to/pdf/attachment_1.pdf
+        Raises
+        ------
+        ValueError
+            if the path is not the path of an attachment in the mirror
         '''
-        if "comments" in path:
-            return path.replace('binary', 'text') \
-                       .replace('comments_attachments',
-                                'comments_extracted_text/pdfminer') \
-                       .replace('.pdf', '_extracted.txt') \
-
-        return path.replace('binary', 'text') \
-                   .replace('documents_attachments',
-                            'documents_extracted_text/pdfminer') \
-                   .replace('.pdf', '_extracted.txt')
+        parsed = parse_path(path)
+        if parsed.kind not in BINARY_KINDS:
+            raise ValueError(f'Not the path of an attachment: {path}')
+        return format_path(extracted_text_path(parsed))
@@ -3,26 +3,72 @@ import pika
 from mirrcore.job_queue_exceptions import JobQueueException
 
 
+class RabbitConnection:
+    """
+    A connection to RabbitMQ that is opened when a channel is first
+    needed, and opened again when it has dropped. RabbitMQ objects that
+    share one, such as the queues of a WeightedQueues, each open their
+    channels on it, so a process holds one connection and one heartbeat
+    instead of one per queue.
+    """
+
+    def __init__(self):
+        self.connection = None
+
+    def channel(self):
+        """
+        @return a new channel on the connection
+        """
+        if self.connection is None or not self.connection.is_open:
+            connection_parameter = pika.ConnectionParameters('rabbitmq')
+            self.connection = pika.BlockingConnection(connection_parameter)
+        return self.connection.channel()
+
+
 class RabbitMQ:
     """
     Encapsulate calls to RabbitMQ in one place
     """
 
-    def __init__(self, queue_name):
+    def __init__(self, queue_name, prefetch_count=None, connection=None):
         """
         Create a new RabbitMQ object
         @param queue_name: the name of the queue to use
+        @param prefetch_count: the number of jobs the broker pushes ahead
+            to a consumer, only used by consume()
+        @param connection: the RabbitConnection the channels are opened
+            on, a connection of its own by default
         """
         self.queue_name = queue_name
-        self.connection = None
+        self.prefetch_count = prefetch_count
+        self.connection = connection or RabbitConnection()
         self.channel = None
+        self.consumer = None
+        # Publishes batches of jobs in transactions, see add_batch()
+        self.batch_channel = None
 
     def _ensure_channel(self):
-        if self.connection is None or not self.connection.is_open:
-            connection_parameter = pika.ConnectionParameters('rabbitmq')
-            self.connection = pika.BlockingConnection(connection_parameter)
+        # The channel closes with the connection, or on its own after a
+        # channel error
+        if self.channel is None or not self.channel.is_open:
             self.channel = self.connection.channel()
             self.channel.queue_declare(self.queue_name, durable=True)
+            # a consumer belongs to the channel it was started on
+            self.consumer = None
+            self.batch_channel = None
+
+    def _ensure_batch_channel(self):
+        self._ensure_channel()
+        if self.batch_channel is None:
+            self.batch_channel = self.connection.channel()
+            self.batch_channel.tx_select()
+
+    def _ensure_consumer(self, inactivity_timeout):
+        self._ensure_channel()
+        if self.consumer is None:
+            self.channel.basic_qos(prefetch_count=self.prefetch_count or 1)
+            self.consumer = self.channel.consume(
+                self.queue_name, inactivity_timeout=inactivity_timeout)
 
     def add(self, job):
         """
@@ -33,17 +79,41 @@ class RabbitMQ:
         self._ensure_channel()
         # channel cannot be ensured hasn't dropped been between these calls
         try:
-            persistent_delivery = pika.spec.PERSISTENT_DELIVERY_MODE
-            self.channel.basic_publish(exchange='',
-                                       routing_key=self.queue_name,
-                                       body=json.dumps(job),
-                                       properties=pika.BasicProperties(
-                                        delivery_mode=persistent_delivery)
-                                       )
+            self._publish(self.channel, job)
         except pika.exceptions.StreamLostError as error:
             print("FAILURE: RabbitMQ Channel Connection Lost")
             raise JobQueueException from error
 
+    def add_batch(self, jobs):
+        """
+        Add jobs to the queue, and wait for the broker to confirm that it
+        has stored all of them.
+        The jobs are published in one transaction on a channel of their
+        own, so the broker confirms the whole batch with one reply
+        instead of one per job, and the transaction does not hold back
+        the acks of get() and consume().
+        @param jobs: the jobs to add
+        @return: None
+        """
+        self._ensure_batch_channel()
+        try:
+            for job in jobs:
+                self._publish(self.batch_channel, job)
+            self.batch_channel.tx_commit()
+        except pika.exceptions.StreamLostError as error:
+            print("FAILURE: RabbitMQ Channel Connection Lost")
+            self.batch_channel = None
+            raise JobQueueException from error
+
+    def _publish(self, channel, job):
+        persistent_delivery = pika.spec.PERSISTENT_DELIVERY_MODE
+        channel.basic_publish(exchange='',
+                              routing_key=self.queue_name,
+                              body=json.dumps(job),
+                              properties=pika.BasicProperties(
+                                delivery_mode=persistent_delivery)
+                              )
+
     def size(self):
         """
         Get the number of jobs in the queue.
@@ -66,6 +136,15 @@ class RabbitMQ:
         Take one job from the queue and return it
         @return: a job, or None if there are no jobs
         """
+        return self._acked(self.get_unacked())
+
+    def get_unacked(self):
+        """
+        Take one job from the queue without acknowledging it. The broker
+        delivers it again if the channel closes before it is passed to
+        ack(), or when it is passed to requeue().
+        @return: (job, delivery tag), or None if there are no jobs
+        """
         # Check if channel is up, if not, create a new one
         self._ensure_channel()
         try:
@@ -75,8 +154,65 @@ class RabbitMQ:
             # If there was no job available
             if method_frame is None:
                 return None
-            self.channel.basic_ack(method_frame.delivery_tag)
-            return json.loads(body.decode('utf-8'))
+            return json.loads(body.decode('utf-8')), method_frame.delivery_tag
         except pika.exceptions.StreamLostError as error:
             print("FAILURE: RabbitMQ Channel Connection Lost")
             raise JobQueueException from error
+
+    def consume(self, inactivity_timeout=1):
+        """
+        Take the next job the broker has pushed to this consumer.
+        Unlike get(), no request is sent to the broker: it delivers up to
+        prefetch_count jobs ahead of time and they are buffered locally.
+        @param inactivity_timeout: seconds to wait for a job to arrive,
+            only used the first time consume() is called on a channel
+        @return: a job, or None if no job arrived in time
+        """
+        return self._acked(self.consume_unacked(inactivity_timeout))
+
+    def consume_unacked(self, inactivity_timeout=1):
+        """
+        Take the next job the broker has pushed to this consumer without
+        acknowledging it, see consume() and get_unacked().
+        @return: (job, delivery tag), or None if no job arrived in time
+        """
+        self._ensure_consumer(inactivity_timeout)
+        try:
+            method_frame, _, body = next(self.consumer)
+            if method_frame is None:
+                return None
+            return json.loads(body.decode('utf-8')), method_frame.delivery_tag
+        except pika.exceptions.StreamLostError as error:
+            print("FAILURE: RabbitMQ Channel Connection Lost")
+            self.consumer = None
+            raise JobQueueException from error
+
+    def ack(self, delivery_tag):
+        """
+        Acknowledge a job taken without acknowledging it, so the broker
+        removes it from the queue
+        @param delivery_tag: the tag the job was returned with
+        """
+        try:
+            self.channel.basic_ack(delivery_tag)
+        except pika.exceptions.StreamLostError as error:
+            print("FAILURE: RabbitMQ Channel Connection Lost")
+            raise JobQueueException from error
+
+    def requeue(self, delivery_tag):
+        """
+        Put a job taken without acknowledging it back in the queue
+        @param delivery_tag: the tag the job was returned with
+        """
+        try:
+            self.channel.basic_nack(delivery_tag, requeue=True)
+        except pika.exceptions.StreamLostError as error:
+            print("FAILURE: RabbitMQ Channel Connection Lost")
+            raise JobQueueException from error
+
+    def _acked(self, delivery):
+        if delivery is None:
+            return None
+        job, delivery_tag = delivery
+        self.ack(delivery_tag)
+        return job
@@ -0,0 +1,165 @@
+import hashlib
+import time
+from email.utils import parsedate_to_datetime
+
+CALLS_PER_HOUR = 1000
+
+# Used when a 429 response does not say how long to wait
+DEFAULT_RETRY_AFTER = 60
+
+
+class RateLimiter:
+    """
+    A token bucket for one regulations.gov API key.
+
+    The bucket is stored in Redis so that every process using the key
+    (clients, the work generator, the validator) draws from the same
+    quota. Updates happen in a WATCH/MULTI transaction, and the time is
+    taken from the Redis server, so concurrent processes never hand out
+    the same token.
+
+    Responses from the API are passed to update() so the bucket follows
+    the X-RateLimit-Limit and X-RateLimit-Remaining headers. While the
+    API reports calls remaining they can be made back to back, when it
+    reports none the calls trickle at the refill rate, and a 429 makes
+    every process wait for the Retry-After time.
+
+    Attributes
+    ----------
+    key : str
+        The Redis hash holding the bucket. It is derived from a digest of
+        the API key so the key itself is not stored in Redis.
+    rate : float
+        Tokens added to the bucket per second
+    capacity : float
+        The most tokens the bucket can hold until the API reports its
+        limit. With a capacity of 1 calls are spread evenly over the hour
+        and the quota is never exceeded in any one hour window.
+    """
+
+    def __init__(self, database, api_key, calls_per_hour=CALLS_PER_HOUR):
+        self.database = database
+        digest = hashlib.sha256(str(api_key).encode('utf8')).hexdigest()
+        self.key = f'rate_limit_{digest[:16]}'
+        self.rate = calls_per_hour / 3600
+        self.capacity = 1
+
+    def acquire(self):
+        """
+        Blocks until a token is available, then takes it.
+        """
+        wait_time = self.try_acquire()
+        while wait_time > 0:
+            time.sleep(wait_time)
+            wait_time = self.try_acquire()
+
+    def try_acquire(self):
+        """
+        Takes a token if one is available.
+        @return 0 if a token was taken, otherwise the number of seconds
+            until the next token is added to the bucket
+        """
+        return self.database.transaction(self._take_token, self.key,
+                                         value_from_callable=True)
+
+    def update(self, response):
+        """
+        Matches the bucket to the rate limit headers of an API response.
+        @param response: the requests.Response from regulations.gov
+        """
+        self.database.transaction(
+            lambda pipe: self._apply_headers(pipe, response), self.key)
+
+    def budget(self):
+        """
+        @return dict with the limit and remaining calls last reported by
+            the API (None until a response has been seen) and the tokens
+            currently in the bucket
+        """
+        tokens, limit, remaining = self.database.hmget(
+            self.key, 'tokens', 'limit', 'remaining')
+        return {
+            'limit': None if limit is None else int(limit),
+            'remaining': None if remaining is None else int(remaining),
+            'tokens': self.capacity if tokens is None else float(tokens)
+        }
+
+    def _take_token(self, pipe):
+        now = _redis_time(pipe)
+        tokens, rate = self._refilled_tokens(pipe, now)
+
+        wait_time = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait_time = (1 - tokens) / rate
+
+        pipe.multi()
+        pipe.hset(self.key, mapping={'tokens': tokens, 'updated': now})
+        return wait_time
+
+    def _refilled_tokens(self, pipe, now):
+        tokens, updated, limit = pipe.hmget(self.key, 'tokens', 'updated',
+                                            'limit')
+        capacity, rate = self._capacity_and_rate(limit)
+        if tokens is None:
+            return capacity, rate
+        tokens = float(tokens) + (now - float(updated)) * rate
+        return min(capacity, tokens), rate
+
+    def _apply_headers(self, pipe, response):
+        limit = _int_header(response, 'X-RateLimit-Limit')
+        remaining = _int_header(response, 'X-RateLimit-Remaining')
+        mapping = {}
+        if limit is not None:
+            mapping['limit'] = limit
+        if remaining is not None:
+            mapping['remaining'] = remaining
+        tokens = self._tokens_after_response(response, limit, remaining)
+        if tokens is not None:
+            mapping['tokens'] = tokens
+            mapping['updated'] = _redis_time(pipe)
+        pipe.multi()
+        if mapping:
+            pipe.hset(self.key, mapping=mapping)
+
+    def _tokens_after_response(self, response, limit, remaining):
+        if response.status_code == 429:
+            _, rate = self._capacity_and_rate(limit)
+            # The next token is added exactly when the wait is over
+            return 1 - retry_after_seconds(response) * rate
+        return remaining
+
+    def _capacity_and_rate(self, limit):
+        if limit is None:
+            return self.capacity, self.rate
+        return float(limit), float(limit) / 3600
+
+
+def retry_after_seconds(response):
+    """
+    @return the number of seconds the Retry-After header asks for, which
+        may be given as seconds or as an HTTP date
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return DEFAULT_RETRY_AFTER
+    if value.isdigit():
+        return int(value)
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+    return max(0, retry_at - time.time())
+
+
+def _int_header(response, name):
+    value = response.headers.get(name)
+    if value is None or not value.isdigit():
+        return None
+    return int(value)
+
+
+def _redis_time(pipe):
+    seconds, microseconds = pipe.time()
+    return seconds + microseconds / 1_000_000
@@ -1,5 +1,5 @@
 import time
-import requests
+from mirrcore.http_session import get_session
 
 
 MIN_DELAY_BETWEEN_CALLS = 3600 / 1000
@@ -11,17 +11,26 @@ class RegulationsAPI:
 
     The class handles attaching the API key to the parameters
     and it adds a delay between calls to ensure less than 1000
-    calls per hour.
+    calls per hour.  When a RateLimiter is given, the delay comes from
+    the key's shared token bucket instead of a fixed sleep, and every
+    response is passed back to it so the pacing follows the rate limit
+    headers returned by regulations.gov.
     """
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, rate_limiter=None):
         self.api_key = api_key
+        self.rate_limiter = rate_limiter
 
     def download(self, url, params=None):
-        time.sleep(MIN_DELAY_BETWEEN_CALLS)
+        if self.rate_limiter is None:
+            time.sleep(MIN_DELAY_BETWEEN_CALLS)
+        else:
+            self.rate_limiter.acquire()
         if params is None:
             params = {}
         params['api_key'] = self.api_key
-        result = requests.get(url, params=params, timeout=10)
+        result = get_session().get(url, params=params, timeout=10)
+        if self.rate_limiter is not None:
+            self.rate_limiter.update(result)
         result.raise_for_status()
         return result.json()
@@ -0,0 +1,100 @@
+import json
+import os
+
+# The index of a packed directory, one json line per saved item:
+# {"id": ..., "shard": ..., "offset": ..., "length": ..., "digest": ...}
+INDEX_NAME = 'index.jsonl'
+
+# Shards are named by their number in the directory, Ex: shard-00000.jsonl
+SHARD_PREFIX = 'shard-'
+SHARD_SUFFIX = '.jsonl'
+
+
+def is_packed():
+    """
+    Returns whether the PACKED_STORAGE environment variable asks for json
+    to be saved in per-docket shards instead of one file per item.
+    """
+    return os.getenv('PACKED_STORAGE', '').strip().lower() in ('1', 'true')
+
+
+def shard_name(number):
+    return f'{SHARD_PREFIX}{number:05d}{SHARD_SUFFIX}'
+
+
+def is_shard_file(name):
+    return name == INDEX_NAME or \
+        (name.startswith(SHARD_PREFIX) and name.endswith(SHARD_SUFFIX))
+
+
+def read_index(directory):
+    """
+    Returns the index entries of a packed directory in the order they
+    were written, or an empty list if nothing is packed there.
+    A last line without its newline was cut off by a process killed
+    while appending it, and is skipped.
+    """
+    index_path = os.path.join(directory, INDEX_NAME)
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, encoding='utf8') as file:
+        return [json.loads(line) for line in file
+                if line.endswith('\n') and line.strip()]
+
+
+def truncate_partial_line(path):
+    """
+    Removes a line cut off by a process killed while appending it from
+    the end of an index or shard, so the next line appended does not run
+    into it.
+    """
+    with open(path, 'rb+') as file:
+        end = file.read().rfind(b'\n') + 1
+        if end < file.tell():
+            file.truncate(end)
+
+
+class ShardReader:
+    """
+    Reads the items packed in one directory, such as the comments of a
+    docket, by id.
+
+    Each item is a line of json in one of the directory's shards, and
+    the index gives the shard and byte offset of every line. An item
+    that was saved again after it changed has an entry for each version,
+    the last one is its current version.
+
+    Attributes
+    ----------
+    directory : str
+        The packed directory,
+        Ex: /data/USTR/USTR-2015-0010/text-USTR-2015-0010/comments
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.versions = {}
+        for entry in read_index(directory):
+            self.versions.setdefault(entry['id'], []).append(entry)
+
+    def ids(self):
+        """
+        @return the id of every item in the directory
+        """
+        return list(self.versions)
+
+    def has_item(self, item_id):
+        return item_id in self.versions
+
+    def get(self, item_id, version=-1):
+        """
+        Reads one item without reading the rest of its shard.
+        @param item_id: Ex: USTR-2015-0010-0002
+        @param version: which saved version, the latest by default
+        @return the item's json
+        @raise KeyError if the item is not in the directory
+        """
+        entry = self.versions[item_id][version]
+        with open(os.path.join(self.directory, entry['shard']), 'rb') as file:
+            file.seek(entry['offset'])
+            return json.loads(file.read(entry['length']).decode('utf8'))
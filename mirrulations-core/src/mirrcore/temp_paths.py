@@ -0,0 +1,24 @@
+import os
+import uuid
+
+# Ends the hidden name a file is written under before it is renamed to
+# its path, Ex: /data/.file.json.1a2b3c4d.tmp
+TEMP_SUFFIX = '.tmp'
+
+
+def temp_path_for(path):
+    """
+    Returns a hidden, unique path in the same directory as path, so the
+    file written there can be renamed to path in one step.
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(directory,
+                        f'.{name}.{uuid.uuid4().hex[:8]}{TEMP_SUFFIX}')
+
+
+def is_temp_name(name):
+    """
+    Returns whether a file name is one temp_path_for() returns, such as
+    a file left behind by a writer that was killed.
+    """
+    return name.startswith('.') and name.endswith(TEMP_SUFFIX)
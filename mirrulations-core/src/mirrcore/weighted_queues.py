@@ -0,0 +1,190 @@
+import os
+import time
+from mirrcore.rabbitmq import RabbitConnection, RabbitMQ
+
+# The queue of jobs without a weighted type, and of the jobs queued
+# before each type had a queue of its own
+QUEUE_NAME = 'jobs_waiting_queue'
+
+# How many jobs of each type are taken for each job of weight 1, so a
+# backfill of millions of comments does not hold back dockets and
+# documents. Overridden with JOB_WEIGHTS=dockets=4,documents=2,comments=1,
+# the types it leaves out keeping these. Each of these types has a queue
+# of its own whatever the weights, so producers and consumers with
+# different weights route jobs alike.
+DEFAULT_WEIGHTS = {'dockets': 4, 'documents': 2, 'comments': 1}
+
+# The weight of the jobs in QUEUE_NAME
+OTHER_WEIGHT = 1
+
+# Seconds consume() waits when none of the queues has a job, so callers
+# waiting for a job do not spin
+CONSUME_WAIT = 0.1
+
+
+def weights_from_environment():
+    """
+    Returns the weights in the JOB_WEIGHTS environment variable,
+    Ex: dockets=4,documents=2,comments=1, or DEFAULT_WEIGHTS if unset.
+    @raise ValueError if a weight is not a positive integer, or a job
+        type is not one of DEFAULT_WEIGHTS
+    """
+    setting = os.getenv('JOB_WEIGHTS', '').strip()
+    if not setting:
+        return dict(DEFAULT_WEIGHTS)
+    weights = {}
+    for pair in setting.split(','):
+        job_type, _, weight = pair.partition('=')
+        if job_type.strip() not in DEFAULT_WEIGHTS:
+            raise ValueError(f'JOB_WEIGHTS has an unknown job type: '
+                             f'{job_type.strip()}')
+        if int(weight) < 1:
+            raise ValueError(f'JOB_WEIGHTS must be positive: {setting}')
+        weights[job_type.strip()] = int(weight)
+    return weights
+
+
+def weighted_schedule(weights):
+    """
+    Returns the order the queues take turns in, each as often as its
+    weight, with the turns of each queue spread out (smooth weighted
+    round robin). Ex: {'a': 2, 'b': 1} -> ['a', 'b', 'a']
+    """
+    total = sum(weights.values())
+    current = dict.fromkeys(weights, 0)
+    schedule = []
+    for _ in range(total):
+        for key, weight in weights.items():
+            current[key] += weight
+        chosen = max(current, key=current.get)
+        current[chosen] -= total
+        schedule.append(chosen)
+    return schedule
+
+
+class WeightedQueues:
+    """
+    A queue of jobs with the interface of RabbitMQ that keeps each job
+    type in a RabbitMQ queue of its own, jobs_waiting_queue_<type>, and
+    takes jobs from them in proportion to their weights. When a queue is
+    empty its turns go to the others, so no capacity is left unused.
+    The queues share one connection, with channels of their own.
+
+    Attributes
+    ----------
+    queues : dict
+        The RabbitMQ queue of each job type, None for QUEUE_NAME
+    schedule : list
+        The job types in the order their queues take turns
+    """
+
+    def __init__(self, prefetch_count=None, weights=None):
+        """
+        @param prefetch_count: passed to the RabbitMQ of each queue
+        @param weights: how often each job type's queue takes a turn,
+            weights_from_environment() by default. Types left out keep
+            their DEFAULT_WEIGHTS.
+        """
+        if weights is None:
+            weights = weights_from_environment()
+        weights = {**DEFAULT_WEIGHTS, **weights}
+        connection = RabbitConnection()
+        self.queues = {job_type: RabbitMQ(f'{QUEUE_NAME}_{job_type}',
+                                          prefetch_count, connection)
+                       for job_type in DEFAULT_WEIGHTS}
+        self.queues[None] = RabbitMQ(QUEUE_NAME, prefetch_count, connection)
+        self.schedule = weighted_schedule({**weights, None: OTHER_WEIGHT})
+        self.turn = 0
+
+    def queue_for(self, job):
+        return self.queues.get(job.get('job_type'), self.queues[None])
+
+    def add(self, job):
+        self.queue_for(job).add(job)
+
+    def add_batch(self, jobs):
+        """
+        Adds jobs, with one batch for each queue they go to.
+        """
+        batches = {}
+        for job in jobs:
+            batches.setdefault(self.queue_for(job), []).append(job)
+        for queue, batch in batches.items():
+            queue.add_batch(batch)
+
+    def size(self):
+        return sum(queue.size() for queue in self.queues.values())
+
+    def get(self):
+        """
+        Takes a job from the queue whose turn it is, or from the next
+        queue that has one.
+        @return: a job, or None if every queue is empty
+        """
+        return self._acked(self.get_unacked())
+
+    def get_unacked(self):
+        """
+        Takes a job as get() does, without acknowledging it, see
+        RabbitMQ.get_unacked().
+        @return: (job, delivery), the delivery being passed to ack() or
+            requeue(), or None if every queue is empty
+        """
+        return self._next_job(lambda queue: queue.get_unacked())
+
+    def consume(self):
+        """
+        Takes the next job the broker has pushed, from the queue whose
+        turn it is or the next queue that has one.
+        @return: a job, or None if none arrived
+        """
+        return self._acked(self.consume_unacked())
+
+    def consume_unacked(self):
+        """
+        Takes a job as consume() does, without acknowledging it.
+        @return: (job, delivery), see get_unacked(), or None if none
+            arrived
+        """
+        taken = self._next_job(lambda queue: queue.consume_unacked(0))
+        if taken is None:
+            time.sleep(CONSUME_WAIT)
+        return taken
+
+    def ack(self, delivery):
+        """
+        Acknowledges a job taken by get_unacked() or consume_unacked().
+        """
+        queue, delivery_tag = delivery
+        queue.ack(delivery_tag)
+
+    def requeue(self, delivery):
+        """
+        Puts a job taken by get_unacked() or consume_unacked() back in
+        its queue.
+        """
+        queue, delivery_tag = delivery
+        queue.requeue(delivery_tag)
+
+    def _acked(self, taken):
+        if taken is None:
+            return None
+        job, delivery = taken
+        self.ack(delivery)
+        return job
+
+    def _next_job(self, take):
+        # Each queue is tried at most once, in the order of the schedule.
+        # Returns the job with the queue it came from and its delivery tag
+        tried = set()
+        while len(tried) < len(self.queues):
+            job_type = self.schedule[self.turn]
+            self.turn = (self.turn + 1) % len(self.schedule)
+            if job_type not in tried:
+                queue = self.queues[job_type]
+                taken = take(queue)
+                if taken is not None:
+                    job, delivery_tag = taken
+                    return job, (queue, delivery_tag)
+                tried.add(job_type)
+        return None
@@ -0,0 +1,67 @@
+import hashlib
+import os
+from mirrcore.blob_store import BlobStore, file_digest, uses_blob_store
+from mirrcore.temp_paths import is_temp_name
+
+
+def test_file_digest(tmp_path):
+    source = tmp_path / 'download'
+    source.write_bytes(b'\x17' * 10)
+    assert file_digest(source) == hashlib.sha256(b'\x17' * 10).hexdigest()
+
+
+def test_identical_files_share_one_blob(tmp_path):
+    store = BlobStore(str(tmp_path))
+    first = tmp_path / 'first'
+    first.write_bytes(b'pdf')
+    second = tmp_path / 'second'
+    second.write_bytes(b'pdf')
+    digest = file_digest(first)
+    blob_path = store.add(str(first), digest)
+    assert store.add(str(second), digest) == blob_path
+    assert blob_path == f'{tmp_path}/blobs/{digest[:2]}/{digest}'
+    for name in ('a', 'b'):
+        store.link(blob_path, f'{tmp_path}/USTR/{name}.pdf')
+    assert os.stat(blob_path).st_nlink == 3
+    with open(f'{tmp_path}/USTR/b.pdf', 'rb') as file:
+        assert file.read() == b'pdf'
+
+
+def test_link_replaces_existing_file(tmp_path):
+    store = BlobStore(str(tmp_path))
+    source = tmp_path / 'download'
+    source.write_bytes(b'new')
+    (tmp_path / 'a.pdf').write_bytes(b'old')
+    store.link(store.add(str(source), file_digest(source)),
+               f'{tmp_path}/a.pdf')
+    assert (tmp_path / 'a.pdf').read_bytes() == b'new'
+
+
+def test_files_are_written_under_hidden_temporary_names(tmp_path, mocker):
+    replace = mocker.patch('os.replace', wraps=os.replace)
+    store = BlobStore(str(tmp_path))
+    source = tmp_path / 'download'
+    source.write_bytes(b'pdf')
+    store.link(store.add(str(source), file_digest(source)),
+               f'{tmp_path}/a.pdf')
+    # A file left by a crash is skipped by the manifest
+    assert all(is_temp_name(os.path.basename(call.args[0]))
+               for call in replace.call_args_list)
+    assert replace.call_count == 2
+
+
+def test_blob_is_copied_when_it_cannot_be_linked(tmp_path, mocker):
+    mocker.patch('os.link', side_effect=OSError('cross-device link'))
+    store = BlobStore(str(tmp_path))
+    source = tmp_path / 'download'
+    source.write_bytes(b'pdf')
+    store.link(store.add(str(source), file_digest(source)),
+               f'{tmp_path}/a.pdf')
+    assert (tmp_path / 'a.pdf').read_bytes() == b'pdf'
+
+
+def test_blob_store_is_read_from_environment(monkeypatch):
+    monkeypatch.delenv('BLOB_STORE', raising=False)
+    assert not uses_blob_store()
+    monkeypatch.setenv('BLOB_STORE', '1')
+    assert uses_blob_store()
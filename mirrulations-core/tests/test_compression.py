@@ -0,0 +1,41 @@
+import gzip
+import pytest
+from mirrcore.compression import compress, decode, get_compression, \
+    read_json, read_text
+
+
+def test_compressed_text_is_decoded():
+    assert decode(compress('Hello world')) == 'Hello world'
+
+
+def test_uncompressed_text_is_decoded():
+    assert decode('Hello world'.encode('utf8')) == 'Hello world'
+
+
+def test_compression_is_deterministic():
+    assert compress('{"data": 1}') == compress('{"data": 1}')
+    assert gzip.decompress(compress('{"data": 1}')) == b'{"data": 1}'
+
+
+def test_unknown_compression_raises():
+    with pytest.raises(ValueError):
+        compress('text', 'zip')
+
+
+def test_compression_is_read_from_environment(monkeypatch):
+    monkeypatch.delenv('STORAGE_COMPRESSION', raising=False)
+    assert get_compression() is None
+    monkeypatch.setenv('STORAGE_COMPRESSION', 'GZIP')
+    assert get_compression() == 'gzip'
+    monkeypatch.setenv('STORAGE_COMPRESSION', 'zstd')
+    with pytest.raises(ValueError):
+        get_compression()
+
+
+def test_saved_files_are_read_whether_compressed_or_not(tmp_path):
+    plain = tmp_path / 'plain.json'
+    plain.write_text('{"data": 1}', encoding='utf8')
+    packed = tmp_path / 'packed.json'
+    packed.write_bytes(compress('{"data": 1}'))
+    assert read_json(plain) == read_json(packed) == {'data': 1}
+    assert read_text(packed) == '{"data": 1}'
@@ -6,7 +6,7 @@ from mirrcore.data_counts import DataCounts
 class TestDataCounts(unittest.TestCase):
 
     # Test that each count function returns the expected values
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_counts(self, mock_api_request):
         """Tests that each count function returns the expected value"""
         # Set up mock data and objects
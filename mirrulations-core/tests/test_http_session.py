@@ -0,0 +1,29 @@
+from mirrcore.http_session import get_session, size_pool, API_PREFIX, \
+    POOL_SIZES, DEFAULT_POOL_SIZE
+
+
+def test_session_is_shared():
+    assert get_session() is get_session()
+
+
+def test_regulations_hosts_have_own_pools():
+    session = get_session()
+    for prefix, pool_size in POOL_SIZES.items():
+        adapter = session.get_adapter(f'{prefix}/v4/comments')
+        assert adapter._pool_maxsize == pool_size  # pylint: disable=W0212
+
+
+def test_pool_is_resized():
+    size_pool(API_PREFIX, 12)
+    adapter = get_session().get_adapter(f'{API_PREFIX}/v4/comments')
+    assert adapter._pool_maxsize == 12  # pylint: disable=W0212
+    size_pool(API_PREFIX, POOL_SIZES[API_PREFIX])
+
+
+def test_other_hosts_use_default_pool():
+    adapter = get_session().get_adapter('https://example.com')
+    assert adapter._pool_maxsize == DEFAULT_POOL_SIZE  # pylint: disable=W0212
+
+
+def test_gzip_requested():
+    assert 'gzip' in get_session().headers['Accept-Encoding']
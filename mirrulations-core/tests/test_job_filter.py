@@ -0,0 +1,65 @@
+from fakeredis import FakeRedis
+from mirrcore.job_filter import CHUNK_BITS, GENERATIONS, JobFilter, job_key
+
+# Generations of 1024 bits, which hold 71 jobs each
+SMALL_BUDGET = 128 * GENERATIONS
+
+
+def test_job_key():
+    assert job_key('https://a.b/comments/X-1', '2020-01-01T00:00:00Z') == \
+        'https://a.b/comments/X-1@2020-01-01T00:00:00Z'
+
+
+def test_added_keys_are_found():
+    job_filter = JobFilter(FakeRedis(), SMALL_BUDGET)
+    assert job_filter.find_new(['a', 'b']) == [True, True]
+    job_filter.add(['a', 'b'])
+    assert job_filter.find_new(['b', 'c', 'a', 'c']) == \
+        [False, True, False, False]
+
+
+def test_finding_keys_does_not_add_them():
+    database = FakeRedis()
+    job_filter = JobFilter(database, SMALL_BUDGET)
+    assert job_filter.find_new(['a']) == [True]
+    assert job_filter.find_new(['a']) == [True]
+    assert not database.keys()
+
+
+def test_no_keys():
+    database = FakeRedis()
+    job_filter = JobFilter(database, SMALL_BUDGET)
+    assert not job_filter.find_new([])
+    job_filter.add([])
+    assert not database.keys()
+
+
+def test_memory_budget_from_environment(monkeypatch):
+    monkeypatch.setenv('JOB_FILTER_MB', '1')
+    job_filter = JobFilter(FakeRedis())
+    assert job_filter.bits * GENERATIONS == 1024 ** 2 * 8
+    assert job_filter.chunk_bits == CHUNK_BITS
+    assert 500000 < job_filter.capacity * GENERATIONS < 600000
+
+
+def test_full_generation_starts_the_next():
+    database = FakeRedis()
+    job_filter = JobFilter(database, SMALL_BUDGET)
+    first = [f'first-{i}' for i in range(job_filter.capacity)]
+    job_filter.add(first)
+    assert int(database.get('job_filter:generation')) == 1
+    assert int(database.get('job_filter:count')) == 0
+    # Keys in an older generation are still found
+    assert not any(job_filter.find_new(first[:100]))
+
+
+def test_oldest_generation_is_forgotten():
+    database = FakeRedis()
+    job_filter = JobFilter(database, SMALL_BUDGET)
+    job_filter.add(['first'])
+    for generation in range(GENERATIONS):
+        job_filter.add([f'{generation}-{i}'
+                        for i in range(job_filter.capacity)])
+    assert int(database.get('job_filter:generation')) == GENERATIONS
+    assert not database.exists('job_filter:0:0')
+    assert job_filter.find_new(['first']) == [True]
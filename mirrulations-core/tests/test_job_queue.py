@@ -1,9 +1,14 @@
 
+import json
+import time
+import pytest
+import redis
 from fakeredis import FakeRedis
 
 from mirrmock.mock_rabbitmq import MockRabbit
 from mirrmock.mock_redis import MockRedisWithStorage
-from mirrcore.job_queue import JobQueue
+from mirrcore.job_queue import JobQueue, LEASE_SECONDS, MAX_ATTEMPTS
+from mirrcore.job_queue_exceptions import JobQueueException
 
 
 def test_first_job_added_with_id_0():
@@ -106,3 +111,284 @@ def test_decrement_function():
     assert database.get('num_jobs_comments_waiting') == 0
     assert database.get('num_jobs_documents_waiting') == 0
     assert database.get('num_jobs_dockets_waiting') == 0
+
+
+def test_push_mode_job_consumed_from_broker():
+    queue = JobQueue(FakeRedis(), prefetch_count=4)
+    queue.rabbitmq = MockRabbit()
+    queue.add_job('http://a.b.c')
+    assert queue.get_job()['url'] == 'http://a.b.c'
+
+
+def test_push_mode_waits_for_job(mocker):
+    queue = JobQueue(FakeRedis(), prefetch_count=4)
+    queue.rabbitmq = mocker.Mock()
+    queue.rabbitmq.consume_unacked.side_effect = \
+        [None, None, ({'job_id': 1}, 7)]
+    assert queue.get_job() == {'job_id': 1}
+    assert queue.rabbitmq.consume_unacked.call_count == 3
+    queue.rabbitmq.ack.assert_called_once_with(7)
+
+
+def test_lease_job_records_client_and_waiting_count():
+    database = FakeRedis()
+    queue = JobQueue(database)
+    queue.rabbitmq = MockRabbit()
+    queue.add_job('http://a.b.c', job_type='comments')
+
+    job = queue.lease_job('client-1')
+
+    assert database.hget('jobs_in_progress', job['job_id']) == b'http://a.b.c'
+    assert database.hget('client_jobs', job['job_id']) == b'client-1'
+    assert int(database.get('num_jobs_comments_waiting')) == 0
+
+
+def test_lease_job_with_no_jobs_returns_none(mocker):
+    database = FakeRedis()
+    queue = JobQueue(database)
+    queue.rabbitmq = mocker.Mock()
+    queue.rabbitmq.get_unacked.return_value = None
+    assert queue.lease_job('client-1') is None
+    assert not database.exists('jobs_in_progress')
+
+
+def test_leased_job_is_acknowledged_once_its_lease_is_recorded():
+    queue = JobQueue(FakeRedis())
+    queue.rabbitmq = MockRabbit()
+    queue.add_job('http://a.b.c', job_type='comments')
+    queue.lease_job('client-1')
+    assert not queue.rabbitmq.unacked
+    assert queue.rabbitmq.size() == 0
+
+
+def test_job_is_requeued_when_its_lease_cannot_be_recorded(mocker):
+    database = FakeRedis()
+    queue = JobQueue(database)
+    queue.rabbitmq = MockRabbit()
+    queue.add_job('http://a.b.c', job_type='comments')
+    pipeline = mocker.patch.object(database, 'pipeline')
+    pipeline.return_value.execute.side_effect = \
+        redis.exceptions.ConnectionError('Redis is restarting')
+    with pytest.raises(redis.exceptions.ConnectionError):
+        queue.lease_job('client-1')
+    assert queue.rabbitmq.jobs[0]['url'] == 'http://a.b.c'
+    assert not queue.rabbitmq.unacked
+
+
+def test_complete_job_clears_lease_and_counts_job():
+    database = FakeRedis()
+    queue = JobQueue(database)
+    queue.rabbitmq = MockRabbit()
+    queue.add_job('http://a.b.c', job_type='comments')
+    job = queue.lease_job('client-1')
+
+    queue.complete_job(job, attachments=3, pdf_attachments=2)
+
+    assert not database.hexists('jobs_in_progress', job['job_id'])
+    assert not database.hexists('client_jobs', job['job_id'])
+    assert int(database.get('num_comments_done')) == 1
+    assert int(database.get('num_attachments_done')) == 3
+    assert int(database.get('num_pdf_attachments_done')) == 2
+
+
+def test_add_jobs_reserves_ids_in_one_block():
+    database = FakeRedis()
+    queue = JobQueue(database)
+    queue.rabbitmq = MockRabbit()
+    queue.add_job('http://a.b.c')
+    queue.add_jobs([{'url': 'http://d.e.f', 'job_type': 'comments'},
+                    {'url': 'http://g.h.i', 'job_type': 'comments'},
+                    {'url': 'http://j.k.l', 'job_type': 'dockets'}])
+    assert [job['job_id'] for job in queue.rabbitmq.jobs] == [1, 2, 3, 4]
+    assert queue.rabbitmq.jobs[3] == {'job_id': 4, 'url': 'http://j.k.l',
+                                      'job_type': 'dockets',
+                                      'reg_id': None, 'agency': None}
+    assert int(database.get('num_jobs_comments_waiting')) == 2
+    assert int(database.get('num_jobs_dockets_waiting')) == 1
+    assert int(database.get('num_jobs_documents_waiting')) == 0
+
+
+def test_add_jobs_publishes_one_batch(mocker):
+    queue = JobQueue(FakeRedis())
+    queue.rabbitmq = mocker.Mock()
+    queue.add_jobs([{'url': 'http://a.b.c'}, {'url': 'http://d.e.f'}])
+    queue.rabbitmq.add_batch.assert_called_once()
+    queue.rabbitmq.add.assert_not_called()
+
+
+def test_add_no_jobs(mocker):
+    database = FakeRedis()
+    queue = JobQueue(database)
+    queue.rabbitmq = mocker.Mock()
+    queue.add_jobs([])
+    queue.rabbitmq.add_batch.assert_not_called()
+    assert not database.exists('last_job_id')
+
+
+def test_jobs_are_leased_by_weight_with_consistent_counts():
+    database = FakeRedis()
+    queue = JobQueue(database, weights={'dockets': 1, 'comments': 1})
+    queue.rabbitmq.queues = {job_type: MockRabbit()
+                             for job_type in queue.rabbitmq.queues}
+    queue.add_jobs([{'url': f'http://a.b.c/{i}', 'job_type': 'comments'}
+                    for i in range(3)] +
+                   [{'url': 'http://d.e.f', 'job_type': 'dockets'}])
+    leased = [queue.lease_job('client-1')['job_type'] for _ in range(2)]
+    assert sorted(leased) == ['comments', 'dockets']
+    assert queue.get_num_jobs() == 2
+    assert int(database.get('num_jobs_comments_waiting')) == 2
+    assert int(database.get('num_jobs_dockets_waiting')) == 0
+
+
+def test_add_jobs_drops_jobs_queued_before():
+    queue = JobQueue(FakeRedis())
+    queue.rabbitmq = MockRabbit()
+    first = [{'url': 'http://a.b.c', 'last_modified': '2020-01-01'},
+             {'url': 'http://d.e.f', 'last_modified': '2020-01-01'}]
+    assert len(queue.add_jobs(first)) == 2
+    again = [{'url': 'http://a.b.c', 'last_modified': '2020-01-01'},
+             {'url': 'http://d.e.f', 'last_modified': '2021-01-01'},
+             {'url': 'http://g.h.i'}]
+    added = queue.add_jobs(again)
+    assert [job['url'] for job in added] == ['http://d.e.f', 'http://g.h.i']
+    assert queue.get_num_jobs() == 4
+    assert 'last_modified' not in queue.rabbitmq.jobs[0]
+
+
+def test_add_job_drops_job_queued_before():
+    queue = JobQueue(FakeRedis())
+    queue.rabbitmq = MockRabbit()
+    assert queue.add_job('http://a.b.c', last_modified='2020-01-01')
+    assert not queue.add_job('http://a.b.c', last_modified='2020-01-01')
+    assert queue.add_job('http://a.b.c')
+    assert queue.get_num_jobs() == 2
+
+
+def test_jobs_that_fail_to_publish_are_added_when_retried(mocker):
+    queue = JobQueue(FakeRedis())
+    rabbit = MockRabbit()
+    queue.rabbitmq = mocker.Mock()
+    queue.rabbitmq.add.side_effect = JobQueueException()
+    queue.rabbitmq.add_batch.side_effect = JobQueueException()
+    jobs = [{'url': 'http://a.b.c', 'last_modified': '2020-01-01'}]
+    with pytest.raises(JobQueueException):
+        queue.add_jobs(jobs)
+    with pytest.raises(JobQueueException):
+        queue.add_job('http://d.e.f', last_modified='2020-01-01')
+    queue.rabbitmq = rabbit
+    assert len(queue.add_jobs(jobs)) == 1
+    assert queue.add_job('http://d.e.f', last_modified='2020-01-01')
+    assert not queue.add_jobs(jobs)
+
+
+def leased_queue():
+    """
+    Returns a JobQueue, its database and a comment job leased by client-1
+    """
+    database = FakeRedis()
+    queue = JobQueue(database)
+    queue.rabbitmq = MockRabbit()
+    queue.add_job('http://a.b.c', job_type='comments')
+    return queue, database, queue.lease_job('client-1')
+
+
+def test_lease_job_records_lease():
+    _, database, job = leased_queue()
+    deadline = database.zscore('job_leases', job['job_id'])
+    assert deadline == pytest.approx(time.time() + LEASE_SECONDS, abs=5)
+    assert json.loads(database.hget('leased_jobs', job['job_id'])) == job
+
+
+def test_complete_job_ends_lease():
+    queue, database, job = leased_queue()
+    queue.complete_job(job)
+    assert not database.exists('job_leases')
+    assert not database.exists('leased_jobs')
+    assert not queue.reap_expired_leases(time.time() + LEASE_SECONDS + 1)
+
+
+def test_lease_is_not_reaped_before_it_expires():
+    queue, database, _ = leased_queue()
+    assert not queue.reap_expired_leases()
+    assert database.hlen('jobs_in_progress') == 1
+
+
+def test_expired_lease_is_queued_again():
+    queue, database, job = leased_queue()
+    reaped = queue.reap_expired_leases(time.time() + LEASE_SECONDS + 1)
+    assert [job['url'] for job in reaped] == ['http://a.b.c']
+    assert queue.rabbitmq.jobs == reaped
+    assert reaped[0]['job_id'] != job['job_id']
+    assert reaped[0]['attempts'] == 1
+    assert not database.exists('jobs_in_progress')
+    assert not database.exists('client_jobs')
+    assert not database.exists('job_leases')
+    assert not database.exists('leased_jobs')
+    assert int(database.get('num_jobs_comments_waiting')) == 1
+
+
+def test_job_is_invalid_after_max_attempts(capsys):
+    queue, database, job = leased_queue()
+    for _ in range(MAX_ATTEMPTS - 1):
+        queue.reap_expired_leases(time.time() + LEASE_SECONDS + 1)
+        job = queue.lease_job('client-1')
+    assert not queue.reap_expired_leases(time.time() + LEASE_SECONDS + 1)
+    assert queue.get_num_jobs() == 0
+    assert database.hget('invalid_jobs', job['job_id']) == b'http://a.b.c'
+    assert f'expired {MAX_ATTEMPTS} times' in capsys.readouterr().out
+
+
+def test_leases_are_kept_when_jobs_cannot_be_queued(mocker):
+    queue, database, job = leased_queue()
+    queue.rabbitmq = mocker.Mock()
+    queue.rabbitmq.add_batch.side_effect = JobQueueException()
+    with pytest.raises(JobQueueException):
+        queue.reap_expired_leases(time.time() + LEASE_SECONDS + 1)
+    assert database.zscore('job_leases', job['job_id']) is not None
+    assert database.hexists('leased_jobs', job['job_id'])
+
+
+def test_failed_job_is_invalid_and_not_reaped():
+    queue, database, job = leased_queue()
+    queue.fail_job(job)
+    assert database.hget('invalid_jobs', job['job_id']) == b'http://a.b.c'
+    assert not database.exists('jobs_in_progress')
+    assert not database.exists('client_jobs')
+    assert not database.exists('leased_jobs')
+    assert not queue.reap_expired_leases(time.time() + LEASE_SECONDS + 1)
+    assert queue.get_num_jobs() == 0
+
+
+def test_retried_job_is_queued_again_by_the_reaper():
+    queue, database, job = leased_queue()
+    queue.retry_job(job)
+    reaped = queue.reap_expired_leases()
+    assert [job['url'] for job in reaped] == ['http://a.b.c']
+    assert reaped[0]['attempts'] == 1
+    assert not database.exists('jobs_in_progress')
+    assert not database.exists('invalid_jobs')
+
+
+def test_retried_job_is_invalid_after_max_attempts():
+    queue, database, job = leased_queue()
+    for _ in range(MAX_ATTEMPTS - 1):
+        queue.retry_job(job)
+        queue.reap_expired_leases()
+        job = queue.lease_job('client-1')
+    queue.retry_job(job)
+    assert not queue.reap_expired_leases()
+    assert database.hget('invalid_jobs', job['job_id']) == b'http://a.b.c'
+
+
+def test_retrying_a_reaped_job_does_not_lease_it_again():
+    queue, database, job = leased_queue()
+    queue.reap_expired_leases(time.time() + LEASE_SECONDS + 1)
+    queue.retry_job(job)
+    assert not database.exists('job_leases')
+
+
+def test_dropped_save_is_recorded_in_invalid_jobs():
+    database = FakeRedis()
+    JobQueue(database).record_dropped_save('/data/USTR/a.json')
+    assert database.hget('invalid_jobs', '/data/USTR/a.json') == \
+        b'dropped save'
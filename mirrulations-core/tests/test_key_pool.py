@@ -0,0 +1,55 @@
+import pytest
+from fakeredis import FakeRedis
+from mirrcore.key_pool import KeyPool
+
+
+def test_keys_are_used_in_turn():
+    pool = KeyPool(FakeRedis(), ['KEY_1', 'KEY_2'])
+    assert pool.try_acquire() == ('KEY_1', 0)
+    assert pool.try_acquire() == ('KEY_2', 0)
+
+
+def test_key_with_budget_picks_up_slack():
+    pool = KeyPool(FakeRedis(), ['KEY_1', 'KEY_2'])
+    pool.limiters['KEY_1'].try_acquire()
+    # KEY_1 has no token left, so KEY_2 is used even though it is
+    # KEY_1's turn
+    assert pool.try_acquire() == ('KEY_2', 0)
+
+
+def test_no_key_with_budget_returns_shortest_wait():
+    pool = KeyPool(FakeRedis(), ['KEY_1', 'KEY_2'])
+    pool.try_acquire()
+    pool.try_acquire()
+    api_key, wait_time = pool.try_acquire()
+    assert api_key is None
+    assert 3.5 < wait_time <= 3.6
+
+
+def test_acquire_sleeps_until_key_available(mocker):
+    sleep = mocker.patch('time.sleep')
+    pool = KeyPool(FakeRedis(), ['KEY_1'])
+    mocker.patch.object(pool, 'try_acquire',
+                        side_effect=[(None, 2.5), ('KEY_1', 0)])
+    assert pool.acquire() == 'KEY_1'
+    sleep.assert_called_once_with(2.5)
+
+
+def test_update_goes_to_key_limiter(mocker):
+    pool = KeyPool(FakeRedis(), ['KEY_1', 'KEY_2'])
+    update = mocker.patch.object(pool.limiters['KEY_2'], 'update')
+    response = mocker.Mock()
+    pool.update('KEY_2', response)
+    update.assert_called_once_with(response)
+
+
+def test_budgets_do_not_expose_api_keys():
+    pool = KeyPool(FakeRedis(), ['KEY_1', 'KEY_2'])
+    budgets = pool.budgets()
+    assert len(budgets) == 2
+    assert not any('KEY' in key for key in budgets)
+
+
+def test_pool_needs_a_key():
+    with pytest.raises(ValueError):
+        KeyPool(FakeRedis(), [])
@@ -0,0 +1,133 @@
+import os
+import pytest
+from mirrcore.manifest import Manifest, load_manifest, item_details, \
+    MANIFEST_NAME, S3
+
+
+def test_record_and_get(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record(f'{tmp_path}/USTR/USTR-1/file.json', item_id='USTR-1',
+                    item_type='dockets', size=10, digest='abc')
+    assert manifest.get(f'{tmp_path}/USTR/USTR-1/file.json') == {
+        'item_id': 'USTR-1', 'item_type': 'dockets', 'last_modified': None,
+        'size': 10, 'digest': 'abc'}
+
+
+def test_paths_are_recorded_relative_to_root(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record(f'{tmp_path}/USTR/file.json')
+    # Another container mounting the data elsewhere asks without the root
+    assert manifest.has_path('/USTR/file.json')
+    assert not manifest.has_path('/USTR/other.json')
+
+
+def test_locations_are_kept_apart(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record('/USTR/file.json', S3)
+    assert manifest.has_path('/USTR/file.json', S3)
+    assert not manifest.has_path('/USTR/file.json')
+
+
+def test_has_item(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record('/USTR/file.json', item_id='USTR-1')
+    assert manifest.has_item('USTR-1')
+    assert not manifest.has_item('USTR-2')
+
+
+def test_unknown_details_are_rejected(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    with pytest.raises(ValueError):
+        manifest.record('/USTR/file.json', colour='red')
+
+
+def test_paths_with_suffix(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record('/USTR/a.pdf')
+    manifest.record('/USTR/b.json')
+    assert manifest.paths('.pdf') == [f'{tmp_path}/USTR/a.pdf']
+
+
+def test_records_are_not_synced_one_by_one(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    # 1 is NORMAL, which syncs the log at checkpoints
+    assert manifest.connection.execute(
+        'PRAGMA synchronous').fetchone() == (1,)
+
+
+def test_rebuild_records_existing_files(tmp_path):
+    (tmp_path / 'USTR').mkdir()
+    (tmp_path / 'USTR' / 'USTR-1.json').write_text('{}')
+    (tmp_path / 'USTR' / 'USTR-1.json.sha256').write_text('abc\n')
+    (tmp_path / 'USTR' / '.a.pdf.1a2b3c4d.tmp').write_bytes(b'\x17')
+    (tmp_path / 'USTR' / 'a.pdf').write_bytes(b'\x17' * 5)
+    manifest = Manifest(str(tmp_path))
+    assert not manifest.is_complete()
+    manifest.rebuild()
+    assert manifest.is_complete()
+    assert manifest.get('/USTR/USTR-1.json')['item_id'] == 'USTR-1'
+    assert manifest.get('/USTR/a.pdf')['size'] == 5
+    assert not manifest.has_path('/USTR/USTR-1.json.sha256')
+    assert not manifest.has_path('/USTR/.a.pdf.1a2b3c4d.tmp')
+    assert not manifest.has_path(f'/{MANIFEST_NAME}')
+
+
+def test_rebuild_skips_hidden_directories(tmp_path):
+    (tmp_path / '.retry_spool').mkdir()
+    (tmp_path / '.retry_spool' / 'spool.jsonl').write_text('{}\n')
+    manifest = Manifest(str(tmp_path))
+    manifest.rebuild()
+    assert not manifest.has_path('/.retry_spool/spool.jsonl')
+
+
+def test_rebuild_records_items_in_the_layout(tmp_path):
+    comments = tmp_path / 'USTR' / 'USTR-1' / 'text-USTR-1' / 'comments'
+    comments.mkdir(parents=True)
+    (comments / 'USTR-1-1.json').write_text('{}')
+    manifest = Manifest(str(tmp_path))
+    manifest.rebuild()
+    entry = manifest.get('/USTR/USTR-1/text-USTR-1/comments/USTR-1-1.json')
+    assert (entry['item_id'], entry['item_type']) == ('USTR-1-1', 'comments')
+
+
+def test_load_manifest_only_when_built(tmp_path):
+    assert load_manifest(str(tmp_path)) is None
+    Manifest(str(tmp_path))
+    assert os.path.exists(tmp_path / MANIFEST_NAME)
+    assert load_manifest(str(tmp_path)) is None
+    Manifest(str(tmp_path)).rebuild()
+    assert load_manifest(str(tmp_path)).is_complete()
+
+
+def test_item_details():
+    data = {'data': {'id': 'USTR-1', 'type': 'dockets',
+                     'attributes': {'lastModifiedDate': '2020-01-01'}}}
+    assert item_details(data) == {'item_id': 'USTR-1',
+                                  'item_type': 'dockets',
+                                  'last_modified': '2020-01-01'}
+    assert not item_details({'errors': []})
+    assert not item_details('text')
+
+
+def test_rebuild_records_packed_items(tmp_path):
+    comments = tmp_path / 'USTR' / 'comments'
+    comments.mkdir(parents=True)
+    (comments / 'shard-00000.jsonl').write_text('{}\n{"a": 1}\n')
+    (comments / 'index.jsonl').write_text(
+        '{"id": "USTR-1-1", "shard": "shard-00000.jsonl", "offset": 0, '
+        '"length": 3, "digest": "a"}\n'
+        '{"id": "USTR-1-1", "shard": "shard-00000.jsonl", "offset": 3, '
+        '"length": 9, "digest": "b"}\n')
+    manifest = Manifest(str(tmp_path))
+    manifest.rebuild()
+    assert manifest.get('/USTR/comments/USTR-1-1.json')['size'] == 9
+    assert manifest.has_item('USTR-1-1')
+
+
+def test_paths_with_digest(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record('/USTR/a.pdf', digest='abc')
+    manifest.record('/USTR/b.pdf', digest='abc')
+    manifest.record('/USTR/c.pdf', digest='def')
+    assert sorted(manifest.paths_with_digest('abc')) == \
+        [f'{tmp_path}/USTR/a.pdf', f'{tmp_path}/USTR/b.pdf']
@@ -0,0 +1,72 @@
+import pytest
+from mirrcore.mirror_path import MirrorPath, extracted_text_path, \
+    format_path, parse_path, parse_paths
+
+DOCKET = '/USTR/USTR-2015-0010/text-USTR-2015-0010'
+BINARY = '/USTR/USTR-2015-0010/binary-USTR-2015-0010'
+
+PATHS = [
+    f'/data{DOCKET}/docket/USTR-2015-0010.json',
+    f'/data{DOCKET}/documents/USTR-2015-0010-0001.json',
+    f'/data{DOCKET}/documents/USTR-2015-0010-0001_content.htm',
+    f'/data{DOCKET}/comments/USTR-2015-0010-0002.json',
+    f'{BINARY}/comments_attachments/USTR-2015-0010-0002_attachment_1.pdf',
+    f'/data/data{BINARY}/documents_attachments/'
+    'USTR-2015-0010-0001_content.pdf',
+    f'/data{DOCKET}/comments_extracted_text/pdfminer/'
+    'USTR-2015-0010-0002_attachment_1_extracted.txt',
+    f'/data{DOCKET}/documents_extracted_text/pdfminer/'
+    'USTR-2015-0010-0001_content_extracted.txt'
+]
+
+
+def test_parse_comment_attachment():
+    assert parse_path(f'/data{BINARY}/comments_attachments/'
+                      'USTR-2015-0010-0002_attachment_1.pdf') == \
+        MirrorPath('/data', 'USTR', 'USTR-2015-0010', 'comments_attachments',
+                   None, 'USTR-2015-0010-0002', 'attachment_1', 'pdf')
+
+
+def test_parse_extracted_text():
+    parsed = parse_path(PATHS[6])
+    assert parsed.kind == 'comments_extracted_text'
+    assert parsed.tool == 'pdfminer'
+    assert parsed.item == 'USTR-2015-0010-0002'
+    assert parsed.attachment == 'attachment_1'
+    assert parsed.extension == 'txt'
+
+
+def test_parse_json_has_no_attachment():
+    parsed = parse_path(PATHS[0])
+    assert (parsed.kind, parsed.item, parsed.attachment) == \
+        ('docket', 'USTR-2015-0010', None)
+
+
+def test_format_path_reverses_parse_path():
+    for path in PATHS:
+        assert format_path(parse_path(path)) == path
+
+
+@pytest.mark.parametrize('path', [
+    'a.pdf',
+    '/USTR/USTR-1.json',
+    f'/data{DOCKET}/unknown/USTR-2015-0010-0002.json',
+    f'/data{BINARY}/comments/USTR-2015-0010-0002.json',
+    f'/data{DOCKET}/comments_attachments/USTR-2015-0010-0002_1.pdf',
+    '/data/USTR/USTR-2015-0010/text-USTR-2016-0001/comments/a.json',
+    f'/data{DOCKET}/comments_extracted_text/a_extracted.txt'
+])
+def test_parse_path_rejects_other_paths(path):
+    with pytest.raises(ValueError):
+        parse_path(path)
+
+
+def test_parse_paths_marks_other_paths():
+    assert parse_paths([PATHS[0], 'a.pdf']) == [parse_path(PATHS[0]), None]
+
+
+def test_extracted_text_path():
+    attachment = parse_path(PATHS[5])
+    assert format_path(extracted_text_path(attachment)) == \
+        f'/data/data{DOCKET}/documents_extracted_text/pdfminer/' \
+        'USTR-2015-0010-0001_content_extracted.txt'
@@ -1,5 +1,5 @@
 from mirrcore.path_generator import PathGenerator
-from pytest import fixture
+from pytest import fixture, raises
 
 
 @fixture(name='generator')
@@ -436,3 +436,36 @@ def test_extractor_save_path():
                     "comments_extracted_text/pdfminer/" + \
                     "USTR-2015-0010-0002_attachment_1_extracted.txt"
     assert save_path == expected_path
+
+
+def test_extractor_save_path_of_document_attachment():
+    path = "/data/USTR/USTR-2015-0010/binary-USTR-2015-0010/" + \
+           "documents_attachments/USTR-2015-0010-0001_content.pdf"
+    assert PathGenerator.make_attachment_save_path(path) == \
+        "/data/USTR/USTR-2015-0010/text-USTR-2015-0010/" + \
+        "documents_extracted_text/pdfminer/" + \
+        "USTR-2015-0010-0001_content_extracted.txt"
+
+
+def test_extractor_save_path_of_other_path():
+    with raises(ValueError):
+        PathGenerator.make_attachment_save_path('/data/comments/a.pdf')
+
+
+def test_get_paths_matches_get_path(generator):
+    items = [
+        get_test_docket()['data'],
+        get_test_document()['data'],
+        {'id': 'VETS-2010-0001-0010', 'type': 'comments', 'attributes': {}},
+        {'type': 'comments', 'attributes': {'agencyId': 'VETS'}},
+        {'type': 'dockets', 'attributes': {}},
+        {'id': 'FR-2020-1', 'type': 'documents',
+         'attributes': {'agencyId': 'EPA', 'docketId': None}},
+        {'id': 'USTR-1', 'type': 'unknowns', 'attributes': {}}
+    ]
+    assert generator.get_paths(items) == \
+        [generator.get_path({'data': item}) for item in items]
+
+
+def test_get_paths_of_empty_item_is_unknown(generator):
+    assert generator.get_paths([{}, []]) == ['/unknown/unknown.json'] * 2
@@ -1,7 +1,7 @@
 # pylint: disable=unused-argument
 from unittest.mock import MagicMock
 from mirrcore.job_queue_exceptions import JobQueueException
-from mirrcore.rabbitmq import RabbitMQ
+from mirrcore.rabbitmq import RabbitConnection, RabbitMQ
 import pika
 import pytest
 
@@ -17,17 +17,44 @@ class ChannelSpy:
     def queue_declare(self, *args, **kwargs):
         return MagicMock()
 
+    def __init__(self):
+        self.is_open = True
+        self.published = 0
+        self.committed = 0
+
     def basic_publish(self, *args, **kwargs):
+        self.published += 1
+
+    def tx_select(self, *args, **kwargs):
         pass
 
+    def tx_commit(self, *args, **kwargs):
+        self.committed = self.published
+
     def basic_get(self, *args, **kwargs):
         return None, None, None
 
+    def basic_qos(self, *args, **kwargs):
+        pass
+
+    def basic_ack(self, *args, **kwargs):
+        pass
+
+    def basic_nack(self, *args, **kwargs):
+        pass
+
+    def consume(self, *args, **kwargs):
+        yield MagicMock(), None, b'{"job_id": 1}'
+        while True:
+            yield None, None, None
+
 
 class PikaSpy:
+    opened = 0
 
     def __init__(self, *args, **kwargs):
         self.is_open = True
+        PikaSpy.opened += 1
 
     def channel(self, *args, **kwargs):
         return ChannelSpy()
@@ -42,15 +69,33 @@ class BadPikaSpy:
 
 
 class BadConnectionSpy:
+    is_open = True
+
     def queue_declare(self, *args, **kwargs):
         return MagicMock()
 
     def basic_publish(self, *args, **kwargs):
         raise pika.exceptions.StreamLostError()
 
+    def tx_select(self, *args, **kwargs):
+        pass
+
     def basic_get(self, *args, **kwargs):
         raise pika. exceptions.StreamLostError()
 
+    def basic_qos(self, *args, **kwargs):
+        pass
+
+    def basic_ack(self, *args, **kwargs):
+        raise pika.exceptions.StreamLostError()
+
+    def basic_nack(self, *args, **kwargs):
+        raise pika.exceptions.StreamLostError()
+
+    def consume(self, *args, **kwargs):
+        raise pika.exceptions.StreamLostError()
+        yield  # pylint: disable=unreachable
+
 
 def test_rabbit_interactions(monkeypatch):
 
@@ -62,6 +107,52 @@ def test_rabbit_interactions(monkeypatch):
     rabbit.get()
 
 
+def test_rabbit_consume_returns_pushed_jobs(monkeypatch):
+    monkeypatch.setattr(pika, 'BlockingConnection', PikaSpy)
+
+    rabbit = RabbitMQ('jobs_waiting_queue', prefetch_count=4)
+    assert rabbit.consume() == {'job_id': 1}
+    assert rabbit.consume() is None
+
+
+def test_rabbit_unacked_job_is_returned_with_its_delivery_tag(monkeypatch):
+    monkeypatch.setattr(pika, 'BlockingConnection', PikaSpy)
+
+    rabbit = RabbitMQ('jobs_waiting_queue', prefetch_count=4)
+    job, delivery_tag = rabbit.consume_unacked()
+    assert job == {'job_id': 1}
+    rabbit.channel.basic_ack = MagicMock()
+    rabbit.channel.basic_nack = MagicMock()
+    rabbit.ack(delivery_tag)
+    rabbit.channel.basic_ack.assert_called_once_with(delivery_tag)
+    rabbit.requeue(delivery_tag)
+    rabbit.channel.basic_nack.assert_called_once_with(delivery_tag,
+                                                      requeue=True)
+
+
+def test_rabbit_consumer_started_once(monkeypatch):
+    monkeypatch.setattr(pika, 'BlockingConnection', PikaSpy)
+
+    rabbit = RabbitMQ('jobs_waiting_queue', prefetch_count=4)
+    rabbit.consume()
+    consumer = rabbit.consumer
+    rabbit.consume()
+    assert rabbit.consumer is consumer
+
+
+def test_rabbit_batch_is_committed_on_its_own_channel(monkeypatch):
+    monkeypatch.setattr(pika, 'BlockingConnection', PikaSpy)
+
+    rabbit = RabbitMQ('jobs_waiting_queue')
+    rabbit.add('foo')
+    rabbit.add_batch(['a', 'b', 'c'])
+    rabbit.add_batch(['d'])
+    assert rabbit.batch_channel is not rabbit.channel
+    # pylint: disable=no-member
+    assert rabbit.channel.published == 1
+    assert rabbit.batch_channel.committed == 4
+
+
 def test_rabbit_error_interactions(monkeypatch):
     monkeypatch.setattr(pika, 'BlockingConnection', BadPikaSpy)
 
@@ -71,7 +162,45 @@ def test_rabbit_error_interactions(monkeypatch):
     with pytest.raises(JobQueueException):
         rabbitmq.add('foo')
 
+    with pytest.raises(JobQueueException):
+        rabbitmq.add_batch(['foo'])
+    assert rabbitmq.batch_channel is None
+
     # Ensure that the exception is caught and re-raised as a
     # JobQueueException in get()
     with pytest.raises(JobQueueException):
         rabbitmq.get()
+
+    # Ensure the consumer is restarted after the connection is lost
+    with pytest.raises(JobQueueException):
+        rabbitmq.consume()
+    assert rabbitmq.consumer is None
+
+    with pytest.raises(JobQueueException):
+        rabbitmq.ack(1)
+    with pytest.raises(JobQueueException):
+        rabbitmq.requeue(1)
+
+
+def test_rabbits_share_a_connection(monkeypatch):
+    monkeypatch.setattr(pika, 'BlockingConnection', PikaSpy)
+    monkeypatch.setattr(PikaSpy, 'opened', 0)
+
+    connection = RabbitConnection()
+    first = RabbitMQ('jobs_waiting_queue_dockets', connection=connection)
+    second = RabbitMQ('jobs_waiting_queue_comments', connection=connection)
+    first.add('foo')
+    second.add('bar')
+    assert PikaSpy.opened == 1
+    assert first.channel is not second.channel
+
+
+def test_rabbit_reopens_closed_channel(monkeypatch):
+    monkeypatch.setattr(pika, 'BlockingConnection', PikaSpy)
+
+    rabbit = RabbitMQ('jobs_waiting_queue')
+    rabbit.add('foo')
+    closed = rabbit.channel
+    closed.is_open = False
+    rabbit.add('bar')
+    assert rabbit.channel is not closed
@@ -0,0 +1,108 @@
+import time
+from email.utils import formatdate
+import requests
+from fakeredis import FakeRedis
+from mirrcore.rate_limiter import RateLimiter, retry_after_seconds, \
+    DEFAULT_RETRY_AFTER
+
+
+def test_first_call_takes_token():
+    limiter = RateLimiter(FakeRedis(), 'FAKE_KEY')
+    assert limiter.try_acquire() == 0
+
+
+def test_second_call_waits_for_next_token():
+    limiter = RateLimiter(FakeRedis(), 'FAKE_KEY')
+    limiter.try_acquire()
+    wait_time = limiter.try_acquire()
+    # 1000 calls per hour is one call every 3.6 seconds
+    assert 3.5 < wait_time <= 3.6
+
+
+def test_limiters_with_same_key_share_bucket():
+    database = FakeRedis()
+    RateLimiter(database, 'FAKE_KEY').try_acquire()
+    assert RateLimiter(database, 'FAKE_KEY').try_acquire() > 0
+    assert RateLimiter(database, 'OTHER_KEY').try_acquire() == 0
+
+
+def test_bucket_refills_over_time():
+    database = FakeRedis()
+    limiter = RateLimiter(database, 'FAKE_KEY')
+    limiter.try_acquire()
+    updated = float(database.hget(limiter.key, 'updated'))
+    database.hset(limiter.key, 'updated', updated - 3.6)
+    assert limiter.try_acquire() == 0
+
+
+def test_api_key_is_not_stored_in_redis():
+    limiter = RateLimiter(FakeRedis(), 'FAKE_KEY')
+    assert 'FAKE_KEY' not in limiter.key
+
+
+def test_acquire_sleeps_until_token_available(mocker):
+    sleep = mocker.patch('time.sleep')
+    limiter = RateLimiter(FakeRedis(), 'FAKE_KEY')
+    mocker.patch.object(limiter, 'try_acquire', side_effect=[2.5, 0])
+    limiter.acquire()
+    sleep.assert_called_once_with(2.5)
+
+
+def make_response(status_code=200, headers=None):
+    response = requests.models.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+def test_remaining_calls_can_be_made_back_to_back():
+    limiter = RateLimiter(FakeRedis(), 'FAKE_KEY')
+    limiter.try_acquire()
+    limiter.update(make_response(headers={'X-RateLimit-Limit': '1000',
+                                          'X-RateLimit-Remaining': '3'}))
+    assert [limiter.try_acquire() for _ in range(3)] == [0, 0, 0]
+    assert limiter.try_acquire() > 0
+
+
+def test_no_remaining_calls_trickles_at_limit_rate():
+    limiter = RateLimiter(FakeRedis(), 'FAKE_KEY')
+    limiter.update(make_response(headers={'X-RateLimit-Limit': '3600',
+                                          'X-RateLimit-Remaining': '0'}))
+    assert 0.9 < limiter.try_acquire() <= 1
+
+
+def test_too_many_requests_waits_for_retry_after():
+    limiter = RateLimiter(FakeRedis(), 'FAKE_KEY')
+    limiter.update(make_response(429, {'Retry-After': '120'}))
+    assert 119 < limiter.try_acquire() <= 120
+
+
+def test_budget_reports_headers():
+    limiter = RateLimiter(FakeRedis(), 'FAKE_KEY')
+    assert limiter.budget() == {'limit': None, 'remaining': None,
+                                'tokens': 1}
+    limiter.update(make_response(headers={'X-RateLimit-Limit': '1000',
+                                          'X-RateLimit-Remaining': '42'}))
+    assert limiter.budget() == {'limit': 1000, 'remaining': 42,
+                                'tokens': 42}
+
+
+def test_response_without_headers_leaves_bucket_alone():
+    limiter = RateLimiter(FakeRedis(), 'FAKE_KEY')
+    limiter.update(make_response())
+    assert limiter.budget()['tokens'] == 1
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(make_response(429)) == DEFAULT_RETRY_AFTER
+    assert retry_after_seconds(
+        make_response(429, {'Retry-After': '30'})) == 30
+    assert retry_after_seconds(
+        make_response(429, {'Retry-After': 'soon'})) == DEFAULT_RETRY_AFTER
+
+
+def test_retry_after_as_http_date():
+    retry_at = formatdate(time.time() + 100, usegmt=True)
+    seconds = retry_after_seconds(make_response(429,
+                                                {'Retry-After': retry_at}))
+    assert 98 < seconds <= 100
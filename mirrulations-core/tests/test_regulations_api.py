@@ -62,3 +62,16 @@ def test_params_passed(requests_mock, mocker):
     # Since the order of the params could be changed, I just look
     # for the string in the overall url
     assert 'key=value' in call.url
+
+
+def test_rate_limiter_used_instead_of_sleep(requests_mock, mocker):
+    fake_time = mocker.patch('time.sleep')
+    requests_mock.get('http://a.b.c', json={'foo': 'bar'})
+    rate_limiter = mocker.Mock()
+
+    api = RegulationsAPI('FAKE_KEY', rate_limiter)
+    api.download('http://a.b.c')
+
+    rate_limiter.acquire.assert_called_once()
+    rate_limiter.update.assert_called_once()
+    assert not fake_time.called
@@ -0,0 +1,72 @@
+import json
+import pytest
+from mirrcore.shards import ShardReader, is_packed, is_shard_file, \
+    shard_name, truncate_partial_line
+
+
+def pack(directory, items):
+    """
+    Writes items, (id, json) pairs, to one shard and its index
+    """
+    offset = 0
+    with open(directory / shard_name(0), 'wb') as shard, \
+            open(directory / 'index.jsonl', 'w', encoding='utf8') as index:
+        for item_id, data in items:
+            line = f'{json.dumps(data)}\n'.encode('utf8')
+            shard.write(line)
+            index.write(json.dumps({'id': item_id, 'shard': shard_name(0),
+                                    'offset': offset, 'length': len(line),
+                                    'digest': ''}) + '\n')
+            offset += len(line)
+
+
+def test_item_is_read_by_id(tmp_path):
+    pack(tmp_path, [('USTR-1-1', {'data': 1}), ('USTR-1-2', {'data': 2})])
+    reader = ShardReader(str(tmp_path))
+    assert reader.ids() == ['USTR-1-1', 'USTR-1-2']
+    assert reader.get('USTR-1-2') == {'data': 2}
+    assert reader.has_item('USTR-1-1')
+
+
+def test_latest_version_is_read_by_default(tmp_path):
+    pack(tmp_path, [('USTR-1-1', {'data': 1}), ('USTR-1-1', {'data': 2})])
+    reader = ShardReader(str(tmp_path))
+    assert reader.get('USTR-1-1') == {'data': 2}
+    assert reader.get('USTR-1-1', version=0) == {'data': 1}
+
+
+def test_missing_item_raises(tmp_path):
+    reader = ShardReader(str(tmp_path))
+    assert not reader.ids()
+    with pytest.raises(KeyError):
+        reader.get('USTR-1-1')
+
+
+def test_index_line_cut_off_by_a_crash_is_skipped(tmp_path):
+    pack(tmp_path, [('USTR-1-1', {'data': 1})])
+    with open(tmp_path / 'index.jsonl', 'a', encoding='utf8') as index:
+        index.write('{"id": "USTR-1-2", "sha')
+    assert ShardReader(str(tmp_path)).ids() == ['USTR-1-1']
+
+
+def test_truncate_partial_line(tmp_path):
+    path = tmp_path / 'index.jsonl'
+    path.write_bytes(b'{"id": 1}\n{"id"')
+    truncate_partial_line(path)
+    assert path.read_bytes() == b'{"id": 1}\n'
+    truncate_partial_line(path)
+    assert path.read_bytes() == b'{"id": 1}\n'
+
+
+def test_shard_files_are_recognised():
+    assert shard_name(12) == 'shard-00012.jsonl'
+    assert is_shard_file('shard-00012.jsonl')
+    assert is_shard_file('index.jsonl')
+    assert not is_shard_file('USTR-1-1.json')
+
+
+def test_packed_storage_is_read_from_environment(monkeypatch):
+    monkeypatch.delenv('PACKED_STORAGE', raising=False)
+    assert not is_packed()
+    monkeypatch.setenv('PACKED_STORAGE', 'true')
+    assert is_packed()
@@ -0,0 +1,14 @@
+import os
+from mirrcore.temp_paths import is_temp_name, temp_path_for
+
+
+def test_temp_path_is_hidden_beside_path():
+    temp_path = temp_path_for('/data/USTR/a.pdf')
+    assert os.path.dirname(temp_path) == '/data/USTR'
+    assert is_temp_name(os.path.basename(temp_path))
+    assert temp_path != temp_path_for('/data/USTR/a.pdf')
+
+
+def test_data_files_are_not_temp_names():
+    assert not is_temp_name('a.pdf')
+    assert not is_temp_name('a.tmp')
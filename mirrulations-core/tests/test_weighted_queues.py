@@ -0,0 +1,111 @@
+from collections import Counter
+import pytest
+from mirrmock.mock_rabbitmq import MockRabbit
+from mirrcore.rabbitmq import RabbitMQ
+from mirrcore.weighted_queues import DEFAULT_WEIGHTS, WeightedQueues, \
+    weighted_schedule, weights_from_environment
+
+
+def make_queues(weights):
+    queues = WeightedQueues(weights=weights)
+    queues.queues = {job_type: MockRabbit() for job_type in queues.queues}
+    return queues
+
+
+def add(queues, job_type, count):
+    queues.add_batch([{'job_id': i, 'job_type': job_type}
+                      for i in range(count)])
+
+
+def test_weighted_schedule_spreads_turns():
+    assert weighted_schedule({'a': 2, 'b': 1}) == ['a', 'b', 'a']
+    assert Counter(weighted_schedule(DEFAULT_WEIGHTS)) == \
+        Counter(DEFAULT_WEIGHTS)
+
+
+def test_weights_from_environment(monkeypatch):
+    monkeypatch.delenv('JOB_WEIGHTS', raising=False)
+    assert weights_from_environment() == DEFAULT_WEIGHTS
+    monkeypatch.setenv('JOB_WEIGHTS', 'dockets=9, comments=3')
+    assert weights_from_environment() == {'dockets': 9, 'comments': 3}
+
+
+@pytest.mark.parametrize('setting', ['dockets=0', 'dockets', 'dockets=a',
+                                     'docket=4'])
+def test_invalid_weights(monkeypatch, setting):
+    monkeypatch.setenv('JOB_WEIGHTS', setting)
+    with pytest.raises(ValueError):
+        weights_from_environment()
+
+
+def test_jobs_are_queued_by_type():
+    queues = make_queues({'dockets': 1, 'comments': 1})
+    add(queues, 'dockets', 2)
+    add(queues, 'comments', 3)
+    queues.add({'job_id': 0, 'job_type': 'documents'})
+    queues.add({'job_id': 1})
+    assert queues.queues['dockets'].size() == 2
+    assert queues.queues['comments'].size() == 3
+    assert queues.queues['documents'].size() == 1
+    assert queues.queues[None].size() == 1
+    assert queues.size() == 7
+
+
+def test_type_left_out_of_weights_keeps_its_queue():
+    queues = make_queues({'dockets': 4, 'documents': 2})
+    assert set(queues.queues) == {'dockets', 'documents', 'comments', None}
+    add(queues, 'comments', 1)
+    assert queues.get()['job_type'] == 'comments'
+
+
+def test_jobs_are_taken_by_weight():
+    queues = make_queues({'dockets': 3, 'comments': 1})
+    add(queues, 'dockets', 100)
+    add(queues, 'comments', 100)
+    taken = Counter(queues.get()['job_type'] for _ in range(40))
+    assert taken == {'dockets': 30, 'comments': 10}
+
+
+def test_backlog_does_not_hold_back_other_types():
+    queues = make_queues({'dockets': 1, 'comments': 1})
+    add(queues, 'comments', 1000)
+    add(queues, 'dockets', 1)
+    jobs = [queues.get()['job_type'] for _ in range(3)]
+    assert 'dockets' in jobs
+
+
+def test_empty_queues_give_up_their_turns():
+    queues = make_queues({'dockets': 4, 'comments': 1})
+    add(queues, 'comments', 5)
+    assert [queues.get()['job_type'] for _ in range(5)] == ['comments'] * 5
+    assert queues.get() is None
+
+
+def test_consume_waits_when_every_queue_is_empty(mocker):
+    sleep = mocker.patch('time.sleep')
+    queues = make_queues({'dockets': 1})
+    assert queues.consume() is None
+    sleep.assert_called_once()
+    add(queues, 'dockets', 1)
+    assert queues.consume() == {'job_id': 0, 'job_type': 'dockets'}
+    sleep.assert_called_once()
+
+
+def test_queues_share_one_connection():
+    queues = WeightedQueues(weights=DEFAULT_WEIGHTS)
+    connections = {id(queue.connection) for queue in queues.queues.values()}
+    assert len(connections) == 1
+    assert all(isinstance(queue, RabbitMQ)
+               for queue in queues.queues.values())
+
+
+def test_unacked_job_is_acknowledged_on_its_queue():
+    queues = make_queues({'dockets': 1, 'comments': 1})
+    add(queues, 'comments', 1)
+    job, delivery = queues.get_unacked()
+    assert job['job_type'] == 'comments'
+    queues.requeue(delivery)
+    assert queues.queues['comments'].size() == 1
+    _, delivery = queues.consume_unacked()
+    queues.ack(delivery)
+    assert not queues.queues['comments'].unacked
@@ -8,6 +8,8 @@ import pikepdf
 import redis
 from mirrcore.path_generator import PathGenerator
 from mirrcore.jobs_statistics import JobStatistics
+from mirrcore.manifest import load_manifest
+from mirrcore.compression import get_compression, read_text
 from mirrclient.saver import Saver
 from mirrclient.s3_saver import S3Saver
 from mirrclient.disk_saver import DiskSaver
@@ -17,6 +19,12 @@ class Extractor:
     """
     Class containing methods to extract text from files.
     """
+    # Set to the Manifest once it has been built, so that pdfs and
+    # extracted text are looked up in it instead of on disk
+    manifest = None
+    # The codec extracted text is saved with, see mirrcore.compression
+    compression = None
+
     @staticmethod
     def init_job_stat():
         """
@@ -46,6 +54,9 @@ class Extractor:
         #   (ex. /path/to/pdf/attachment_1.pdf -> pdf)
         file_type = attachment_path[attachment_path.rfind('.')+1:]
         if file_type.endswith('pdf'):
+            if Extractor.copy_identical_extraction(attachment_path,
+                                                   save_path):
+                return
             print(f"Extracting text from {attachment_path}")
             Extractor._extract_pdf(attachment_path, save_path)
         else:
@@ -85,32 +96,87 @@ class Extractor:
                   f"text from {attachment_path}\n{err}")
             return
         # Save the extracted text to a file
-        saver = Saver([DiskSaver(), S3Saver("mirrulations")])
-        saver.save_text(save_path, text.strip())
+        Extractor._saver().save_text(save_path, text.strip())
         print(f"SUCCESS: Saved extraction at {save_path}")
         try:
             Extractor.job_stat.increase_extractions_done()
         except redis.ConnectionError as error:
             print(f"Coudn't increase extraction cache number due to: {error}")
 
+    @staticmethod
+    def copy_identical_extraction(attachment_path, save_path):
+        """
+        Saves the text already extracted from an identical attachment,
+        found by its digest in the manifest, at save_path instead of
+        extracting the attachment again. Attachments only have a digest
+        in the manifest when the client uses the blob store.
+        Returns whether there was such text.
+        """
+        if Extractor.manifest is None:
+            return False
+        entry = Extractor.manifest.get(attachment_path)
+        if entry is None or entry['digest'] is None:
+            return False
+        for path in Extractor.manifest.paths_with_digest(entry['digest']):
+            try:
+                text_path = PathGenerator.make_attachment_save_path(path)
+            except ValueError:
+                # Not in the layout, so it has no extracted text
+                continue
+            if path != attachment_path and \
+                    Extractor.manifest.has_path(text_path):
+                Extractor._saver().save_text(save_path, read_text(text_path))
+                print(f"SUCCESS: Copied extraction of {path} to {save_path}")
+                return True
+        return False
+
+    @staticmethod
+    def _saver():
+        return Saver([DiskSaver(Extractor.manifest, Extractor.compression),
+                      S3Saver("mirrulations", Extractor.manifest,
+                              Extractor.compression)])
+
+    @staticmethod
+    def find_pdfs():
+        """
+        Returns the path of every pdf under /data, read from the manifest
+        if there is one and otherwise found by walking the directories.
+        """
+        if Extractor.manifest is not None:
+            return Extractor.manifest.paths('pdf')
+        return [os.path.join(root, file)
+                for (root, _, files) in os.walk('/data')
+                for file in files if file.endswith('pdf')]
+
+    @staticmethod
+    def is_extracted(save_path):
+        """
+        Returns whether the text of an attachment has been saved.
+        """
+        if Extractor.manifest is not None:
+            return Extractor.manifest.has_path(save_path)
+        return os.path.isfile(save_path)
+
 
 if __name__ == '__main__':
     Extractor.init_job_stat()
+    Extractor.compression = get_compression()
     now = datetime.now()
     while True:
-        for (root, dirs, files) in os.walk('/data'):
-            for file in files:
-                # Checks for pdfs
-                if not file.endswith('pdf'):
-                    continue
-                complete_path = os.path.join(root, file)
+        if Extractor.manifest is None:
+            Extractor.manifest = load_manifest()
+        for complete_path in Extractor.find_pdfs():
+            try:
                 output_path = PathGenerator\
                     .make_attachment_save_path(complete_path)
-                if not os.path.isfile(output_path):
-                    start_time = time.time()
-                    Extractor.extract_text(complete_path, output_path)
-                    print(f"Time taken to extract text from {complete_path}"
-                          f" is {time.time() - start_time} seconds")
+            except ValueError as error:
+                print(f"FAILURE: {error}")
+                continue
+            if not Extractor.is_extracted(output_path):
+                start_time = time.time()
+                Extractor.extract_text(complete_path, output_path)
+                print(f"Time taken to extract text from {complete_path}"
+                      f" is {time.time() - start_time} seconds")
         # sleep for a hour
         current_time = now.strftime("%H:%M:%S")
         print(f"Sleeping for an hour : started at {current_time}")
@@ -63,6 +63,7 @@ def test_redis_connection_error(mocker, capfd):
     mocker.patch('pdfminer.high_level.extract_text', return_value='test')
     mocker.patch('os.makedirs', return_value=None)
     mocker.patch("builtins.open", mocker.mock_open())
+    mocker.patch('os.replace')
     job_stat = JobStatistics(MockRedisWithStorage())
     Extractor.job_stat = job_stat
     Extractor.job_stat.increase_extractions_done = \
@@ -82,8 +83,78 @@ def test_extract_pdf(mocker, capfd):
     mocker.patch('pdfminer.high_level.extract_text', return_value='test')
     mocker.patch('os.makedirs', return_value=None)
     mocker.patch("builtins.open", mocker.mock_open())
+    mocker.patch('os.replace')
     job_stat = JobStatistics(MockRedisWithStorage())
     Extractor.job_stat = job_stat
     Extractor.extract_text('a.pdf', 'b.txt')
     assert "SUCCESS: Saved extraction at" in capfd.readouterr()[0]
     assert job_stat.get_jobs_done()['num_extractions_done'] == 1
+
+
+def test_find_pdfs_walks_data_without_manifest(mocker):
+    mocker.patch('os.walk', return_value=[('/data/USTR', [],
+                                           ['a.pdf', 'b.json'])])
+    assert Extractor.find_pdfs() == ['/data/USTR/a.pdf']
+
+
+def test_find_pdfs_reads_manifest(mocker):
+    walk = mocker.patch('os.walk')
+    manifest = mocker.Mock()
+    manifest.paths.return_value = ['/data/USTR/a.pdf']
+    mocker.patch.object(Extractor, 'manifest', manifest)
+    assert Extractor.find_pdfs() == ['/data/USTR/a.pdf']
+    walk.assert_not_called()
+
+
+def test_is_extracted(mocker):
+    mocker.patch('os.path.isfile', return_value=True)
+    assert Extractor.is_extracted('/data/USTR/a.txt')
+    manifest = mocker.Mock()
+    manifest.has_path.return_value = False
+    mocker.patch.object(Extractor, 'manifest', manifest)
+    assert not Extractor.is_extracted('/data/USTR/a.txt')
+
+
+def test_identical_attachment_is_not_extracted_again(mocker, tmp_path):
+    text_path = tmp_path / 'a_extracted.txt'
+    text_path.write_text('extracted')
+    manifest = mocker.Mock()
+    manifest.get.return_value = {'digest': 'abc'}
+    manifest.paths_with_digest.return_value = ['/data/b.pdf', '/data/a.pdf']
+    mocker.patch.object(Extractor, 'manifest', manifest)
+    mocker.patch('mirrcore.path_generator.PathGenerator'
+                 '.make_attachment_save_path', return_value=str(text_path))
+    saver = mocker.patch.object(Extractor, '_saver')
+    extract_pdf = mocker.patch.object(Extractor, '_extract_pdf')
+    Extractor.extract_text('/data/b.pdf', '/data/b_extracted.txt')
+    extract_pdf.assert_not_called()
+    saver().save_text.assert_called_once_with('/data/b_extracted.txt',
+                                              'extracted')
+
+
+def test_identical_attachment_outside_layout_is_skipped(mocker, tmp_path):
+    text_path = tmp_path / 'a_extracted.txt'
+    text_path.write_text('extracted')
+    manifest = mocker.Mock()
+    manifest.get.return_value = {'digest': 'abc'}
+    manifest.paths_with_digest.return_value = ['/data/blobs/ab/abc',
+                                               '/data/a.pdf']
+    mocker.patch.object(Extractor, 'manifest', manifest)
+    mocker.patch('mirrcore.path_generator.PathGenerator'
+                 '.make_attachment_save_path',
+                 side_effect=[ValueError('not an attachment path'),
+                              str(text_path)])
+    saver = mocker.patch.object(Extractor, '_saver')
+    assert Extractor.copy_identical_extraction('/data/b.pdf',
+                                               '/data/b_extracted.txt')
+    saver().save_text.assert_called_once_with('/data/b_extracted.txt',
+                                              'extracted')
+
+
+def test_attachment_without_digest_is_extracted(mocker):
+    manifest = mocker.Mock()
+    manifest.get.return_value = {'digest': None}
+    mocker.patch.object(Extractor, 'manifest', manifest)
+    extract_pdf = mocker.patch.object(Extractor, '_extract_pdf')
+    Extractor.extract_text('/data/b.pdf', '/data/b_extracted.txt')
+    extract_pdf.assert_called_once()
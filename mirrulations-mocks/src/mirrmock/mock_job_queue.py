@@ -3,10 +3,19 @@ class MockJobQueue:
 
     def __init__(self):
         self.jobs = []
+        self.prefetch_count = None
+        self.leased = []
+        self.completed = []
+        self.failed = []
+        self.retried = []
 
     def add_job(self, job):
         self.jobs.append(job)
 
+    def add_jobs(self, jobs):
+        self.jobs.extend(jobs)
+        return jobs
+
     def get_num_jobs(self):
         return len(self.jobs)
 
@@ -15,3 +24,19 @@ class MockJobQueue:
 
     def decrement_count(self, job):
         return self.jobs.pop(0)
+
+    def lease_job(self, client_id):
+        if not self.jobs:
+            return None
+        job = self.jobs.pop(0)
+        self.leased.append((job, client_id))
+        return job
+
+    def complete_job(self, job, attachments=0, pdf_attachments=0):
+        self.completed.append((job, attachments, pdf_attachments))
+
+    def fail_job(self, job):
+        self.failed.append(job)
+
+    def retry_job(self, job):
+        self.retried.append(job)
@@ -1,13 +1,39 @@
+# pylint: disable=unused-argument
 class MockRabbit:
 
     def __init__(self):
         self.jobs = []
+        # Jobs taken without being acknowledged, by delivery tag
+        self.unacked = {}
+        self.delivery_tag = 0
 
     def add(self, job):
         self.jobs.append(job)
 
+    def add_batch(self, jobs):
+        self.jobs.extend(jobs)
+
     def size(self):
         return len(self.jobs)
 
     def get(self):
-        return self.jobs.pop(0)
+        return self.jobs.pop(0) if self.jobs else None
+
+    def consume(self, inactivity_timeout=1):
+        return self.jobs.pop(0) if self.jobs else None
+
+    def get_unacked(self):
+        if not self.jobs:
+            return None
+        self.delivery_tag += 1
+        self.unacked[self.delivery_tag] = self.jobs.pop(0)
+        return self.unacked[self.delivery_tag], self.delivery_tag
+
+    def consume_unacked(self, inactivity_timeout=1):
+        return self.get_unacked()
+
+    def ack(self, delivery_tag):
+        del self.unacked[delivery_tag]
+
+    def requeue(self, delivery_tag):
+        self.jobs.insert(0, self.unacked.pop(delivery_tag))
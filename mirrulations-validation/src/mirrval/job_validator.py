@@ -7,14 +7,18 @@ from dotenv import load_dotenv
 from mirrgen.search_iterator import SearchIterator
 from mirrcore.regulations_api import RegulationsAPI
 from mirrcore.path_generator import PathGenerator
+from mirrcore.rate_limiter import RateLimiter
+from mirrcore.redis_check import load_redis
+from mirrcore.manifest import load_manifest
 
 
 class Validator:
 
-    def __init__(self, api, path_gen):
+    def __init__(self, api, path_gen, manifest=None):
         self.api = api
         self.path_gen = path_gen
         self.unfound_jobs = {}
+        self.manifest = manifest
 
     def download(self, endpoint):
         beginning_timestamp = '1990-01-01 00:00:00'
@@ -24,7 +28,7 @@ class Validator:
                 continue
             for res in result['data']:
                 job_path = self.path_gen.get_path({'data': res})
-                if_path_exist = os.path.exists(('/data/data'+job_path).strip())
+                if_path_exist = self.path_exists(job_path)
                 if not if_path_exist:
                     print(f"{res['id']} not in database, writing to file")
                     write_unfound_jobs(res, self.unfound_jobs)
@@ -34,6 +38,11 @@ class Validator:
             print(f'Jobs not found in database: {counter["Not_in_db"]}')
             print(f'Total jobs validated: {counter["Total_validated"]}')
 
+    def path_exists(self, job_path):
+        if self.manifest is not None:
+            return self.manifest.has_path(job_path)
+        return os.path.exists(('/data/data'+job_path).strip())
+
 
 def write_unfound_jobs(res, unfound_jobs):
     if f"missing_{res['type']}" not in unfound_jobs:
@@ -58,17 +67,16 @@ def check_for_missing_jobs(res):
 
 
 def generate_work(collection=None):
-    # commented out for static analysis reasons since
-    # the variable 'database' isn't being used.
-    # database = load_redis()
+    database = load_redis()
 
     # Get API key
     load_dotenv()
     api_key = os.getenv("API_KEY")
-    api = RegulationsAPI(api_key)
+    api = RegulationsAPI(api_key, RateLimiter(database, api_key))
     path_gen = PathGenerator()
     # Download using validator
-    generator = Validator(api, path_gen)
+    # The validator mounts the data at /data/data
+    generator = Validator(api, path_gen, load_manifest('/data/data'))
     if not collection:
         generator.download('dockets')
         generator.download('documents')
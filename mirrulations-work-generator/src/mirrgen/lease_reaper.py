@@ -0,0 +1,31 @@
+import time
+from mirrcore.job_queue import JobQueue
+from mirrcore.job_queue_exceptions import JobQueueException
+from mirrcore.redis_check import load_redis
+
+# Seconds between looks for jobs whose lease has expired
+REAP_INTERVAL = 60
+
+
+def reap(job_queue):
+    """
+    Puts the jobs whose lease has expired back in the queue, so a job
+    taken by a client that crashed is done by another client within
+    minutes instead of waiting for the validator.
+    @return the number of jobs put back in the queue
+    """
+    try:
+        jobs = job_queue.reap_expired_leases()
+    except JobQueueException:
+        print("FAILURE: Error occurred when requeueing jobs.")
+        return 0
+    if jobs:
+        print(f'Queued {len(jobs)} jobs with expired leases again')
+    return len(jobs)
+
+
+if __name__ == '__main__':
+    queue = JobQueue(load_redis())
+    while True:
+        reap(queue)
+        time.sleep(REAP_INTERVAL)
@@ -1,9 +1,10 @@
 import os
 from collections import Counter
+from mirrcore.manifest import DATA_ROOT
 from mirrcore.path_generator import PathGenerator
 
 
-def result_exists(search_element):
+def result_exists(search_element, manifest=None):
     path_generator = PathGenerator()
     # We are checking search results, but the PathGenerator expects
     # the actual data of a docket, document, or comment JSON.
@@ -12,32 +13,58 @@ def result_exists(search_element):
     # wrap the search result in a data field and then use the PathGenerator.
     fake_result = {'data': search_element}
     the_path = path_generator.get_path(fake_result)
-    return os.path.exists(the_path)
+    return path_exists(the_path, manifest)
+
+
+def path_exists(path, manifest=None):
+    """
+    Returns whether a path made by the PathGenerator, which is relative
+    to the data directory, Ex: /USTR/..., has been saved.
+    """
+    if manifest is not None:
+        return manifest.has_path(path)
+    return os.path.exists(f'{DATA_ROOT}{path}')
 
 
 class ResultsProcessor:
 
-    def __init__(self, job_queue):
+    def __init__(self, job_queue, manifest=None):
         self.job_queue = job_queue
+        # Answers path_exists without touching the file system
+        self.manifest = manifest
+        self.path_generator = PathGenerator()
 
     def process_results(self, results_dict):
         counts = Counter()
-        for item in results_dict['data']:
-            if not result_exists(item):
-                # sets url and job_type
-                url = item['links']['self']
-                job_type = item['type']
-                if job_type == 'comments':
-                    # updates the url and job_type
-                    url = url + '?include=attachments'
-                # adds current job to jobs_waiting_queue
-                self.job_queue.add_job(url, job_type)
-                counts[job_type] += 1
+        jobs = []
+        # The paths of the whole page are made in one pass
+        paths = self.path_generator.get_paths(results_dict['data'])
+        for item, path in zip(results_dict['data'], paths):
+            if not path_exists(path, self.manifest):
+                jobs.append(make_job(item))
             else:
                 counts['preexisting'] += 1
+        # adds the page's jobs to jobs_waiting_queue in one batch, less
+        # those that were queued before
+        added = self.job_queue.add_jobs(jobs)
+        counts.update(job['job_type'] for job in added)
+        if len(added) < len(jobs):
+            counts['duplicate'] = len(jobs) - len(added)
         print_report(counts)
 
 
+def make_job(item):
+    # sets url and job_type
+    url = item['links']['self']
+    job_type = item['type']
+    if job_type == 'comments':
+        # updates the url and job_type
+        url = url + '?include=attachments'
+    attributes = item.get('attributes', {})
+    return {'url': url, 'job_type': job_type,
+            'last_modified': attributes.get('lastModifiedDate')}
+
+
 def print_report(counts):
     # join counts into a single string
     report = ', '.join([f'{key}: {counts[key]}' for key in counts])
@@ -9,14 +9,16 @@ from mirrcore.job_queue_exceptions import JobQueueException
 from mirrcore.redis_check import load_redis
 from mirrcore.data_counts import DataCounts, DataNotFoundException
 from mirrcore.jobs_statistics import JobStatistics
+from mirrcore.rate_limiter import RateLimiter
+from mirrcore.manifest import load_manifest
 
 
 class WorkGenerator:
 
-    def __init__(self, job_queue, api):
+    def __init__(self, job_queue, api, manifest=None):
         self.job_queue = job_queue
         self.api = api
-        self.processor = ResultsProcessor(job_queue)
+        self.processor = ResultsProcessor(job_queue, manifest)
 
     def download(self, endpoint):
         # Gets the timestamp of the last known job in queue
@@ -40,15 +42,18 @@ if __name__ == '__main__':
         # Gets an API key
         dotenv.load_dotenv()
         api_key = os.getenv('API_KEY')
-        api = RegulationsAPI(api_key)
-
         database = load_redis()
+        # Shared with every other process using the same API key
+        rate_limiter = RateLimiter(database, api_key)
+        api = RegulationsAPI(api_key, rate_limiter)
 
         job_queue = JobQueue(database)
 
-        generator = WorkGenerator(job_queue, api)
+        # None until the manifest has been built, then existing results
+        # are looked up in it
+        generator = WorkGenerator(job_queue, api, load_manifest())
 
-        update_data_counts(api_key, database)
+        update_data_counts(api_key, database, rate_limiter)
 
         # Download dockets, documents, and comments
         # from all jobs in the job queue
@@ -62,12 +67,13 @@ if __name__ == '__main__':
         generator.download('comments')
         print('End generate comment jobs')
 
-    def update_data_counts(api_key, database):
+    def update_data_counts(api_key, database, rate_limiter):
         # Save the total number of docket, document, and comment
         # entries in Regulations.gov
         job_stats = JobStatistics(database)
         try:
-            regulations_data_counts = DataCounts(api_key).get_counts()
+            regulations_data_counts = DataCounts(api_key,
+                                                 rate_limiter).get_counts()
             job_stats.set_regulations_data(regulations_data_counts)
         except DataNotFoundException:
             print("Error occurred when getting data counts.")
@@ -0,0 +1,24 @@
+from mirrcore.job_queue_exceptions import JobQueueException
+from mirrgen.lease_reaper import reap
+
+
+def test_reap_queues_expired_jobs_again(mocker, capsys):
+    job_queue = mocker.Mock()
+    job_queue.reap_expired_leases.return_value = [{'job_id': 2}]
+    assert reap(job_queue) == 1
+    assert capsys.readouterr().out == \
+        'Queued 1 jobs with expired leases again\n'
+
+
+def test_reap_with_no_expired_jobs(mocker, capsys):
+    job_queue = mocker.Mock()
+    job_queue.reap_expired_leases.return_value = []
+    assert reap(job_queue) == 0
+    assert capsys.readouterr().out == ''
+
+
+def test_reap_survives_queue_errors(mocker, capsys):
+    job_queue = mocker.Mock()
+    job_queue.reap_expired_leases.side_effect = JobQueueException()
+    assert reap(job_queue) == 0
+    assert 'FAILURE' in capsys.readouterr().out
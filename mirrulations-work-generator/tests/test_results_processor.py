@@ -39,3 +39,66 @@ def test_print_counts(capsys):
     print_report({'docket': 250})
     captured = capsys.readouterr()
     assert captured.out == 'Added docket: 250\n'
+
+
+def test_existing_results_are_looked_up_in_manifest(mocker):
+    queue = JobQueue(FakeRedis())
+    queue.rabbitmq = MockRabbit()
+    manifest = mocker.Mock()
+    manifest.has_path.return_value = True
+    processor = ResultsProcessor(queue, manifest)
+    results = MockDataSet(1, job_type='dockets').get_results()
+    processor.process_results(json.loads(results[0]['text']))
+    manifest.has_path.assert_called_once()
+    assert queue.get_num_jobs() == 0
+
+
+def test_page_paths_are_made_in_one_pass(mocker):
+    queue = JobQueue(FakeRedis())
+    queue.rabbitmq = MockRabbit()
+    manifest = mocker.Mock()
+    manifest.has_path.return_value = True
+    processor = ResultsProcessor(queue, manifest)
+    get_paths = mocker.spy(processor.path_generator, 'get_paths')
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    with open(f'{dir_path}/data/dockets_listing.json',
+              encoding='utf8') as listings:
+        processor.process_results(json.load(listings))
+    get_paths.assert_called_once()
+    assert manifest.has_path.call_count == 10
+
+
+def test_page_jobs_are_added_in_one_batch(mocker):
+    queue = JobQueue(FakeRedis())
+    queue.rabbitmq = MockRabbit()
+    add_jobs = mocker.spy(queue, 'add_jobs')
+    processor = ResultsProcessor(queue)
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    with open(f'{dir_path}/data/dockets_listing.json',
+              encoding='utf8') as listings:
+        processor.process_results(json.load(listings))
+    add_jobs.assert_called_once()
+    assert len(add_jobs.call_args.args[0]) == 10
+
+
+def test_existing_results_are_looked_up_under_data_root(mocker):
+    exists = mocker.patch('os.path.exists', return_value=True)
+    queue = JobQueue(FakeRedis())
+    queue.rabbitmq = MockRabbit()
+    results = MockDataSet(1, job_type='dockets').get_results()
+    ResultsProcessor(queue).process_results(json.loads(results[0]['text']))
+    assert exists.call_args.args[0].startswith('/data/')
+    assert queue.get_num_jobs() == 0
+
+
+def test_results_queued_before_are_not_queued_again(capsys):
+    queue = JobQueue(FakeRedis())
+    queue.rabbitmq = MockRabbit()
+    processor = ResultsProcessor(queue)
+    results = json.loads(MockDataSet(3, job_type='dockets')
+                         .get_results()[0]['text'])
+    processor.process_results(results)
+    processor.process_results(results)
+    assert queue.get_num_jobs() == 3
+    assert capsys.readouterr().out == \
+        'Added dockets: 3\nAdded duplicate: 3\n'
@@ -76,9 +76,9 @@ def test_work_generator_catches_job_queue_exception(requests_mock, mocker):
     job_queue.rabbitmq = MockRabbit()
 
     # mock the job queue to raise a JobQueueException when a job is added.
-    # Essentially replaces the original add_job method of the job_queue object
-    # with a new method that raises the JobQueueException exception
-    mocker.patch.object(job_queue, 'add_job', side_effect=JobQueueException())
+    # Essentially replaces the original add_jobs method of the job_queue
+    # object with a new method that raises the JobQueueException exception
+    mocker.patch.object(job_queue, 'add_jobs', side_effect=JobQueueException())
 
     generator = WorkGenerator(job_queue, api)
 